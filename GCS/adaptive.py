@@ -0,0 +1,145 @@
+"""
+Latency-driven inference scheduling.
+
+AdaptiveScheduler measures the per-frame inference cost and the end-to-end latency of
+published frames, and adjusts two knobs to hold a latency budget:
+
+ - stride: run inference on every Nth frame
+ - size:   the long side (in pixels) frames are resized to before inference
+
+When the smoothed latency exceeds the target, the scheduler first shrinks the
+input size down to `min_size`, then raises the stride. When latency is well below
+target (hysteresis band) it undoes those steps in reverse order. Changes are at
+most one step per `adapt_interval` seconds so the effect of a step is measured
+before the next one.
+
+Frames that skip inference reuse the last detections (see carry_forward), so the
+overlay does not flicker while the stride is above 1.
+"""
+
+import threading
+import time
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Downscaled width used to estimate global motion between frames
+MOTION_WIDTH = 160
+
+
+class AdaptiveScheduler:
+    """
+    Args:
+        target_latency_ms (float): end-to-end latency budget to hold.
+        sizes (Sequence[int]): allowed inference sizes, ascending (multiples of 32).
+        initial_size (int), initial_stride (int): starting point.
+        min_size (int): never shrink below this size before raising the stride.
+        min_stride (int), max_stride (int): bounds for the stride.
+        enabled (bool): when False the initial size and stride are kept fixed.
+    """
+
+    def __init__(self, target_latency_ms: float = 150.0, sizes: Sequence[int] = (320, 416, 512, 640),
+                 initial_size: int = 640, initial_stride: int = 1, min_size: int = 416,
+                 min_stride: int = 1, max_stride: int = 6, adapt_interval: float = 1.0, alpha: float = 0.2,
+                 enabled: bool = True):
+        self.target_latency_ms = target_latency_ms
+        self.sizes = sorted(sizes)
+        self.min_size = min_size
+        self.min_stride = max(1, int(min_stride))
+        self.max_stride = max(self.min_stride, int(max_stride))
+        self.adapt_interval = adapt_interval
+        self.alpha = alpha
+        self.enabled = enabled
+
+        self.size = initial_size
+        self.stride = min(self.max_stride, max(self.min_stride, int(initial_stride)))
+        self.latency_ms: Optional[float] = None
+        self.infer_ms_per_frame: Optional[float] = None
+        self.adjustments = 0
+        self._last_adapt = time.time()
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------
+    # DECISIONS (read by pipeline stages)
+    # ---------------------------------------------
+    def should_infer(self, seq: int) -> bool:
+        return seq % self.stride == 0
+
+    # ---------------------------------------------
+    # MEASUREMENTS
+    # ---------------------------------------------
+    def _ema(self, current: Optional[float], sample: float) -> float:
+        return sample if current is None else current + self.alpha * (sample - current)
+
+    def record_inference(self, elapsed_ms: float, frames: int):
+        if frames <= 0:
+            return
+        with self._lock:
+            self.infer_ms_per_frame = self._ema(self.infer_ms_per_frame, elapsed_ms / frames)
+
+    def record_latency(self, latency_ms: float):
+        with self._lock:
+            self.latency_ms = self._ema(self.latency_ms, latency_ms)
+            if self.enabled:
+                self._adapt()
+
+    # ---------------------------------------------
+    # CONTROL
+    # ---------------------------------------------
+    def _adapt(self):
+        now = time.time()
+        if now - self._last_adapt < self.adapt_interval or self.latency_ms is None:
+            return
+        before = (self.size, self.stride)
+        if self.latency_ms > self.target_latency_ms:
+            smaller = [s for s in self.sizes if self.min_size <= s < self.size]
+            if smaller:
+                self.size = smaller[-1]
+            elif self.stride < self.max_stride:
+                self.stride += 1
+        elif self.latency_ms < 0.6 * self.target_latency_ms:
+            larger = [s for s in self.sizes if s > self.size]
+            if self.stride > self.min_stride:
+                self.stride -= 1
+            elif larger:
+                self.size = larger[0]
+        if (self.size, self.stride) != before:
+            self.adjustments += 1
+            self._last_adapt = now
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'target_latency_ms': self.target_latency_ms,
+            'latency_ms': None if self.latency_ms is None else round(self.latency_ms, 1),
+            'infer_ms_per_frame': None if self.infer_ms_per_frame is None else round(self.infer_ms_per_frame, 1),
+            'inference_size': self.size,
+            'inference_stride': self.stride,
+            'adjustments': self.adjustments,
+        }
+
+
+def motion_thumbnail(y_plane: np.ndarray) -> np.ndarray:
+    """Small float32 luma image used by estimate_shift; cheap enough to compute for every frame."""
+    h, w = y_plane.shape[:2]
+    th = max(1, int(h * MOTION_WIDTH / w))
+    return cv2.resize(y_plane, (MOTION_WIDTH, th), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+def estimate_shift(prev_thumb: np.ndarray, thumb: np.ndarray, full_width: int) -> Tuple[float, float]:
+    """Global (dx, dy) translation from prev_thumb to thumb, in full-frame pixels."""
+    (dx, dy), response = cv2.phaseCorrelate(prev_thumb, thumb)
+    if response < 0.1:
+        # no reliable peak (e.g. large scene change); don't move boxes
+        return 0.0, 0.0
+    factor = full_width / float(prev_thumb.shape[1])
+    return dx * factor, dy * factor
+
+
+def carry_forward(dets: np.ndarray, shift: Tuple[float, float] = (0.0, 0.0)) -> np.ndarray:
+    """Copy of a DETECTION_DTYPE array with every box translated by shift."""
+    out = dets.copy()
+    if len(out) and shift != (0.0, 0.0):
+        out['box'] += np.array([shift[0], shift[1], shift[0], shift[1]], dtype=np.float32)
+    return out
@@ -0,0 +1,366 @@
+"""
+Offline person detection over recorded video, spread across a process pool.
+
+Inputs are video files or directories of them, e.g. a stream's recordings
+directory (see recorder.py). Each input is split at keyframes into chunks of about
+--chunk-seconds, so every chunk decodes on its own. Recorded segments are split
+from their .idx keyframe index; other files by one demux pass (no decoding). The
+chunks go to a ProcessPoolExecutor. Each worker loads the model once (see
+yolo_inference.py), decodes its chunk, and runs detect_batch on --batch frames at a
+time. Each worker gets cores / workers inference threads (torch and the ONNX Runtime /
+OpenVINO session), so the processes do not fight over the CPU.
+
+Per input, finished chunks are checkpointed as <out>/<name>.parts/NNNNN.npz, next to
+the chunk plan (plan.json). Rerunning the same command skips finished chunks, so an
+interrupted run resumes where it stopped. Once all chunks of an input are done,
+they are merged into one columnar file <out>/<name>.npz:
+
+    pts, time           per frame: PTS in stream time base, and wall-clock time for
+                        recorded segments (NaN for other files)
+    first, count        per frame: its rows in the box columns
+    box, conf, cls      per detection: x1, y1, x2, y2 in frame pixels, confidence, class
+    time_base           the stream time base as (numerator, denominator)
+
+Progress lines report frames/s per worker (frames / busy seconds) and overall.
+
+Run with:
+    python GCS/batch_detect.py GCS/recordings/drone1 --out results
+    python GCS/batch_detect.py mission.mp4 --out results --workers 8 --imgsz 640 --every 2
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from fractions import Fraction
+from itertools import chain
+
+import av
+import numpy as np
+
+from recorder import read_index
+
+VIDEO_EXTENSIONS = ('.ts', '.mp4', '.mkv', '.mov', '.avi')
+CHUNK_SECONDS = 60.0
+INFERENCE_BATCH = 8
+# seek this far before a chunk start (seconds) when a seek lands past it
+_SEEK_MARGINS = (0.0, 2.0, 10.0)
+
+# per-process worker state, set by _init_worker
+_worker = {}
+
+
+# ---------------------------------------------
+# PLANNING (main process)
+# ---------------------------------------------
+def find_inputs(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files += [os.path.join(root, n) for n in sorted(names) if n.lower().endswith(VIDEO_EXTENSIONS)]
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"[Batch] Skipping {path}: not found")
+    return files
+
+
+def output_names(files):
+    """A unique output name per input: the file name, prefixed with its directory where needed."""
+    stems = [os.path.splitext(os.path.basename(f))[0] for f in files]
+    names = []
+    for path, stem in zip(files, stems):
+        if stems.count(stem) > 1:
+            stem = f"{os.path.basename(os.path.dirname(os.path.abspath(path)))}-{stem}"
+        names.append(stem)
+    return names
+
+
+def _keyframes(path):
+    """(keyframe PTS list, time base, [(pts, wall time), ...] anchors or None) of a video file."""
+    index_path = os.path.splitext(path)[0] + '.idx'
+    if path.endswith('.ts') and os.path.exists(index_path):
+        # a recorded segment: keyframes and their arrival times are in the index (90 kHz PTS)
+        index = read_index(index_path)
+        anchors = [(pts, t) for _, t, pts in index['keyframes'] if pts is not None]
+        return [pts for pts, _ in anchors], Fraction(1, 90000), anchors
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        keyframes = [packet.pts for packet in container.demux(stream)
+                     if packet.is_keyframe and packet.pts is not None]
+        return sorted(keyframes), stream.time_base, None
+
+
+def plan_chunks(keyframes, time_base, chunk_seconds):
+    """[(start_pts, end_pts), ...] cut at keyframes; None means the start / end of the file."""
+    step = int(chunk_seconds / time_base)
+    chunks = []
+    start = None
+    for pts in keyframes:
+        if start is None and not chunks:
+            # the first chunk also covers any frames before the first keyframe
+            chunks.append([None, None])
+            start = pts
+        elif pts - start >= step:
+            chunks[-1][1] = pts
+            chunks.append([pts, None])
+            start = pts
+    return [tuple(c) for c in chunks] or [(None, None)]
+
+
+def load_plan(path, name, out_dir, args):
+    """The chunk plan of one input, reusing the one saved by an interrupted run."""
+    parts = os.path.join(out_dir, name + '.parts')
+    plan_path = os.path.join(parts, 'plan.json')
+    settings = {'imgsz': args.imgsz, 'conf': args.conf, 'every': args.every,
+                'backend': os.environ.get('GCS_INFERENCE_BACKEND', 'torch')}
+    if os.path.exists(plan_path):
+        with open(plan_path) as f:
+            plan = json.load(f)
+        if plan['settings'] == settings and plan['size'] == os.path.getsize(path):
+            return plan
+        print(f"[Batch] {name}: input or settings changed since the last run, starting over")
+        shutil.rmtree(parts)
+
+    keyframes, time_base, anchors = _keyframes(path)
+    plan = {
+        'input': os.path.abspath(path),
+        'size': os.path.getsize(path),
+        'settings': settings,
+        'time_base': [time_base.numerator, time_base.denominator],
+        'anchors': anchors,
+        'chunks': plan_chunks(keyframes, time_base, args.chunk_seconds),
+    }
+    os.makedirs(parts, exist_ok=True)
+    tmp = plan_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(plan, f)
+    os.replace(tmp, plan_path)
+    return plan
+
+
+# ---------------------------------------------
+# WORKERS
+# ---------------------------------------------
+def _init_worker(imgsz, threads, conf, batch, load_lock):
+    # Ctrl-C is handled by the main process, which lets running chunks finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import cv2
+    import torch
+
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+    import yolo_inference
+
+    # one load at a time, so a backend export into the model cache happens only once
+    with load_lock:
+        yolo_inference.load_model(imgsz, log=lambda msg: print(f"[Worker {os.getpid()}] {msg}"),
+                                  threads=threads)
+    _worker.update(imgsz=imgsz, conf=conf, batch=batch, threads=threads, detect=yolo_inference)
+
+
+def _decode(path, start, end, every):
+    """Yields (pts, BGR image) for every n-th frame with start <= pts < end."""
+    for margin in _SEEK_MARGINS:
+        with av.open(path) as container:
+            stream = container.streams.video[0]
+            stream.thread_type = 'AUTO'
+            stream.codec_context.thread_count = _worker['threads']
+            if start is not None:
+                container.seek(max(start - int(margin / stream.time_base), 0), stream=stream, backward=True)
+            frames = (f for f in container.decode(stream) if f.pts is not None)
+            first = next(frames, None)
+            if first is None:
+                return
+            if start is not None and first.pts > start and margin != _SEEK_MARGINS[-1]:
+                # the seek landed after the chunk start: retry from further back
+                continue
+            index = 0
+            for frame in chain([first], frames):
+                if start is not None and frame.pts < start:
+                    continue
+                if end is not None and frame.pts >= end:
+                    return
+                if index % every == 0:
+                    yield frame.pts, frame.to_ndarray(format='bgr24')
+                index += 1
+            return
+
+
+def _process_chunk(path, start, end, every, out_path):
+    detect = _worker['detect']
+    if not detect.is_ready():
+        raise RuntimeError(f"model not loaded: {detect.model_status().get('error')}")
+    started = time.perf_counter()
+    pts, counts, dets, batch = [], [], [], []
+    decode_errors = 0
+
+    def flush():
+        for (p, _), d in zip(batch, detect.detect_batch([img for _, img in batch], _worker['imgsz'], _worker['conf'])):
+            pts.append(p)
+            counts.append(len(d))
+            dets.append(d)
+        batch.clear()
+
+    try:
+        for item in _decode(path, start, end, every):
+            batch.append(item)
+            if len(batch) >= _worker['batch']:
+                flush()
+    except av.error.FFmpegError as e:
+        # a damaged or truncated file: keep what decoded
+        decode_errors += 1
+        print(f"[Worker {os.getpid()}] Decode error in {path} at {start}: {e}")
+    if batch:
+        flush()
+
+    boxes = np.concatenate(dets) if dets else detect.empty_detections()
+    counts = np.array(counts, dtype=np.int64)
+    tmp = out_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, pts=np.array(pts, dtype=np.int64), count=counts,
+                 box=boxes['box'], conf=boxes['conf'], cls=boxes['cls'])
+    os.replace(tmp, out_path)
+    return {'worker': os.getpid(), 'frames': len(pts), 'seconds': time.perf_counter() - started, 'decode_errors': decode_errors}
+
+
+# ---------------------------------------------
+# MERGING (main process)
+# ---------------------------------------------
+def merge(plan, parts, out_path):
+    columns = {k: [] for k in ('pts', 'count', 'box', 'conf', 'cls')}
+    for i in range(len(plan['chunks'])):
+        with np.load(os.path.join(parts, f"{i:05d}.npz")) as chunk:
+            for k in columns:
+                columns[k].append(chunk[k])
+    merged = {k: np.concatenate(v) for k, v in columns.items()}
+    count = merged.pop('count')
+    first = np.cumsum(count) - count
+
+    times = np.full(len(merged['pts']), np.nan)
+    anchors = plan['anchors']
+    if anchors:
+        # wall time of the frame = arrival of the keyframe before it + PTS difference
+        anchor_pts, anchor_times = np.array(anchors).T
+        k = np.maximum(np.searchsorted(anchor_pts, merged['pts'], side='right') - 1, 0)
+        times = anchor_times[k] + (merged['pts'] - anchor_pts[k]) * plan['time_base'][0] / plan['time_base'][1]
+
+    tmp = out_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, time=times, first=first, count=count, time_base=np.array(plan['time_base']), **merged)
+    os.replace(tmp, out_path)
+    return len(count), int(count.sum())
+
+
+# ---------------------------------------------
+# MAIN
+# ---------------------------------------------
+def report(workers, started, done, total):
+    elapsed = time.time() - started
+    frames = sum(w['frames'] for w in workers.values())
+    per_worker = ', '.join(f"{pid}: {w['frames'] / w['seconds']:.1f}" for pid, w in sorted(workers.items()) if w['seconds'])
+    print(f"[Batch] {done}/{total} chunks, {frames} frames, {frames / max(elapsed, 1e-9):.1f} frames/s "
+          f"(per worker: {per_worker})")
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='video files or directories (e.g. GCS/recordings/drone1)')
+    parser.add_argument('--out', required=True, help='output directory')
+    parser.add_argument('--workers', type=int, default=max(1, cpus // 2))
+    parser.add_argument('--threads', type=int, help='inference threads per worker (default: cores / workers)')
+    parser.add_argument('--chunk-seconds', type=float, default=CHUNK_SECONDS)
+    parser.add_argument('--batch', type=int, default=INFERENCE_BATCH, help='frames per model call')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--conf', type=float, default=0.2)
+    parser.add_argument('--every', type=int, default=1, help='process every n-th frame of each chunk')
+    parser.add_argument('--backend', help='inference backend (sets GCS_INFERENCE_BACKEND, see yolo_inference.py)')
+    parser.add_argument('--force', action='store_true', help='redo inputs that already have a result')
+    args = parser.parse_args()
+    if args.backend:
+        os.environ['GCS_INFERENCE_BACKEND'] = args.backend
+    threads = args.threads or max(1, cpus // args.workers)
+    os.makedirs(args.out, exist_ok=True)
+
+    files = find_inputs(args.inputs)
+    tasks, plans, remaining = [], {}, {}
+    for path, name in zip(files, output_names(files)):
+        out_path = os.path.join(args.out, name + '.npz')
+        parts = os.path.join(args.out, name + '.parts')
+        if os.path.exists(out_path) and not args.force:
+            print(f"[Batch] {name}: done already ({out_path})")
+            continue
+        try:
+            plan = load_plan(path, name, args.out, args)
+        except (OSError, av.error.FFmpegError, IndexError) as e:
+            print(f"[Batch] Skipping {path}: {e}")
+            continue
+        plans[name] = (plan, parts, out_path)
+        todo = [i for i in range(len(plan['chunks'])) if not os.path.exists(os.path.join(parts, f"{i:05d}.npz"))]
+        remaining[name] = len(todo)
+        tasks += [(name, i) for i in todo]
+        print(f"[Batch] {name}: {len(plan['chunks'])} chunks, {len(plan['chunks']) - len(todo)} done before")
+
+    total = len(tasks)
+    print(f"[Batch] {total} chunks to process with {args.workers} workers x {threads} threads")
+    workers = {}
+    started = time.time()
+
+    def finish(name):
+        plan, parts, out_path = plans[name]
+        frames, boxes = merge(plan, parts, out_path)
+        shutil.rmtree(parts)
+        print(f"[Batch] {name}: {frames} frames, {boxes} detections -> {out_path}")
+
+    for name, count in remaining.items():
+        if count == 0:
+            finish(name)
+
+    ctx = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=_init_worker,
+                                   initargs=(args.imgsz, threads, args.conf, args.batch, ctx.Lock()))
+    try:
+        pending = {}
+        for name, i in tasks:
+            plan, parts, _ = plans[name]
+            start, end = plan['chunks'][i]
+            future = executor.submit(_process_chunk, plan['input'], start, end, args.every,
+                                     os.path.join(parts, f"{i:05d}.npz"))
+            pending[future] = name
+        done = decode_errors = 0
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = pending.pop(future)
+                result = future.result()
+                w = workers.setdefault(result['worker'], {'frames': 0, 'seconds': 0.0})
+                w['frames'] += result['frames']
+                w['seconds'] += result['seconds']
+                decode_errors += result['decode_errors']
+                done += 1
+                remaining[name] -= 1
+                if remaining[name] == 0:
+                    finish(name)
+            report(workers, started, done, total)
+    except KeyboardInterrupt:
+        print("[Batch] Interrupted; finishing the running chunks (run the same command again to resume)")
+        executor.shutdown(cancel_futures=True)
+        sys.exit(130)
+    except Exception as e:
+        executor.shutdown(wait=False, cancel_futures=True)
+        print(f"[Batch] Failed: {e}")
+        sys.exit(1)
+    executor.shutdown()
+    if decode_errors:
+        print(f"[Batch] {decode_errors} chunk(s) ended early on decode errors; their results hold the frames before the error")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Parity and throughput check for the inference backends in inference_backends.py.
+
+For every backend it:
+ - runs the same images through PyTorch ('torch', the reference) and the backend,
+   and matches detections (all classes) by class and IoU. It reports recall of the
+   reference boxes, mean IoU of the matches, the largest confidence difference, and
+   how many extra boxes the backend produced. FP32 backends should reach ~100% recall
+   with IoU ~1.0. INT8 is expected to drift a little (see PARITY_MIN_RECALL).
+ - measures throughput at each batch size, after a warm-up.
+
+The first run per backend/size includes the one-off export into the model cache.
+Load times are printed separately and are not part of the throughput numbers.
+
+Needs ultralytics (plus onnxruntime / openvino for those backends). Run with:
+    python GCS/benchmarks/bench_backends.py --backends onnx openvino openvino-int8
+    python GCS/benchmarks/bench_backends.py --images path/to/frames --imgsz 416 --batch 1 4
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from detections import extract_detections  # noqa: E402
+from inference_backends import BACKENDS, DetectorBackend  # noqa: E402
+from tracker import greedy_match, iou_matrix  # noqa: E402
+
+MATCH_IOU = 0.5
+CONF_THRESH = 0.25
+# minimum share of reference boxes a backend must reproduce
+PARITY_MIN_RECALL = {'onnx': 0.98, 'openvino': 0.98, 'openvino-int8': 0.85}
+
+
+def load_images(folder):
+    if folder:
+        paths = sorted(p for p in Path(folder).iterdir() if p.suffix.lower() in ('.jpg', '.jpeg', '.png'))
+    else:
+        from ultralytics.utils import ASSETS
+        paths = sorted(Path(ASSETS).glob('*.jpg'))
+    images = [cv2.imread(str(p)) for p in paths]
+    return [img for img in images if img is not None]
+
+
+def detect(backend, images, imgsz, class_ids):
+    results = []
+    for img in images:
+        results.extend(backend.predict([img], imgsz, CONF_THRESH))
+    return [extract_detections(r, class_ids, CONF_THRESH) for r in results]
+
+
+def compare(ref_dets, dets):
+    """Aggregated parity figures over a list of per-image (reference, candidate) detections."""
+    total, matched, extra, ious, conf_diff = 0, 0, 0, [], 0.0
+    for ref, cand in zip(ref_dets, dets):
+        total += len(ref)
+        iou = iou_matrix(ref['box'], cand['box'])
+        # only boxes of the same class may match
+        iou[ref['cls'][:, None] != cand['cls'][None, :]] = 0.0
+        pairs = greedy_match(iou, MATCH_IOU)
+        matched += len(pairs)
+        extra += len(cand) - len(pairs)
+        for r, c in pairs:
+            ious.append(iou[r, c])
+            conf_diff = max(conf_diff, abs(float(ref['conf'][r]) - float(cand['conf'][c])))
+    return {
+        'recall': matched / total if total else 1.0,
+        'mean_iou': float(np.mean(ious)) if ious else 0.0,
+        'max_conf_diff': conf_diff,
+        'extra': extra,
+        'reference_boxes': total,
+    }
+
+
+def throughput(backend, images, imgsz, batch, repeats):
+    frames = [images[i % len(images)] for i in range(batch)]
+    for _ in range(3):
+        backend.predict(frames, imgsz, CONF_THRESH)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        backend.predict(frames, imgsz, CONF_THRESH)
+    elapsed = time.perf_counter() - start
+    return elapsed / repeats * 1000, batch * repeats / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--weights', default='yolov8m.pt')
+    parser.add_argument('--backends', nargs='+', default=['onnx', 'openvino'], choices=BACKENDS[1:])
+    parser.add_argument('--images', help='folder of test images (default: the Ultralytics sample images)')
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--cache-dir', default='model_cache')
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        sys.exit("no test images found")
+
+    def timed_backend(name):
+        b = DetectorBackend(args.weights, name, args.cache_dir, device='cpu', export_imgsz=args.imgsz)
+        started = time.perf_counter()
+        b.model()
+        print(f"{name}: ready in {time.perf_counter() - started:.1f}s")
+        return b
+
+    reference = timed_backend('torch')
+    class_ids = np.array(sorted(reference.model().names), dtype=np.int64)
+    ref_dets = detect(reference, images, args.imgsz, class_ids)
+
+    rows = [('torch', None, reference)]
+    for name in args.backends:
+        b = timed_backend(name)
+        rows.append((name, compare(ref_dets, detect(b, images, args.imgsz, class_ids)), b))
+
+    print(f"\nparity vs torch on {len(images)} images at {args.imgsz}px (IoU >= {MATCH_IOU}, conf >= {CONF_THRESH})")
+    print(f"{'backend':>14} {'recall':>7} {'mean IoU':>9} {'max dconf':>10} {'extra':>6} {'result':>7}")
+    failed = False
+    for name, parity, _ in rows[1:]:
+        ok = parity['recall'] >= PARITY_MIN_RECALL[name]
+        failed |= not ok
+        print(f"{name:>14} {parity['recall']:>7.1%} {parity['mean_iou']:>9.3f} {parity['max_conf_diff']:>10.3f} "
+              f"{parity['extra']:>6} {'ok' if ok else 'FAIL':>7}")
+
+    print(f"\nthroughput at {args.imgsz}px, CPU ({args.repeats} batches after warm-up)")
+    print(f"{'backend':>14} {'batch':>6} {'ms/batch':>9} {'frames/s':>9} {'vs torch':>9}")
+    base = {}
+    for name, _, b in rows:
+        for batch in args.batch:
+            ms, fps = throughput(b, images, args.imgsz, batch, args.repeats)
+            base.setdefault(batch, fps)
+            print(f"{name:>14} {batch:>6} {ms:>9.1f} {fps:>9.1f} {fps / base[batch]:>8.2f}x")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Micro-benchmark: per-box Python post-processing vs. the vectorized path in detections.py.
+
+Compares, at 0, 10 and 200 raw detections per frame:
+ - legacy:     the old run_yolo_inference loop (int(b.cls[0]), float(x) for x in b.xyxy[0], ...)
+               followed by the old per-box rescaling loop in processing_thread
+ - vectorized: extract_detections + scale_detections
+
+Only NumPy is needed; Ultralytics `Boxes` are emulated with NumPy arrays, which is
+cheaper per element than torch tensors, so the real-world gain is larger than shown.
+
+Run with:
+    python GCS/benchmarks/bench_postprocess.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from detections import class_ids_for, extract_detections, scale_detections  # noqa: E402
+
+NAMES = {0: 'person', 1: 'bicycle', 2: 'car'}
+SCALE = 0.5
+REPEATS = 2000
+
+
+class FakeBoxes:
+    """Mimics ultralytics.engine.results.Boxes: array attributes and per-row iteration."""
+
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls = cls
+
+    def __len__(self):
+        return len(self.cls)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield FakeBoxes(self.xyxy[i:i + 1], self.conf[i:i + 1], self.cls[i:i + 1])
+
+
+class FakeResult:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+
+def make_result(n, rng):
+    xy = rng.uniform(0, 600, size=(n, 2)).astype(np.float32)
+    wh = rng.uniform(10, 80, size=(n, 2)).astype(np.float32)
+    xyxy = np.concatenate([xy, xy + wh], axis=1)
+    conf = rng.uniform(0.25, 1.0, size=n).astype(np.float32)
+    cls = rng.integers(0, len(NAMES), size=n).astype(np.float32)
+    return FakeResult(FakeBoxes(xyxy, conf, cls))
+
+
+def legacy(r):
+    boxes, confidences, class_ids, class_names = [], [], [], []
+    for b in getattr(r, 'boxes', []):
+        try:
+            cls = int(b.cls[0])
+            name = NAMES[cls]
+            if name != 'person':
+                continue
+            xyxy = [float(x) for x in b.xyxy[0]]
+            conf = float(b.conf[0])
+            boxes.append(xyxy)
+            confidences.append(conf)
+            class_ids.append(cls)
+            class_names.append(name)
+        except Exception:
+            continue
+    scaled_boxes = []
+    for box in boxes:
+        scaled_boxes.append([int(box[0] / SCALE), int(box[1] / SCALE), int(box[2] / SCALE), int(box[3] / SCALE)])
+    return scaled_boxes, confidences, class_ids, class_names
+
+
+def vectorized(r, class_ids):
+    return scale_detections(extract_detections(r, class_ids, 0.2), SCALE)
+
+
+def time_per_call(fn, *args):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        fn(*args)
+    return (time.perf_counter() - start) / REPEATS * 1e6
+
+
+def main():
+    rng = np.random.default_rng(0)
+    class_ids = class_ids_for(NAMES, ('person',))
+    print(f"{'detections':>10} {'legacy us':>12} {'vectorized us':>14} {'speedup':>8}")
+    for n in (0, 10, 200):
+        r = make_result(n, rng)
+        # sanity: both paths keep the same boxes
+        assert len(legacy(r)[0]) == len(vectorized(r, class_ids))
+        t_legacy = time_per_call(legacy, r)
+        t_vec = time_per_call(vectorized, r, class_ids)
+        print(f"{n:>10} {t_legacy:>12.1f} {t_vec:>14.1f} {t_legacy / t_vec:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""
+End-to-end GCS benchmark: synthetic senders -> video_server.py -> simulated viewers.
+
+Starts one synthetic_sender.py per stream and the real server (uvicorn, pointed at the
+senders through GCS_STREAMS), waits for the model to be warm and every stream to be
+connected, attaches VIEWERS MJPEG clients to each stream, then measures for DURATION
+seconds after a WARMUP. Reported per stream:
+
+ - decode_fps, processed_fps, dropped frames (frame ring counters)
+ - inference_fps (frames the shared engine ran the detector on) and motion-gating counters
+ - per-stage latency p50/p95/p99 (the server's rolling window, see metrics.py)
+ - receiver counters, including RTP loss statistics with --transport rtp [--loss 0.02]
+ - delivery fps and bandwidth per viewer
+
+plus the server process's CPU (% of one core) and RSS, sampled every second.
+
+Results are written as JSON (--out). With --baseline, the run is compared against an
+earlier results file and the script exits with status 1 if a key metric regressed
+by more than --tolerance.
+
+Run with:
+    python GCS/benchmarks/run_benchmark.py --streams 2 --viewers 4 --duration 30 --out bench.json
+    python GCS/benchmarks/run_benchmark.py --out new.json --baseline bench.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+_GCS_DIR = os.path.abspath(os.path.join(_HERE, '..'))
+
+# (path in the results, True if higher is better) checked by --baseline
+KEY_METRICS = [
+    ('totals.decode_fps', True),
+    ('totals.inference_fps', True),
+    ('totals.delivery_fps_per_viewer', True),
+    ('totals.drop_ratio', False),
+    ('process.cpu_percent', False),
+    ('process.rss_mb_max', False),
+    ('totals.total_latency_p95_ms', False),
+]
+
+
+# ---------------------------------------------
+# PROCESSES
+# ---------------------------------------------
+def _drain(proc, log_file):
+    for line in proc.stdout:
+        log_file.write(line)
+    log_file.flush()
+
+
+def start_process(cmd, env, cwd, log_path, ready_text=None, timeout=60.0):
+    """Starts cmd with merged stdout/stderr copied to log_path; optionally waits for ready_text."""
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    log_file = open(log_path, 'w')
+    if ready_text:
+        deadline = time.time() + timeout
+        for line in proc.stdout:
+            log_file.write(line)
+            if ready_text in line:
+                break
+            if time.time() > deadline:
+                break
+        else:
+            raise RuntimeError(f"{cmd[1]} exited before becoming ready (see {log_path})")
+    threading.Thread(target=_drain, args=(proc, log_file), daemon=True).start()
+    return proc
+
+
+def stop_process(proc):
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+class ProcessSampler:
+    """CPU time and RSS of one process, via psutil when installed, else /proc (Linux)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        try:
+            import psutil
+            self._proc = psutil.Process(pid)
+        except ImportError:
+            self._proc = None
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def sample(self):
+        """(cpu seconds, rss MB) or (None, None) when unavailable."""
+        try:
+            if self._proc is not None:
+                t = self._proc.cpu_times()
+                return t.user + t.system, self._proc.memory_info().rss / 2 ** 20
+            with open(f'/proc/{self.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / self._ticks
+            with open(f'/proc/{self.pid}/status') as f:
+                rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS:')) / 1024
+            return cpu, rss
+        except Exception:
+            return None, None
+
+
+# ---------------------------------------------
+# HTTP
+# ---------------------------------------------
+def get_json(port: int, path: str, timeout: float = 5.0):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+    try:
+        conn.request('GET', path)
+        resp = conn.getresponse()
+        if resp.status != 200:
+            raise RuntimeError(f"GET {path} -> {resp.status}")
+        return json.loads(resp.read())
+    finally:
+        conn.close()
+
+
+def wait_until(predicate, timeout: float, interval: float = 0.5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if predicate():
+                return True
+        except Exception:
+            pass
+        time.sleep(interval)
+    return False
+
+
+class Viewer(threading.Thread):
+    """One MJPEG client: reads multipart parts and counts frames and bytes after `measuring` is set."""
+
+    def __init__(self, port: int, stream_id: str, stop: threading.Event, measuring: threading.Event):
+        super().__init__(daemon=True)
+        self.port = port
+        self.stream_id = stream_id
+        self.stop = stop
+        self.measuring = measuring
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+
+    def run(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        try:
+            conn.request('GET', f'/streams/{self.stream_id}/video_feed')
+            resp = conn.getresponse()
+            while not self.stop.is_set():
+                length = None
+                # part headers: boundary, Content-Type, Content-Length, blank line
+                while True:
+                    line = resp.readline()
+                    if not line:
+                        return
+                    line = line.strip()
+                    if line.lower().startswith(b'content-length:'):
+                        length = int(line.split(b':', 1)[1])
+                    elif not line and length is not None:
+                        break
+                resp.read(length + 2)
+                if self.measuring.is_set():
+                    self.frames += 1
+                    self.bytes += length
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            conn.close()
+
+
+# ---------------------------------------------
+# RESULTS
+# ---------------------------------------------
+def _delta(after: dict, before: dict, key: str) -> float:
+    return (after.get(key) or 0) - (before.get(key) or 0)
+
+
+def summarize(args, streams, before, after, engine_before, engine_after, viewers, samples, elapsed, model):
+    results = {
+        'label': args.label,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'version': _git_version(),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'config': {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+        'model': model,
+        'duration_s': round(elapsed, 2),
+        'streams': {},
+    }
+    totals = {'decode_fps': 0.0, 'processed_fps': 0.0, 'inference_fps': 0.0, 'dropped': 0, 'received': 0}
+    viewer_fps = []
+    for sid in streams:
+        b, a = before[sid], after[sid]
+        frames_b, frames_a = b['frames'], a['frames']
+        eng_b = engine_before['streams'].get(sid, {})
+        eng_a = engine_after['streams'].get(sid, {})
+        decoded = _delta(frames_a, frames_b, 'frames_written')
+        dropped = _delta(frames_a, frames_b, 'frames_dropped')
+        inferred = _delta(eng_a, eng_b, 'frames_inferred')
+        own = [v for v in viewers if v.stream_id == sid]
+        stream = {
+            'decode_fps': round(decoded / elapsed, 2),
+            'processed_fps': round(_delta(frames_a, frames_b, 'frames_read') / elapsed, 2),
+            'inference_fps': round(inferred / elapsed, 2),
+            'frames_decoded': decoded,
+            'frames_dropped': dropped,
+            'drop_ratio': round(dropped / decoded, 4) if decoded else None,
+            'scheduler': a.get('scheduler'),
+            'motion_gate': a.get('motion_gate'),
+            'latency_ms': a.get('latency'),
+            'receiver': a.get('receiver'),
+            'transport': a.get('transport'),
+            'viewers': [
+                {'fps': round(v.frames / elapsed, 2), 'kbps': round(v.bytes * 8 / elapsed / 1000, 1), 'error': v.error}
+                for v in own
+            ],
+        }
+        results['streams'][sid] = stream
+        totals['decode_fps'] += stream['decode_fps']
+        totals['processed_fps'] += stream['processed_fps']
+        totals['inference_fps'] += stream['inference_fps']
+        totals['dropped'] += dropped
+        totals['received'] += decoded
+        viewer_fps += [v['fps'] for v in stream['viewers']]
+
+    totals['drop_ratio'] = round(totals['dropped'] / totals['received'], 4) if totals['received'] else None
+    totals['delivery_fps_per_viewer'] = round(sum(viewer_fps) / len(viewer_fps), 2) if viewer_fps else None
+    p95s = [s['latency_ms'].get('total', {}).get('p95') for s in results['streams'].values() if s['latency_ms']]
+    p95s = [p for p in p95s if p is not None]
+    totals['total_latency_p95_ms'] = max(p95s) if p95s else None
+    results['totals'] = {k: round(v, 2) if isinstance(v, float) else v for k, v in totals.items()}
+
+    cpu = [s for s in samples if s[1] is not None]
+    process = {'cpu_percent': None, 'rss_mb_max': None, 'rss_mb_end': None}
+    if len(cpu) >= 2:
+        process['cpu_percent'] = round((cpu[-1][1] - cpu[0][1]) / (cpu[-1][0] - cpu[0][0]) * 100, 1)
+        process['rss_mb_max'] = round(max(s[2] for s in cpu), 1)
+        process['rss_mb_end'] = round(cpu[-1][2], 1)
+    results['process'] = process
+    return results
+
+
+def _git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=_GCS_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def _lookup(results: dict, path: str):
+    value = results
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Prints the key metrics next to the baseline; returns False if any regressed beyond tolerance."""
+    ok = True
+    differs = [k for k, v in results['config'].items() if baseline.get('config', {}).get(k) != v and k != 'label']
+    if differs:
+        print(f"[Bench] Warning: configuration differs from the baseline in {', '.join(differs)}")
+    print(f"\n{'metric':<34} {'baseline':>10} {'this run':>10} {'change':>8}")
+    for path, higher_is_better in KEY_METRICS:
+        old, new = _lookup(baseline, path), _lookup(results, path)
+        if old is None or new is None:
+            print(f"{path:<34} {str(old):>10} {str(new):>10}")
+            continue
+        # a zero baseline (e.g. no drops) is compared in absolute terms
+        change = (new - old) / old if old else new - old
+        worse = -change if higher_is_better else change
+        regressed = worse > tolerance
+        ok &= not regressed
+        print(f"{path:<34} {old:>10.2f} {new:>10.2f} {change:>+7.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+# ---------------------------------------------
+# MAIN
+# ---------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--streams', type=int, default=1, help='number of simulated drones')
+    parser.add_argument('--viewers', type=int, default=2, help='MJPEG viewers per stream')
+    parser.add_argument('--duration', type=float, default=30.0, help='measured seconds (<= 60, the latency window)')
+    parser.add_argument('--warmup', type=float, default=5.0)
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--bitrate', type=int, default=4_000_000)
+    parser.add_argument('--source', help='video file for the senders instead of the synthetic clip')
+    parser.add_argument('--transport', choices=('tcp', 'rtp'), default='tcp', help='drone -> GCS transport')
+    parser.add_argument('--loss', type=float, default=0.0, help='induced RTP packet loss at the receiver (0-1)')
+    parser.add_argument('--sender-port', type=int, default=18880, help='first sender port')
+    parser.add_argument('--server-port', type=int, default=18000)
+    parser.add_argument('--model-timeout', type=float, default=300.0, help='seconds to wait for the model to be warm')
+    parser.add_argument('--label', default='')
+    parser.add_argument('--out', help='write results JSON here')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative regression for --baseline')
+    args = parser.parse_args()
+
+    logs_dir = tempfile.mkdtemp(prefix='gcs-bench-')
+    streams = {f'bench{i + 1}': args.sender_port + i for i in range(args.streams)}
+    procs = []
+    stop = threading.Event()
+    measuring = threading.Event()
+    try:
+        sender_args = ['--size', args.size, '--fps', str(args.fps), '--bitrate', str(args.bitrate),
+                       '--transport', args.transport]
+        if args.source:
+            sender_args += ['--source', args.source]
+        for sid, port in streams.items():
+            print(f"[Bench] Starting sender {sid} on port {port}")
+            procs.append(start_process([sys.executable, os.path.join(_HERE, 'synthetic_sender.py'), '--host', '127.0.0.1',
+                                        '--port', str(port)] + sender_args,
+                                       os.environ.copy(), _HERE, os.path.join(logs_dir, f'sender-{sid}.log'),
+                                       ready_text='Ready on port', timeout=120))
+
+        scheme = 'rtp://' if args.transport == 'rtp' else ''
+        env = dict(os.environ, GCS_STREAMS=','.join(f'{sid}={scheme}127.0.0.1:{port}' for sid, port in streams.items()),
+                   GCS_RTP_INDUCED_LOSS=str(args.loss))
+        print(f"[Bench] Starting server on port {args.server_port} (logs in {logs_dir})")
+        server = start_process([sys.executable, '-m', 'uvicorn', 'video_server:app', '--host', '127.0.0.1',
+                                '--port', str(args.server_port), '--log-level', 'warning'],
+                               env, _GCS_DIR, os.path.join(logs_dir, 'server.log'))
+        procs.append(server)
+        if not wait_until(lambda: get_json(args.server_port, '/status'), 60):
+            sys.exit("server did not start")
+        started_wait = time.time()
+        wait_until(lambda: get_json(args.server_port, '/status')['model']['state'] in ('warm', 'failed'), args.model_timeout)
+        model = get_json(args.server_port, '/status')['model']
+        print(f"[Bench] Model {model.get('state')} after {time.time() - started_wait:.1f}s")
+        wait_until(lambda: all(get_json(args.server_port, '/status')['streams'].values()), 30)
+
+        viewers = [Viewer(args.server_port, sid, stop, measuring) for sid in streams for _ in range(args.viewers)]
+        for v in viewers:
+            v.start()
+        print(f"[Bench] {len(viewers)} viewer(s) attached; warming up for {args.warmup:.0f}s")
+        time.sleep(args.warmup)
+
+        sampler = ProcessSampler(server.pid)
+        before = {sid: get_json(args.server_port, f'/streams/{sid}/status') for sid in streams}
+        engine_before = get_json(args.server_port, '/status')['inference']
+        measuring.set()
+        t0 = time.time()
+        samples = [(t0, *sampler.sample())]
+        print(f"[Bench] Measuring for {args.duration:.0f}s")
+        while time.time() - t0 < args.duration:
+            time.sleep(1.0)
+            samples.append((time.time(), *sampler.sample()))
+        measuring.clear()
+        elapsed = time.time() - t0
+        after = {sid: get_json(args.server_port, f'/streams/{sid}/status') for sid in streams}
+        engine_after = get_json(args.server_port, '/status')['inference']
+    finally:
+        stop.set()
+        for proc in reversed(procs):
+            stop_process(proc)
+
+    results = summarize(args, streams, before, after, engine_before, engine_after, viewers, samples, elapsed, model)
+    print(json.dumps({'totals': results['totals'], 'process': results['process']}, indent=2))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"[Bench] Results written to {args.out}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            if not compare(results, json.load(f), args.tolerance):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
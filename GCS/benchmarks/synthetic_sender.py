@@ -0,0 +1,218 @@
+"""
+Stand-in for the drone's MPEG-TS TCP sender, for benchmarks without a Raspberry Pi.
+
+The clip is prepared once at startup and then only re-muxed, so serving it costs
+almost no CPU and every run sends the same bytes:
+
+ - synthetic (default): SECONDS of WxH video at FPS, encoded with libx264 (zerolatency,
+   keyframe every GOP frames, BITRATE). The scene is a textured background with a few
+   dark figures walking across it and a frame counter, so decode, motion gating and
+   JPEG encoding see realistic work.
+ - --source FILE: any video PyAV can read (e.g. a recorded .ts from the drone). H.264
+   packets are sent as-is; other codecs are transcoded once.
+
+Over TCP it accepts one receiver at a time and waits for the next after a disconnect.
+With --transport rtp it serves RTP/UDP subscribers through the drone's own TsFanout and
+RtpServer (drone/src), so RTP receivers can be tested over loopback (combine with
+GCS_RTP_INDUCED_LOSS on the server for packet loss). Frames are paced at FPS (or the
+file's rate x --speed); the clip loops with continuous timestamps, so the receiver
+sees one endless stream.
+
+Run with:
+    python GCS/benchmarks/synthetic_sender.py --port 8888 --size 1280x720 --fps 30
+    python GCS/benchmarks/synthetic_sender.py --port 8888 --source flight.ts
+    python GCS/benchmarks/synthetic_sender.py --port 8888 --transport rtp
+"""
+
+import argparse
+import io
+import os
+import socket
+import sys
+import time
+from fractions import Fraction
+
+import av
+import cv2
+import numpy as np
+
+_DRONE_SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'drone', 'src'))
+
+
+def synthetic_frames(width: int, height: int, count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(60, 200, (height // 8, width // 8, 3), dtype=np.uint8),
+                                  (5, 5), 0)
+    background = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+    # (x, y, speed px/frame, height) of each walking figure
+    figures = [(rng.uniform(0, width), rng.uniform(0.2, 0.8) * height, rng.uniform(-4, 4), rng.uniform(0.05, 0.2) * height)
+               for _ in range(4)]
+    for i in range(count):
+        img = background.copy()
+        for x, y, speed, fh in figures:
+            cx = int((x + speed * i) % width)
+            fw = max(2, int(fh * 0.4))
+            cv2.rectangle(img, (cx, int(y)), (cx + fw, int(y + fh)), (40, 40, 40), -1)
+            cv2.circle(img, (cx + fw // 2, int(y - fw * 0.4)), max(1, int(fw * 0.4)), (40, 40, 40), -1)
+        cv2.putText(img, f"frame {i}", (20, height - 20), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
+        yield img
+
+
+def encode_clip(frames, width: int, height: int, fps: int, bitrate: int, gop: int) -> bytes:
+    """Encodes BGR frames to an in-memory MPEG-TS with libx264."""
+    buf = io.BytesIO()
+    out = av.open(buf, 'w', format='mpegts')
+    stream = out.add_stream('libx264', rate=fps)
+    stream.width, stream.height, stream.pix_fmt = width, height, 'yuv420p'
+    stream.bit_rate = bitrate
+    stream.options = {'tune': 'zerolatency', 'preset': 'veryfast', 'g': str(gop), 'bf': '0'}
+    for img in frames:
+        for packet in stream.encode(av.VideoFrame.from_ndarray(img, format='bgr24')):
+            out.mux(packet)
+    for packet in stream.encode():
+        out.mux(packet)
+    out.close()
+    return buf.getvalue()
+
+
+def load_clip(args):
+    """Returns (input container, video stream, [(bytes, is_keyframe)], fps) for the clip to serve."""
+    if args.source:
+        probe = av.open(args.source)
+        vs = probe.streams.video[0]
+        fps = float(vs.average_rate or args.fps)
+        if vs.codec_context.name == 'h264':
+            probe.close()
+            container = av.open(args.source)
+        else:
+            frames = (f.to_ndarray(format='bgr24') for f in probe.decode(vs))
+            data = encode_clip(frames, vs.codec_context.width, vs.codec_context.height, round(fps), args.bitrate, args.gop)
+            probe.close()
+            container = av.open(io.BytesIO(data), format='mpegts')
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        fps = args.fps
+        frames = synthetic_frames(width, height, int(args.seconds * fps))
+        container = av.open(io.BytesIO(encode_clip(frames, width, height, fps, args.bitrate, args.gop)), format='mpegts')
+    stream = container.streams.video[0]
+    packets = [(bytes(p), p.is_keyframe) for p in container.demux(stream) if p.size]
+    # start the loop on a keyframe so a fresh receiver can decode immediately
+    first_key = next((i for i, (_, key) in enumerate(packets) if key), 0)
+    return container, stream, packets[first_key:], fps * args.speed
+
+
+def mux_loop(f, template, packets, fps: float) -> int:
+    """Muxes the clip into file object f, paced at fps, until writing fails. Returns the frames sent."""
+    out = av.open(f, 'w', format='mpegts', options={'flush_packets': '1'})
+    stream = out.add_stream_from_template(template)
+    ticks = round(90000 / fps)
+    started = time.perf_counter()
+    sent = 0
+    try:
+        while True:
+            for data, key in packets:
+                # pace against the start time so timing errors do not accumulate
+                delay = started + sent / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                packet = av.Packet(data)
+                packet.stream = stream
+                packet.time_base = Fraction(1, 90000)
+                packet.pts = packet.dts = sent * ticks
+                packet.is_keyframe = key
+                out.mux(packet)
+                sent += 1
+    except (OSError, av.error.FFmpegError):
+        pass
+    finally:
+        try:
+            out.close()
+        except Exception:
+            pass
+    return sent
+
+
+def serve_client(conn: socket.socket, template, packets, fps: float, log):
+    f = conn.makefile('wb', buffering=0)
+    try:
+        sent = mux_loop(f, template, packets, fps)
+        log(f"[Sender] Receiver gone after {sent} frames")
+    finally:
+        f.close()
+
+
+class _FanoutWriter:
+    """File-like sink that feeds the muxed stream to a TsFanout."""
+
+    def __init__(self, fanout):
+        self.fanout = fanout
+
+    def write(self, data) -> int:
+        self.fanout.feed(bytes(data))
+        return len(data)
+
+
+def serve_rtp(args, template, packets, fps: float, log):
+    sys.path.insert(0, _DRONE_SRC)
+    from rtp_transport import RtpServer
+    from stream_fanout import TsFanout
+
+    fanout = TsFanout()
+    server = RtpServer(fanout, args.port)
+    server.start()
+    log(f"[Sender] Ready on port {args.port} (rtp)")
+    try:
+        # the stream runs continuously, like the drone's encoder; subscribers join at keyframes
+        mux_loop(_FanoutWriter(fanout), template, packets, fps)
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8888)
+    parser.add_argument('--source', help='video file to serve instead of the synthetic clip')
+    parser.add_argument('--size', default='1280x720')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--seconds', type=float, default=10.0, help='length of the synthetic clip before it loops')
+    parser.add_argument('--bitrate', type=int, default=4_000_000)
+    parser.add_argument('--gop', type=int, default=30)
+    parser.add_argument('--speed', type=float, default=1.0, help='playback speed multiplier')
+    parser.add_argument('--transport', choices=('tcp', 'rtp'), default='tcp')
+    args = parser.parse_args()
+
+    def log(msg):
+        print(msg, flush=True)
+
+    started = time.time()
+    container, template, packets, fps = load_clip(args)
+    log(f"[Sender] Prepared {len(packets)} frames at {fps:.1f} fps in {time.time() - started:.1f}s")
+
+    if args.transport == 'rtp':
+        try:
+            serve_rtp(args, template, packets, fps, log)
+        except KeyboardInterrupt:
+            pass
+        container.close()
+        return 0
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind((args.host, args.port))
+        srv.listen(1)
+        log(f"[Sender] Ready on port {args.port}")
+        try:
+            while True:
+                conn, addr = srv.accept()
+                log(f"[Sender] Connected to {addr[0]}:{addr[1]}")
+                with conn:
+                    serve_client(conn, template, packets, fps, log)
+        except KeyboardInterrupt:
+            pass
+    container.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
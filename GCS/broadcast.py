@@ -0,0 +1,154 @@
+"""
+Broadcast from worker threads to asyncio subscribers.
+
+BroadcastHub (video frames) is latest-value:
+
+A producer thread calls `publish(value)`; every subscriber (an async generator
+running on the server's event loop) wakes up on the new value instead of polling.
+Values are shared as-is, so a frame that is encoded once is sent to every client as
+the same bytes object.
+
+Subscribers never queue: a client that is still busy sending an old value simply
+picks up the newest one when it comes back, skipping whatever was published in
+between. A slow viewer therefore cannot delay the producer or other viewers.
+
+QueueBroadcast (detection events) delivers every value in order through a bounded
+queue per subscriber. When a subscriber's queue is full its oldest value is dropped
+(and counted), so a stalled client costs at most `maxsize` values of memory.
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Optional
+
+_CLOSED = object()
+
+
+class BroadcastHub:
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+        # (sequence, value) replaced as one tuple so readers never see a torn pair
+        self._latest = (0, None)
+        self._closed = False
+        self.subscribers = 0
+        self.published = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Attaches the hub to the server's event loop; call from that loop (e.g. at startup)."""
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def publish(self, value: Any):
+        """Thread-safe: stores value as the latest one and wakes all subscribers."""
+        seq = self._latest[0] + 1
+        self._latest = (seq, value)
+        self.published += 1
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # loop already closed during shutdown
+                pass
+
+    def latest(self) -> Any:
+        return self._latest[1]
+
+    def close(self):
+        """Ends all subscriptions (thread-safe)."""
+        self._closed = True
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                pass
+
+    def _wake(self):
+        # runs on the loop: swap in a fresh event before setting the old one, so a
+        # subscriber always waits on an event that the next publish will set
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def subscribe(self, min_interval: float = 0.0) -> AsyncIterator[Any]:
+        """Yields each new value (skipping any missed while the consumer was busy), at most once per min_interval."""
+        if self._event is None:
+            raise RuntimeError("BroadcastHub.bind() was not called")
+        last_seq = 0
+        self.subscribers += 1
+        try:
+            while not self._closed:
+                seq, value = self._latest
+                if seq == last_seq or value is None:
+                    await self._event.wait()
+                    continue
+                last_seq = seq
+                yield value
+                if min_interval > 0:
+                    await asyncio.sleep(min_interval)
+        finally:
+            self.subscribers -= 1
+
+
+class QueueBroadcast:
+    """
+    Args:
+        maxsize (int): values buffered per subscriber before the oldest is dropped.
+    """
+
+    def __init__(self, maxsize: int = 32):
+        self.maxsize = maxsize
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queues = set()
+        self._closed = False
+        self.published = 0
+        self.dropped = 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._queues)
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Attaches to the server's event loop; call before subscribers arrive."""
+        self._loop = loop
+
+    def publish(self, value: Any):
+        """Thread-safe: queues value for every current subscriber."""
+        self.published += 1
+        if self._loop is None or not self._queues:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, value)
+        except RuntimeError:
+            pass
+
+    def close(self):
+        """Ends all subscriptions (thread-safe)."""
+        self._closed = True
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._deliver, _CLOSED)
+            except RuntimeError:
+                pass
+
+    def _deliver(self, value):
+        for queue in self._queues:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(value)
+
+    async def subscribe(self, idle_timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        """Yields every value published while subscribed; yields None after idle_timeout seconds without one."""
+        queue = asyncio.Queue(self.maxsize)
+        self._queues.add(queue)
+        try:
+            while not self._closed:
+                try:
+                    value = await asyncio.wait_for(queue.get(), idle_timeout)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if value is _CLOSED:
+                    break
+                yield value
+        finally:
+            self._queues.discard(queue)
@@ -0,0 +1,116 @@
+"""
+Compact, vectorized detection results.
+
+Detections travel through the GCS as a NumPy structured array (one record per box)
+instead of lists of Python floats:
+
+    dets['box']   float32 (N, 4)  x1, y1, x2, y2 in pixels
+    dets['conf']  float32 (N,)    confidence
+    dets['cls']   int16   (N,)    class id
+
+Class filtering, confidence thresholding and coordinate rescaling are whole-array
+operations, so their cost barely grows with the number of boxes. Use
+`detections_to_dict` where the legacy {"boxes", "confidences", ...} shape is needed.
+
+This module only depends on NumPy so it can be used (and benchmarked) without torch.
+"""
+
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+DETECTION_DTYPE = np.dtype([
+    ('box', np.float32, (4,)),
+    ('conf', np.float32),
+    ('cls', np.int16),
+])
+
+
+def empty_detections() -> np.ndarray:
+    return np.empty(0, dtype=DETECTION_DTYPE)
+
+
+def _to_numpy(t) -> np.ndarray:
+    # torch tensors (possibly on CUDA) expose .cpu(); numpy arrays pass straight through
+    if hasattr(t, 'cpu'):
+        t = t.cpu()
+    if hasattr(t, 'numpy'):
+        t = t.numpy()
+    return np.asarray(t)
+
+
+def class_ids_for(names: Dict[int, str], wanted: Iterable[str]) -> np.ndarray:
+    """Returns the ids in a model's names mapping whose label is in wanted."""
+    wanted = set(wanted)
+    return np.array([i for i, n in names.items() if n in wanted], dtype=np.int16)
+
+
+def extract_detections(result, class_ids: np.ndarray, conf_thresh: float = 0.0) -> np.ndarray:
+    """
+    Converts one Ultralytics result into a structured detections array.
+
+    Args:
+        result: an Ultralytics `Results` object (anything with `.boxes.xyxy/.conf/.cls`).
+        class_ids (np.ndarray): class ids to keep.
+        conf_thresh (float): minimum confidence to keep.
+
+    Returns:
+        np.ndarray: DETECTION_DTYPE records, in the model's output order.
+    """
+    boxes = getattr(result, 'boxes', None)
+    if boxes is None or len(boxes) == 0:
+        return empty_detections()
+
+    cls = _to_numpy(boxes.cls).astype(np.int16, copy=False)
+    conf = _to_numpy(boxes.conf).astype(np.float32, copy=False)
+    if len(class_ids) == 1:
+        # the common single-class case; np.isin has a large fixed cost for small inputs
+        keep = cls == class_ids[0]
+    else:
+        keep = np.isin(cls, class_ids)
+    keep &= conf >= conf_thresh
+
+    out = np.empty(int(np.count_nonzero(keep)), dtype=DETECTION_DTYPE)
+    out['box'] = _to_numpy(boxes.xyxy)[keep]
+    out['conf'] = conf[keep]
+    out['cls'] = cls[keep]
+    return out
+
+
+def scale_detections(dets: np.ndarray, scale: float) -> np.ndarray:
+    """Maps boxes from a resized frame back to the original by dividing by scale (in place)."""
+    if scale != 1.0 and len(dets):
+        dets['box'] /= scale
+    return dets
+
+
+def offset_detections(dets: np.ndarray, dx: float, dy: float) -> np.ndarray:
+    """Maps boxes from a crop at (dx, dy) back to the full frame (in place)."""
+    if (dx or dy) and len(dets):
+        dets['box'] += np.array([dx, dy, dx, dy], dtype=np.float32)
+    return dets
+
+
+def boxes_outside(dets: np.ndarray, regions) -> np.ndarray:
+    """Boolean mask of detections whose box centre lies outside every (x1, y1, x2, y2) region."""
+    cx = (dets['box'][:, 0] + dets['box'][:, 2]) / 2
+    cy = (dets['box'][:, 1] + dets['box'][:, 3]) / 2
+    outside = np.ones(len(dets), dtype=bool)
+    for x1, y1, x2, y2 in regions:
+        outside &= ~((cx >= x1) & (cx < x2) & (cy >= y1) & (cy < y2))
+    return outside
+
+
+def detections_to_dict(dets: np.ndarray, names: Optional[Dict[int, str]] = None) -> dict:
+    """Compatibility adapter to the legacy {"boxes", "confidences", "class_ids", "class_names"} dict."""
+    class_ids = dets['cls'].tolist()
+    if names is None:
+        class_names = [str(c) for c in class_ids]
+    else:
+        class_names = [names[c] for c in class_ids]
+    return {
+        "boxes": dets['box'].tolist(),
+        "confidences": dets['conf'].tolist(),
+        "class_ids": class_ids,
+        "class_names": class_names,
+    }
@@ -0,0 +1,97 @@
+"""
+Decode-side frame helpers: keep frames in native I420 (YUV420 planar) and convert to
+BGR only when a consumer needs pixels, into reusable buffers.
+
+An I420 frame of width w and height h is stored as one (h * 3 // 2, w) uint8 array:
+the Y plane in the first h rows, followed by the quarter-size U and V planes. That is
+half the bytes of BGR and needs no colour conversion at decode time.
+
+ - copy_frame_i420(frame, buf) copies a PyAV frame's planes into buf without any
+   intermediate allocation (the planes are read through the buffer protocol).
+ - i420_to_bgr(yuv, out) converts at full size into out.
+ - i420_to_bgr_resized(yuv, size, out, scratch) downscales the planes first and
+   converts only the small image, e.g. straight to INFERENCE_WIDTH.
+ - BufferPool hands out and recycles same-shaped arrays.
+"""
+
+import threading
+from collections import defaultdict
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+
+def i420_shape(width: int, height: int) -> Tuple[int, int]:
+    return (height * 3 // 2, width)
+
+
+def _planes(buf: np.ndarray, width: int, height: int):
+    # views into an I420 buffer; the chroma planes need not start on a row boundary
+    # (height % 4 != 0), so slice the flat buffer
+    flat = buf.reshape(-1)
+    ysize = width * height
+    csize = (width // 2) * (height // 2)
+    y = buf[:height]
+    u = flat[ysize:ysize + csize].reshape(height // 2, width // 2)
+    v = flat[ysize + csize:ysize + 2 * csize].reshape(height // 2, width // 2)
+    return y, u, v
+
+
+def copy_frame_i420(frame, buf: np.ndarray):
+    """Copies a decoded PyAV VideoFrame into an I420 buffer of shape i420_shape(frame.width, frame.height)."""
+    if frame.format.name != 'yuv420p':
+        # rare (e.g. yuvj420p from some encoders); this path allocates a converted frame
+        frame = frame.reformat(format='yuv420p')
+    w, h = frame.width, frame.height
+    for plane, dst in zip(frame.planes, _planes(buf, w, h)):
+        ph, pw = dst.shape
+        src = np.frombuffer(plane, np.uint8)[:plane.line_size * ph].reshape(ph, plane.line_size)
+        # line_size may include alignment padding past the visible width
+        np.copyto(dst, src[:, :pw])
+
+
+def i420_to_bgr(yuv: np.ndarray, out: np.ndarray) -> np.ndarray:
+    cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR_I420, dst=out)
+    return out
+
+
+def i420_to_bgr_resized(yuv: np.ndarray, size: Tuple[int, int], out: np.ndarray, scratch: np.ndarray) -> np.ndarray:
+    """
+    Resizes an I420 frame to size=(width, height) plane by plane, then converts to BGR.
+
+    Both dimensions of size must be even. scratch is an I420 buffer for the small
+    frame (shape i420_shape(*size)); out is the (height, width, 3) BGR result.
+    """
+    h = yuv.shape[0] * 2 // 3
+    w = yuv.shape[1]
+    sw, sh = size
+    for src, dst in zip(_planes(yuv, w, h), _planes(scratch, sw, sh)):
+        cv2.resize(src, (dst.shape[1], dst.shape[0]), dst=dst, interpolation=cv2.INTER_LINEAR)
+    cv2.cvtColor(scratch, cv2.COLOR_YUV2BGR_I420, dst=out)
+    return out
+
+
+class BufferPool:
+    """Thread-safe pool of reusable numpy arrays, keyed by shape."""
+
+    def __init__(self, dtype=np.uint8):
+        self.dtype = dtype
+        self._free = defaultdict(list)
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self, shape) -> np.ndarray:
+        shape = tuple(shape)
+        with self._lock:
+            free = self._free[shape]
+            if free:
+                return free.pop()
+            self.allocated += 1
+        return np.empty(shape, dtype=self.dtype)
+
+    def release(self, arr: np.ndarray):
+        if arr is None:
+            return
+        with self._lock:
+            self._free[arr.shape].append(arr)
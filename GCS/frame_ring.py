@@ -0,0 +1,155 @@
+"""
+Preallocated, fixed-slot frame ring buffer.
+
+Replaces a queue.Queue of freshly allocated frames between the decoder and the
+processing pipeline. Each slot owns one numpy buffer that is reused for every frame
+written into it, and every committed frame gets a monotonically increasing sequence
+number.
+
+A slot is always in exactly one state: free, being written, ready (committed, not
+yet read) or held (handed to a reader and not yet released).
+
+Read modes:
+ - 'latest':   get() returns the newest ready frame and recycles every older ready
+               frame (counted as dropped). When no slot is free, the writer reuses
+               the oldest ready slot, so a slow consumer only ever sees fresh frames.
+ - 'lossless': get() returns frames oldest first and the writer waits for a free
+               slot instead of overwriting (use for recording).
+
+Usage (writer):
+    slot, buf = ring.acquire(shape)
+    ... fill buf ...
+    ring.commit(slot, timestamp)
+
+Usage (reader):
+    item = ring.get(timeout=0.5)   # (slot, buf, seq, timestamp) or None
+    ... use buf ...
+    ring.release(slot)
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Optional, Tuple
+
+import numpy as np
+
+MODES = ('latest', 'lossless')
+
+
+class FrameRing:
+    def __init__(self, slots: int = 8, mode: str = 'latest'):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        if slots < 2:
+            raise ValueError("FrameRing needs at least 2 slots")
+        self.mode = mode
+        self.slots = slots
+        self._buffers = [None] * slots
+        self._seq = [0] * slots
+        self._timestamps = [0.0] * slots
+        self._meta = [None] * slots
+        self._free = deque(range(slots))
+        self._ready = deque()
+        self._cond = threading.Condition()
+        self._next_seq = 0
+
+        # counters (read without the lock by stats())
+        self.frames_written = 0
+        self.frames_read = 0
+        self.frames_dropped = 0
+
+    def _buffer_for(self, slot: int, shape, dtype) -> np.ndarray:
+        buf = self._buffers[slot]
+        # slots are allocated on first use and only reallocated if the stream geometry changes
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[slot] = buf
+        return buf
+
+    def acquire(self, shape, dtype=np.uint8, timeout: Optional[float] = None) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Reserves a slot for writing a frame of the given shape.
+
+        Returns (slot, buffer), or None if the frame has to be dropped: in 'latest' mode
+        when every slot is held by readers, in 'lossless' mode after timeout seconds.
+        """
+        with self._cond:
+            if not self._free:
+                if self.mode == 'latest':
+                    if not self._ready:
+                        self.frames_dropped += 1
+                        return None
+                    # overwrite the stalest unread frame
+                    self._free.append(self._ready.popleft())
+                    self.frames_dropped += 1
+                else:
+                    deadline = None if timeout is None else time.time() + timeout
+                    while not self._free:
+                        remaining = None if deadline is None else deadline - time.time()
+                        if remaining is not None and remaining <= 0:
+                            self.frames_dropped += 1
+                            return None
+                        self._cond.wait(remaining)
+            slot = self._free.popleft()
+            return slot, self._buffer_for(slot, shape, dtype)
+
+    def commit(self, slot: int, timestamp: float, meta=None) -> int:
+        """Publishes a written slot to readers; returns its sequence number. meta travels with the frame (see meta())."""
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._seq[slot] = seq
+            self._timestamps[slot] = timestamp
+            self._meta[slot] = meta
+            self._ready.append(slot)
+            self.frames_written += 1
+            self._cond.notify_all()
+            return seq
+
+    def cancel(self, slot: int):
+        """Returns an acquired slot without publishing it (e.g. the decode failed)."""
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def get(self, timeout: Optional[float] = None):
+        """Takes the next frame according to the ring's mode: (slot, buffer, seq, timestamp) or None."""
+        with self._cond:
+            if not self._ready:
+                self._cond.wait(timeout)
+                if not self._ready:
+                    return None
+            if self.mode == 'latest':
+                slot = self._ready.pop()
+                stale = len(self._ready)
+                if stale:
+                    self._free.extend(self._ready)
+                    self._ready.clear()
+                    self.frames_dropped += stale
+                    self._cond.notify_all()
+            else:
+                slot = self._ready.popleft()
+            self.frames_read += 1
+            return slot, self._buffers[slot], self._seq[slot], self._timestamps[slot]
+
+    def meta(self, slot: int):
+        """The meta passed to commit() for the frame a reader currently holds in slot."""
+        return self._meta[slot]
+
+    def release(self, slot: int):
+        """Hands a slot obtained from get() back to the writer."""
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            'mode': self.mode,
+            'slots': self.slots,
+            'frames_written': self.frames_written,
+            'frames_read': self.frames_read,
+            'frames_dropped': self.frames_dropped,
+            'ready': len(self._ready),
+            'last_seq': self._next_seq - 1,
+        }
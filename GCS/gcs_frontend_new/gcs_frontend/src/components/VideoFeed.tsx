@@ -1,17 +1,41 @@
 // src/components/VideoFeed.tsx
-import React, { useEffect } from 'react';
+import React, { useEffect, useState } from 'react';
 import { useDroneData } from '../hooks/useDroneData';
 
+// One message of the GCS detection event stream (GET /detections)
+interface DetectionEvent {
+  seq: number;
+  ts: number;
+  w: number;
+  h: number;
+  annotated: boolean;
+  boxes: [number, number, number, number][];
+  conf: number[];
+  ids: number[] | null;
+}
+
 export const VideoFeed: React.FC = () => {
   const { addLog } = useDroneData();
+  const [detections, setDetections] = useState<DetectionEvent | null>(null);
+
+  // boxes come as events; they are only drawn here when the server sends clean video
+  useEffect(() => {
+    const source = new EventSource('http://localhost:8000/detections');
+    source.onmessage = (e) => setDetections(JSON.parse(e.data));
+    source.onerror = () => setDetections(null);
+    return () => source.close();
+  }, []);
 
   useEffect(() => {
+    // only entries newer than the last one seen (the server numbers them)
+    let lastSeq = 0;
     const fetchLogs = async () => {
       try {
-        const res = await fetch('http://localhost:8000/logs');
+        const res = await fetch(`http://localhost:8000/logs?since=${lastSeq}`);
         const data = await res.json();
 
         data.forEach((entry: any) => {
+          lastSeq = Math.max(lastSeq, entry.seq);
           const msg = entry.message || '';
           addLog({
             type: msg.includes('BLIP')
@@ -19,9 +43,7 @@ export const VideoFeed: React.FC = () => {
               : msg.includes('YOLO')
               ? 'detection'
               : 'sys',
-            severity: msg.toLowerCase().includes('error')
-              ? 'error'
-              : 'info',
+            severity: entry.level === 'error' || entry.level === 'warning' ? entry.level : 'info',
             message: msg,
             timestamp: new Date(entry.timestamp * 1000),
           });
@@ -35,13 +57,33 @@ export const VideoFeed: React.FC = () => {
     return () => clearInterval(interval);
   }, [addLog]);
 
+  const overlay = detections && !detections.annotated ? detections : null;
+
   return (
     <div className="w-full h-full flex justify-center items-center bg-black">
-      <img
-        src="http://localhost:8000/video_feed"
-        alt="YOLO + BLIP Stream"
-        style={{ maxWidth: '100%', maxHeight: '100%' }}
-      />
+      <div className="relative" style={{ maxWidth: '100%', maxHeight: '100%' }}>
+        <img
+          src="http://localhost:8000/video_feed"
+          alt="YOLO + BLIP Stream"
+          style={{ maxWidth: '100%', maxHeight: '100%', display: 'block' }}
+        />
+        {overlay && (
+          <svg
+            className="absolute inset-0 w-full h-full pointer-events-none"
+            viewBox={`0 0 ${overlay.w} ${overlay.h}`}
+            preserveAspectRatio="none"
+          >
+            {overlay.boxes.map(([x1, y1, x2, y2], i) => (
+              <g key={overlay.ids ? overlay.ids[i] : i}>
+                <rect x={x1} y={y1} width={x2 - x1} height={y2 - y1} fill="none" stroke="#00ff00" strokeWidth={2} />
+                <text x={x1} y={Math.max(y1 - 6, 12)} fill="#00ff00" fontSize={16}>
+                  {overlay.ids ? `#${overlay.ids[i]} ` : ''}person {overlay.conf[i].toFixed(2)}
+                </text>
+              </g>
+            ))}
+          </svg>
+        )}
+      </div>
     </div>
   );
 };
@@ -0,0 +1,239 @@
+"""
+Inference backends for the YOLO detector.
+
+PyTorch eager inference is the slowest option on CPU-only ground stations. This
+module exports the model once to an optimized runtime and keeps the compiled
+artifact on disk, so later starts only pay the load:
+
+ - 'torch':         the .pt weights through PyTorch (CUDA when available)
+ - 'onnx':          ONNX Runtime
+ - 'openvino':      OpenVINO FP32
+ - 'openvino-int8': OpenVINO with post-training INT8 quantization (calibrated on
+                    INT8_CALIBRATION_DATA)
+
+Artifacts live under <cache_dir>/<weights stem>-<sha256[:12]>/<backend>-<imgsz>/, so
+changing the weights or the export size produces a new export instead of reusing a
+stale one. Exports have dynamic batch and image axes: the engine can still batch
+frames, and one export serves every inference size (the adaptive and ROI sizes in
+stream_session.py), so nothing is exported or loaded while streams are running.
+The export size only sets INT8 calibration and the model's default input size.
+Exported models are loaded back through Ultralytics (YOLO(path)), which keeps pre-
+and post-processing (letterbox, NMS) identical across backends.
+"""
+
+import hashlib
+import json
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+BACKENDS = ('torch', 'onnx', 'openvino', 'openvino-int8')
+
+# Ultralytics export arguments per backend
+_EXPORT_ARGS = {
+    'onnx': {'format': 'onnx', 'dynamic': True, 'simplify': True},
+    'openvino': {'format': 'openvino', 'dynamic': True},
+    'openvino-int8': {'format': 'openvino', 'dynamic': True, 'int8': True},
+}
+# Dataset YAML used to calibrate INT8 quantization (Ultralytics downloads coco8 on demand)
+INT8_CALIBRATION_DATA = 'coco8.yaml'
+# Written last into a cache entry; an entry without it is an interrupted export
+_META_FILE = 'export.json'
+
+_hashes = {}
+
+
+def file_hash(path) -> str:
+    """First 12 hex digits of the file's SHA-256, memoized per path."""
+    path = str(Path(path).resolve())
+    if path not in _hashes:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        _hashes[path] = h.hexdigest()[:12]
+    return _hashes[path]
+
+
+def cache_entry(weights, backend: str, imgsz: int, cache_dir) -> Path:
+    weights = Path(weights)
+    return Path(cache_dir) / f"{weights.stem}-{file_hash(weights)}" / f"{backend}-{imgsz}"
+
+
+def cached_artifact(weights, backend: str, imgsz: int, cache_dir) -> Optional[Path]:
+    """Path of a finished export for these weights/backend/size, or None."""
+    meta = cache_entry(weights, backend, imgsz, cache_dir) / _META_FILE
+    if not meta.is_file():
+        return None
+    try:
+        artifact = meta.parent / json.loads(meta.read_text())['artifact']
+    except (OSError, ValueError, KeyError):
+        return None
+    return artifact if artifact.exists() else None
+
+
+def export_model(weights, backend: str, imgsz: int, cache_dir, log: Callable[[str], None] = print) -> Path:
+    """
+    Exports weights for backend at imgsz into the cache, unless already there.
+
+    Args:
+        weights: path to the .pt weights.
+        backend (str): one of BACKENDS except 'torch'.
+        imgsz (int): input size the model is exported for.
+        cache_dir: root of the export cache.
+        log (callable): progress messages.
+
+    Returns:
+        Path: the exported artifact (a file for ONNX, a directory for OpenVINO).
+    """
+    if backend not in _EXPORT_ARGS:
+        raise ValueError(f"Unknown export backend '{backend}' (expected one of {', '.join(BACKENDS[1:])})")
+    found = cached_artifact(weights, backend, imgsz, cache_dir)
+    if found is not None:
+        return found
+
+    from ultralytics import YOLO
+
+    entry = cache_entry(weights, backend, imgsz, cache_dir)
+    if entry.exists():
+        # leftovers of an interrupted export
+        shutil.rmtree(entry)
+    entry.mkdir(parents=True)
+    # Ultralytics writes the export next to the weights, so export from a copy inside the entry
+    source = entry / Path(weights).name
+    shutil.copy2(weights, source)
+
+    args = dict(_EXPORT_ARGS[backend], imgsz=imgsz, device='cpu')
+    if args.get('int8'):
+        args['data'] = INT8_CALIBRATION_DATA
+    log(f"[Backend] Exporting {Path(weights).name} to {backend} at {imgsz}px (one-off)...")
+    started = time.time()
+    artifact = Path(YOLO(str(source)).export(**args))
+    source.unlink()
+    (entry / _META_FILE).write_text(json.dumps({
+        'artifact': artifact.name,
+        'backend': backend,
+        'imgsz': imgsz,
+        'weights': Path(weights).name,
+        'sha256': file_hash(weights),
+        'export_s': round(time.time() - started, 1),
+    }))
+    log(f"[Backend] Exported {backend} {imgsz}px in {time.time() - started:.1f}s -> {artifact}")
+    return artifact
+
+
+class DetectorBackend:
+    """
+    Hands out one ready Ultralytics model that runs at any inference size.
+
+    Exported backends export (or take from the cache) and load it the first time
+    model() is called; load_model() in yolo_inference.py does that in the background
+    load, before any stream inference.
+
+    Args:
+        weights: path to the .pt weights.
+        backend (str): one of BACKENDS.
+        cache_dir: root of the export cache.
+        device (str): device for the 'torch' backend; exported backends run on CPU.
+        log (callable): progress messages.
+        export_imgsz (int): size exported backends are exported (and INT8-calibrated) at.
+        threads (int, optional): intra-op thread limit for the ONNX Runtime / OpenVINO
+            runtime (None keeps the runtime default of one thread per core). The 'torch'
+            backend is limited with torch.set_num_threads() by the caller.
+    """
+
+    def __init__(self, weights, backend: str = 'torch', cache_dir='model_cache', device: str = 'cpu',
+                 log: Callable[[str], None] = print, export_imgsz: int = 640,
+                 threads: Optional[int] = None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+        self.weights = Path(weights)
+        self.backend = backend
+        self.cache_dir = Path(cache_dir)
+        self.device = device if backend == 'torch' else 'cpu'
+        self.half = backend == 'torch' and device == 'cuda'
+        self.log = log
+        self.export_imgsz = export_imgsz
+        self.threads = threads
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_ms = None
+
+    def model(self):
+        m = self._model
+        if m is not None:
+            return m
+        with self._lock:
+            if self._model is None:
+                started = time.time()
+                self._model = self._load()
+                self.load_ms = round((time.time() - started) * 1000)
+            return self._model
+
+    def _load(self):
+        from ultralytics import YOLO
+
+        if self.backend == 'torch':
+            m = YOLO(str(self.weights))
+            if self.device == 'cuda':
+                m.model.to('cuda')
+            return m
+        if not self.weights.is_file():
+            # Ultralytics downloads named release weights (e.g. 'yolov8m.pt') on first use;
+            # the export needs the local file
+            self.weights = Path(YOLO(str(self.weights)).ckpt_path)
+        artifact = export_model(self.weights, self.backend, self.export_imgsz, self.cache_dir, self.log)
+        m = YOLO(str(artifact), task='detect')
+        if self.threads:
+            self._limit_threads(m, artifact)
+        return m
+
+    def _limit_threads(self, m, artifact: Path):
+        """
+        Rebuilds the runtime session of an exported model with self.threads intra-op threads.
+
+        Ultralytics creates the ONNX Runtime session / OpenVINO compiled model on the first
+        predict and passes no thread settings, so each runtime would start one thread per
+        core; with several batch_detect workers per machine they oversubscribe the CPU.
+        One small throwaway inference creates the predictor, then the session is replaced.
+        """
+        import numpy as np
+
+        m(np.zeros((32, 32, 3), dtype=np.uint8), imgsz=32, verbose=False)
+        runtime = m.predictor.model
+        if self.backend == 'onnx':
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            options.inter_op_num_threads = 1
+            runtime.session = ort.InferenceSession(str(artifact), options,
+                                                   providers=runtime.session.get_providers())
+        else:
+            import openvino as ov
+
+            core = ov.Core()
+            xml = next(Path(artifact).glob('*.xml'))
+            ov_model = core.read_model(str(xml), weights=str(xml.with_suffix('.bin')))
+            if ov_model.get_parameters()[0].get_layout().empty:
+                ov_model.get_parameters()[0].set_layout(ov.Layout('NCHW'))
+            runtime.ov_compiled_model = core.compile_model(
+                ov_model, 'CPU', config={'PERFORMANCE_HINT': 'LATENCY',
+                                         'INFERENCE_NUM_THREADS': self.threads})
+        self.log(f"[Model] {self.backend} runtime limited to {self.threads} threads")
+
+    def predict(self, frames: list, imgsz: int, conf_thresh: float):
+        """Ultralytics Results for frames (BGR), run as one batch at imgsz."""
+        return self.model()(frames, device=self.device, imgsz=imgsz, half=self.half,
+                                 conf=conf_thresh, verbose=False)
+
+    def stats(self) -> dict:
+        return {
+            'backend': self.backend,
+            'device': self.device,
+            'export_imgsz': self.export_imgsz if self.backend != 'torch' else None,
+            'load_ms': self.load_ms,
+            'threads': self.threads if self.backend != 'torch' else None,
+        }
@@ -0,0 +1,199 @@
+"""
+Shared inference engine: one model, many streams.
+
+Every StreamSession hands its frames to the same InferenceEngine instead of loading
+its own model. The engine runs a single worker thread that builds batches across
+streams and schedules them fairly: requests are taken round-robin, one per stream
+at a time, so a busy drone cannot starve a quiet one. Each stream may only have a
+few requests pending; beyond that `infer` blocks, which back-pressures that stream's
+pipeline without affecting the others.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, List, Optional
+
+
+class _Request:
+    __slots__ = ('stream_id', 'images', 'imgsz', 'results', 'error', 'done', 'submitted')
+
+    def __init__(self, stream_id: str, images: list, imgsz: int):
+        self.stream_id = stream_id
+        self.images = images
+        self.imgsz = imgsz
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+        self.submitted = time.time()
+
+
+class InferenceEngine:
+    """
+    Args:
+        detect_fn (callable): detect_fn(images, imgsz=...) -> one result per image (e.g. yolo_inference.detect_batch).
+        max_batch (int): most images sent to detect_fn in one call.
+        batch_timeout (float): how long to wait for more requests once one is pending, in seconds.
+        max_pending_per_stream (int): requests a stream may have queued before infer() blocks.
+        on_error (callable): called with a message when detect_fn raises.
+        ready_fn (callable): ready_fn() -> False while detect_fn only returns placeholder
+            (empty) results, e.g. yolo_inference.is_ready during a background load.
+    """
+
+    def __init__(self, detect_fn: Callable[[list], list], max_batch: int = 8, batch_timeout: float = 0.01,
+                 max_pending_per_stream: int = 2, on_error: Optional[Callable[[str], None]] = None,
+                 ready_fn: Optional[Callable[[], bool]] = None):
+        self.detect_fn = detect_fn
+        self.max_batch = max(1, int(max_batch))
+        self.batch_timeout = batch_timeout
+        self.max_pending_per_stream = max(1, int(max_pending_per_stream))
+        self.on_error = on_error or (lambda msg: None)
+        self.ready_fn = ready_fn or (lambda: True)
+
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # per-stream counters for /status
+        self._frames = {}
+        self._wait_ms = {}
+        self.batches = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._worker, name='inference-engine', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(2.0)
+            self._thread = None
+
+    def ready(self) -> bool:
+        """Whether detect_fn returns real detections yet."""
+        return self.ready_fn()
+
+    def infer(self, stream_id: str, images: list, imgsz: int = 640) -> list:
+        """
+        Runs detect_fn over images at imgsz on behalf of stream_id; blocks until the results are ready.
+
+        More images than max_batch are queued as several requests of at most max_batch
+        each, so detect_fn never sees a bigger batch and other streams get their turns
+        in between; the results come back in input order.
+        """
+        if not images:
+            return []
+        images = list(images)
+        requests = []
+        for i in range(0, len(images), self.max_batch):
+            req = _Request(stream_id, images[i:i + self.max_batch], imgsz)
+            with self._cond:
+                q = self._queues.setdefault(stream_id, deque())
+                while len(q) >= self.max_pending_per_stream and not self._stop.is_set():
+                    self._cond.wait(0.5)
+                if self._stop.is_set():
+                    raise RuntimeError("InferenceEngine is stopped")
+                q.append(req)
+                self._cond.notify_all()
+            requests.append(req)
+        results = []
+        for req in requests:
+            req.done.wait()
+            if req.error is not None:
+                raise req.error
+            results.extend(req.results)
+        return results
+
+    def _pending_images(self) -> int:
+        return sum(len(r.images) for q in self._queues.values() for r in q)
+
+    def _take_fair_batch(self) -> List[_Request]:
+        # round-robin over streams, one request per stream per pass; a batch shares one
+        # input size, set by the first request taken
+        batch, count = [], 0
+        while count < self.max_batch:
+            took = False
+            for stream_id in list(self._queues):
+                q = self._queues[stream_id]
+                if not q:
+                    continue
+                if batch and (count + len(q[0].images) > self.max_batch or q[0].imgsz != batch[0].imgsz):
+                    continue
+                req = q.popleft()
+                batch.append(req)
+                count += len(req.images)
+                took = True
+                # rotate so the next batch starts with the following stream
+                self._queues.move_to_end(stream_id)
+                if count >= self.max_batch:
+                    break
+            if not took:
+                break
+        return batch
+
+    def _worker(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._stop.is_set() and self._pending_images() == 0:
+                    self._cond.wait(0.5)
+                if self._stop.is_set():
+                    break
+                # give other streams a moment to join the batch
+                deadline = time.time() + self.batch_timeout
+                while self._pending_images() < self.max_batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_fair_batch()
+                self._cond.notify_all()
+
+            images = [img for req in batch for img in req.images]
+            started = time.time()
+            try:
+                results = self.detect_fn(images, imgsz=batch[0].imgsz)
+            except Exception as e:
+                self.on_error(f"[Engine] inference error: {e}")
+                for req in batch:
+                    req.error = e
+                    req.done.set()
+                continue
+            self.batches += 1
+
+            i = 0
+            for req in batch:
+                n = len(req.images)
+                req.results = results[i:i + n]
+                i += n
+                self._frames[req.stream_id] = self._frames.get(req.stream_id, 0) + n
+                self._wait_ms[req.stream_id] = (started - req.submitted) * 1000
+                req.done.set()
+
+        # release anyone still waiting
+        with self._cond:
+            for q in self._queues.values():
+                while q:
+                    req = q.popleft()
+                    req.error = RuntimeError("InferenceEngine stopped")
+                    req.done.set()
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending = {sid: len(q) for sid, q in self._queues.items()}
+        return {
+            'batches': self.batches,
+            'streams': {
+                sid: {
+                    'frames_inferred': self._frames.get(sid, 0),
+                    'pending_requests': pending.get(sid, 0),
+                    'last_queue_wait_ms': round(self._wait_ms.get(sid, 0.0), 1),
+                }
+                for sid in pending
+            },
+        }
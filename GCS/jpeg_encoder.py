@@ -0,0 +1,216 @@
+"""
+JPEG output for MJPEG viewers: a pooled encoder, per-frame renditions and per-viewer
+quality adaptation.
+
+ - JpegEncoder uses libjpeg-turbo through PyTurboJPEG when it is installed (one
+   compressor handle per worker thread, fast DCT, 4:2:0), and cv2.imencode otherwise.
+ - RenditionCache wraps one published frame. Each (rendition, quality) is encoded at
+   most once, the first time a viewer asks for it, and the multipart chunk is shared
+   by every viewer that wants the same version. Renditions are the frame as processed
+   ('full') and a downscaled 'preview'. Once a newer frame replaces it, release()
+   hands the image back (to its buffer pool); versions not encoded by then never are.
+ - ViewerQuality picks the (rendition, quality) for one viewer from QUALITY_LADDER so
+   its stream fits a bandwidth budget: the viewer's max_kbps, or the throughput its
+   connection actually achieved when writes start blocking. It steps down as soon as
+   frames are over budget and back up once the better step would fit comfortably.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+try:
+    from turbojpeg import TJFLAG_FASTDCT, TJPF_BGR, TJSAMP_420, TurboJPEG
+except Exception:
+    TurboJPEG = None
+
+# rendition -> maximum width in pixels (None: the processed frame as-is)
+RENDITIONS = {'full': None, 'preview': 640}
+DEFAULT_KEY = ('full', 80)
+# (rendition, quality) from best to smallest, walked by ViewerQuality
+QUALITY_LADDER = (('full', 80), ('full', 65), ('full', 50), ('preview', 75), ('preview', 60),
+                  ('preview', 45), ('preview', 30))
+# sends faster than this went straight into socket buffers and say nothing about the link
+_BLOCKED_SEND_S = 0.005
+
+Key = Tuple[str, int]
+
+
+class JpegEncoder:
+    """Thread-safe BGR -> JPEG encoder."""
+
+    def __init__(self, prefer_turbo: bool = True):
+        self._local = threading.local()
+        self.backend = 'opencv'
+        if prefer_turbo and TurboJPEG is not None:
+            try:
+                TurboJPEG()
+                self.backend = 'turbojpeg'
+            except Exception:
+                # PyTurboJPEG installed but the libjpeg-turbo shared library is missing
+                pass
+        self.frames_encoded = 0
+        self.bytes_encoded = 0
+
+    def _turbo(self):
+        handle = getattr(self._local, 'turbo', None)
+        if handle is None:
+            handle = self._local.turbo = TurboJPEG()
+        return handle
+
+    def encode(self, img: np.ndarray, quality: int) -> Optional[bytes]:
+        if self.backend == 'turbojpeg':
+            jpg = self._turbo().encode(img, quality=quality, pixel_format=TJPF_BGR,
+                                       jpeg_subsample=TJSAMP_420, flags=TJFLAG_FASTDCT)
+        else:
+            ret, buf = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+            if not ret:
+                return None
+            jpg = buf.tobytes()
+        self.frames_encoded += 1
+        self.bytes_encoded += len(jpg)
+        return jpg
+
+
+class RenditionCache:
+    """
+    Args:
+        img (np.ndarray): the frame (BGR); kept until the cache is dropped.
+        encoder (JpegEncoder): shared encoder.
+        wrap (callable): turns JPEG bytes into what viewers send (e.g. mjpeg_chunk).
+        on_release (callable): takes the image back on release() (e.g. BufferPool.release).
+        on_encode (callable): on_encode(ms) after each encode (scaling included), for metrics.
+    """
+
+    def __init__(self, img: np.ndarray, encoder: JpegEncoder, wrap: Callable[[bytes], bytes],
+                 on_release: Optional[Callable[[np.ndarray], None]] = None,
+                 on_encode: Optional[Callable[[float], None]] = None):
+        self.img = img
+        self.encoder = encoder
+        self.wrap = wrap
+        self.on_release = on_release
+        self.on_encode = on_encode
+        self._chunks: Dict[Key, Optional[bytes]] = {}
+        self._scaled: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def cached(self, key: Key) -> Optional[bytes]:
+        return self._chunks.get(key)
+
+    def get(self, key: Key) -> Optional[bytes]:
+        """The chunk for (rendition, quality), encoding it if nobody asked for it before."""
+        chunk = self._chunks.get(key)
+        if chunk is not None or key in self._chunks:
+            return chunk
+        with self._lock:
+            if self.img is None:
+                # superseded by a newer frame before anyone asked for this version
+                return self._chunks.get(key)
+            if key not in self._chunks:
+                started = time.perf_counter()
+                jpg = self.encoder.encode(self._rendition(key[0]), key[1])
+                self._chunks[key] = self.wrap(jpg) if jpg is not None else None
+                if self.on_encode is not None:
+                    self.on_encode((time.perf_counter() - started) * 1000)
+            return self._chunks[key]
+
+    def release(self):
+        """Gives the image back once a newer frame replaced this one; encoded chunks stay available."""
+        # under the lock, so an encode still reading the image finishes first
+        with self._lock:
+            img, self.img = self.img, None
+            self._scaled.clear()
+        if img is not None and self.on_release is not None:
+            self.on_release(img)
+
+    def _rendition(self, name: str) -> np.ndarray:
+        max_width = RENDITIONS[name]
+        height, width = self.img.shape[:2]
+        if max_width is None or width <= max_width:
+            return self.img
+        scaled = self._scaled.get(name)
+        if scaled is None:
+            size = (max_width, int(round(height * max_width / width)))
+            scaled = self._scaled[name] = cv2.resize(self.img, size, interpolation=cv2.INTER_AREA)
+        return scaled
+
+
+class ViewerQuality:
+    """
+    Args:
+        max_kbps (float): bandwidth target for this viewer; None adapts to the link only.
+        fps (float): frames per second the viewer is sent.
+        rendition (str): best rendition allowed ('preview' keeps the viewer on the small one).
+        quality (int): starting and best JPEG quality.
+    """
+
+    def __init__(self, max_kbps: Optional[float] = None, fps: float = 10.0, rendition: str = 'full',
+                 quality: Optional[int] = None):
+        if rendition not in RENDITIONS:
+            raise ValueError(f"unknown rendition {rendition!r}")
+        best = RENDITIONS[rendition] or 1 << 30
+        self.ladder = [(r, q) for r, q in QUALITY_LADDER
+                       if (RENDITIONS[r] or 1 << 30) <= best and (quality is None or q <= quality)]
+        if quality is not None and (rendition, quality) not in self.ladder:
+            self.ladder.insert(0, (rendition, quality))
+        self.max_kbps = max_kbps
+        self.fps = fps
+        self.step = 0
+        self._sizes: Dict[Key, float] = {}
+        self._throughput = None
+        self._good_frames = 0
+
+    @property
+    def key(self) -> Key:
+        return self.ladder[self.step]
+
+    def budget(self) -> Optional[float]:
+        """Bytes per frame the viewer can take, or None if unlimited."""
+        rates = [r for r in (self.max_kbps * 125 if self.max_kbps else None, self._throughput) if r]
+        return min(rates) / self.fps if rates else None
+
+    def observe(self, size: int, send_seconds: float):
+        """Records a sent frame (its size and how long writing it took) and adapts the step."""
+        key = self.key
+        prev = self._sizes.get(key)
+        self._sizes[key] = size if prev is None else prev * 0.7 + size * 0.3
+
+        if send_seconds > _BLOCKED_SEND_S:
+            rate = size / send_seconds
+            self._throughput = rate if self._throughput is None else self._throughput * 0.7 + rate * 0.3
+        elif self._throughput is not None:
+            # writes no longer block: let the estimate recover, then forget it
+            self._throughput *= 1.05
+            if self._throughput > 20 * size * self.fps:
+                self._throughput = None
+
+        budget = self.budget()
+        if budget is None:
+            self._good_frames = 0
+            if self.step:
+                self.step -= 1
+            return
+        if self._sizes[key] > budget and self.step < len(self.ladder) - 1:
+            self.step += 1
+            self._good_frames = 0
+            return
+        if self.step:
+            better = self.ladder[self.step - 1]
+            # unknown sizes are assumed one and a half times the current step's
+            estimate = self._sizes.get(better, self._sizes[key] * 1.5)
+            self._good_frames = self._good_frames + 1 if estimate < 0.8 * budget else 0
+            if self._good_frames >= self.fps:
+                self.step -= 1
+                self._good_frames = 0
+
+    def stats(self) -> dict:
+        rendition, quality = self.key
+        budget = self.budget()
+        return {
+            'rendition': rendition,
+            'quality': quality,
+            'budget_kbps': round(budget * self.fps / 125, 1) if budget else None,
+        }
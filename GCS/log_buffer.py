@@ -0,0 +1,190 @@
+"""
+Bounded in-memory log for the GCS server, safe to write from any thread.
+
+Entries ({'seq', 'timestamp', 'level', 'message'}) go into a preallocated ring of
+`capacity` slots. Every entry gets the next number of a monotonic sequence, and
+writing it is a single slot assignment. Writers take no lock, and a new entry
+overwrites the oldest one. Readers copy the ring and return entries after a given
+seq, in order (since()). A poller keeps its last seq and only ever gets new entries.
+
+An identical (level, message) within `repeat_window` seconds of the first one is
+only counted. Once the window has passed, one summary entry reports the count ('repeats'):
+with the next occurrence, or, if the message stopped, from a sweep that runs at most
+once a second on later log() calls, on every since() query, and in the stdout writer.
+A decode-error storm therefore costs one dict lookup per message, not a line of
+output per frame.
+
+Entries below `min_level` are dropped. stdout gets a copy of each entry through a
+queue and a background thread, so a slow terminal or pipe never blocks the caller.
+Lines beyond STDOUT_QUEUE_MAX waiting are dropped and counted.
+"""
+
+import itertools
+import queue
+import sys
+import threading
+import time
+from typing import List, Optional
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+STDOUT_QUEUE_MAX = 10000
+# distinct messages tracked for repeat coalescing before the table is reset
+_MAX_TRACKED = 4096
+_STOP = object()
+
+
+class LogBuffer:
+    """
+    Args:
+        capacity (int): entries kept.
+        min_level (str): entries below this level are dropped.
+        repeat_window (float): seconds during which a repeated message is only counted (0 disables).
+        echo (bool): also write entries to stdout (from a background thread).
+    """
+
+    def __init__(self, capacity: int = 1000, min_level: str = 'info', repeat_window: float = 5.0,
+                 echo: bool = True):
+        if min_level not in LEVELS:
+            raise ValueError(f"min_level must be one of {list(LEVELS)}, got {min_level!r}")
+        self.capacity = capacity
+        self.min_level = LEVELS[min_level]
+        self.repeat_window = repeat_window
+        self._ring: List[Optional[dict]] = [None] * capacity
+        self._seq = itertools.count(1)
+        self.last_seq = 0
+        # (level, message) -> [window start, suppressed count]
+        self._repeats = {}
+        self._last_sweep = time.time()
+
+        # counters (best effort: increments from racing threads may be lost)
+        self.suppressed = 0
+        self.stdout_dropped = 0
+
+        self._out = queue.SimpleQueue() if echo else None
+        self._thread = None
+        if echo:
+            self._thread = threading.Thread(target=self._stdout_loop, name='log-writer', daemon=True)
+            self._thread.start()
+
+    # ---------------------------------------------
+    # WRITING (any thread)
+    # ---------------------------------------------
+    def log(self, msg: str, level: str = 'info'):
+        if LEVELS.get(level, LEVELS['info']) < self.min_level:
+            return
+        now = time.time()
+        if self.repeat_window > 0:
+            key = (level, msg)
+            state = self._repeats.get(key)
+            if state is not None:
+                if now - state[0] < self.repeat_window:
+                    state[1] += 1
+                    self.suppressed += 1
+                    return
+                self._end_repeats(key, state, now)
+            elif now - self._last_sweep >= 1.0:
+                # summaries of messages that stopped repeating, whether or not anyone echoes
+                self._last_sweep = now
+                self._flush_repeats()
+            if len(self._repeats) >= _MAX_TRACKED:
+                # report pending counts before forgetting them
+                self._flush_repeats(everything=True)
+                self._repeats.clear()
+            self._repeats[key] = [now, 0]
+        self._append(now, level, msg)
+
+    def _append(self, now: float, level: str, msg: str, repeats: int = 0):
+        seq = next(self._seq)
+        entry = {'seq': seq, 'timestamp': now, 'level': level, 'message': msg}
+        if repeats:
+            entry['repeats'] = repeats
+        self._ring[seq % self.capacity] = entry
+        if seq > self.last_seq:
+            self.last_seq = seq
+        if self._out is not None:
+            if self._out.qsize() < STDOUT_QUEUE_MAX:
+                self._out.put(msg)
+            else:
+                self.stdout_dropped += 1
+
+    def _end_repeats(self, key, state, now: float):
+        # pop() is atomic: whichever thread removes this state reports its count, once
+        if self._repeats.pop(key, None) is state and state[1]:
+            level, msg = key
+            self._append(now, level, f"{msg} (repeated {state[1]}x in {now - state[0]:.0f}s)", state[1])
+
+    # ---------------------------------------------
+    # READING (any thread)
+    # ---------------------------------------------
+    def since(self, seq: int = 0, min_level: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        """
+        Entries with a sequence number above seq, oldest first.
+
+        Entries overwritten in the meantime are skipped, so the first seq returned
+        can jump ahead. min_level filters by level, and limit keeps the newest
+        entries.
+        """
+        if self.repeat_window > 0:
+            self._flush_repeats()
+        ring = list(self._ring)
+        newest = max((e['seq'] for e in ring if e is not None), default=0)
+        entries = []
+        for s in range(max(seq + 1, newest - self.capacity + 1), newest + 1):
+            entry = ring[s % self.capacity]
+            if entry is None or entry['seq'] != s:
+                # numbered but not written yet: stop, so a poller does not skip it
+                break
+            entries.append(entry)
+        if min_level is not None:
+            threshold = LEVELS[min_level]
+            entries = [e for e in entries if LEVELS.get(e['level'], 0) >= threshold]
+        if limit is not None:
+            entries = entries[-limit:] if limit > 0 else []
+        return entries
+
+    def __len__(self) -> int:
+        return min(self.last_seq, self.capacity)
+
+    def stats(self) -> dict:
+        return {
+            'entries': len(self),
+            'last_seq': self.last_seq,
+            'suppressed': self.suppressed,
+            'stdout_dropped': self.stdout_dropped,
+        }
+
+    # ---------------------------------------------
+    # STDOUT WRITER
+    # ---------------------------------------------
+    def _stdout_loop(self):
+        last_flush = time.time()
+        while True:
+            try:
+                line = self._out.get(timeout=1.0)
+            except queue.Empty:
+                line = None
+            if line is _STOP:
+                break
+            if line is not None:
+                sys.stdout.write(line + '\n')
+                if self._out.empty():
+                    sys.stdout.flush()
+            if time.time() - last_flush >= 1.0:
+                self._flush_repeats()
+                last_flush = time.time()
+        sys.stdout.flush()
+
+    def _flush_repeats(self, everything: bool = False):
+        """Reports messages that stopped repeating (or all pending counts), and forgets quiet ones."""
+        now = time.time()
+        for key, state in list(self._repeats.items()):
+            if everything or now - state[0] >= self.repeat_window:
+                self._end_repeats(key, state, now)
+
+    def close(self):
+        """Writes out pending repeat counts and stdout lines."""
+        self._flush_repeats(everything=True)
+        if self._thread is not None:
+            self._out.put(_STOP)
+            self._thread.join(2.0)
+            self._thread = None
@@ -0,0 +1,220 @@
+"""
+Per-stage latency metrics.
+
+Every frame carries wall-clock stamps (time.time()) taken as it moves from the socket
+to the viewers. The session turns consecutive stamps into stage durations and feeds
+them to a StageMetrics, one RollingHistogram per stage:
+
+    network     capture on the drone -> first bytes read from the socket (needs capture stamps)
+    demux       socket read -> TS packet out of the demuxer
+    decode      packet -> decoded frame
+    queue_wait  time spent waiting in the frame ring and between pipeline stages
+    preprocess, inference, annotate   time inside each pipeline stage
+    encode      one JPEG encode of a (frame, rendition), timed when a viewer first fetches it
+    publish     annotate done -> frame handed to the viewers (output stage and reordering)
+    send        publish -> frame written to a viewer's connection (per viewer)
+    total       socket read -> written to a viewer
+    glass_to_glass  capture on the drone -> written to a viewer (needs capture stamps)
+
+RollingHistogram keeps log-spaced buckets (~10% wide) for a sliding window of
+`window` seconds, split into sub-windows that are recycled as time moves on. observe()
+is a bisect plus one list increment and takes no lock; with several writers a rare
+increment may be lost, which does not matter for percentiles. Quantiles are read from
+the buckets, so p50/p95/p99 are accurate to about one bucket width.
+
+render_prometheus() writes everything in the Prometheus text exposition format
+(summaries with quantile labels), for GET /metrics. FrameTracer optionally appends
+one JSON line per frame with all its stamps, for offline analysis.
+"""
+
+import bisect
+import json
+import math
+import threading
+import time
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+# bucket upper bounds in ms: 0.05 ms .. 60 s, ~10% apart
+_BOUNDS_MS = [0.05 * (1.1 ** i) for i in range(int(math.log(60000 / 0.05, 1.1)) + 2)]
+QUANTILES = (0.5, 0.95, 0.99)
+
+STAGES = ('network', 'demux', 'decode', 'queue_wait', 'preprocess', 'inference', 'annotate', 'encode',
+          'publish', 'send', 'total', 'glass_to_glass')
+
+
+class RollingHistogram:
+    """
+    Args:
+        window (float): seconds of history the quantiles cover.
+        sub_windows (int): granularity of the sliding window.
+    """
+
+    def __init__(self, window: float = 60.0, sub_windows: int = 6):
+        self.sub_seconds = window / sub_windows
+        self._counts = [[0] * (len(_BOUNDS_MS) + 1) for _ in range(sub_windows)]
+        self._epochs = [-1] * sub_windows
+        # lifetime totals, as Prometheus summaries expect
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, ms: float, now: Optional[float] = None):
+        epoch = int((now or time.time()) / self.sub_seconds)
+        i = epoch % len(self._counts)
+        if self._epochs[i] != epoch:
+            # recycle the sub-window that fell out of the window
+            self._counts[i] = [0] * (len(_BOUNDS_MS) + 1)
+            self._epochs[i] = epoch
+        self._counts[i][bisect.bisect_left(_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+    def _window_counts(self, now: float):
+        epoch = int(now / self.sub_seconds)
+        totals = [0] * (len(_BOUNDS_MS) + 1)
+        for e, counts in zip(self._epochs, self._counts):
+            if 0 <= epoch - e < len(self._counts):
+                for b, c in enumerate(counts):
+                    totals[b] += c
+        return totals
+
+    def quantiles(self, qs: Sequence[float] = QUANTILES, now: Optional[float] = None) -> Tuple[int, Dict[float, float]]:
+        """(samples in the window, {q: value in ms}); values are None for an empty window."""
+        counts = self._window_counts(now or time.time())
+        n = sum(counts)
+        if not n:
+            return 0, {q: None for q in qs}
+        out = {}
+        for q in qs:
+            target, seen = q * n, 0
+            for b, c in enumerate(counts):
+                if c and seen + c >= target:
+                    # interpolate inside the bucket
+                    lo = _BOUNDS_MS[b - 1] if b > 0 else 0.0
+                    hi = _BOUNDS_MS[b] if b < len(_BOUNDS_MS) else _BOUNDS_MS[-1]
+                    out[q] = lo + (hi - lo) * (target - seen) / c
+                    break
+                seen += c
+        return n, out
+
+
+class StageMetrics:
+    """Rolling histograms for the STAGES of one stream."""
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self._histograms = {stage: RollingHistogram(window) for stage in STAGES}
+
+    def observe(self, stage: str, ms: float, now: Optional[float] = None):
+        if ms is not None and ms >= 0:
+            self._histograms[stage].observe(ms, now)
+
+    def observe_frame(self, durations: Dict[str, Optional[float]], now: Optional[float] = None):
+        now = now or time.time()
+        for stage, ms in durations.items():
+            self.observe(stage, ms, now)
+
+    def snapshot(self) -> dict:
+        """{stage: {'count', 'p50', 'p95', 'p99'}} over the window, for JSON status."""
+        now = time.time()
+        out = {}
+        for stage, h in self._histograms.items():
+            n, qs = h.quantiles(now=now)
+            if n:
+                out[stage] = {'count': n, **{f"p{int(q * 100)}": round(v, 2) for q, v in qs.items()}}
+        return out
+
+    def items(self):
+        return self._histograms.items()
+
+
+def frame_durations(t: Dict[str, float]) -> Dict[str, Optional[float]]:
+    """
+    Stage durations in ms from a frame's stamps (see StreamSession). Stamps a frame
+    did not get (no capture time, no inference) yield None.
+    """
+    def span(a, b):
+        return (t[b] - t[a]) * 1000 if t.get(a) is not None and t.get(b) is not None else None
+
+    waits = [span('decode', 'preprocess_start'), span('preprocess_end', 'infer_start'),
+             span('infer_end', 'annotate_start')]
+    return {
+        'network': span('capture', 'receive'),
+        'demux': span('receive', 'demux'),
+        'decode': span('demux', 'decode'),
+        'queue_wait': sum(w for w in waits if w is not None) if any(w is not None for w in waits) else None,
+        'preprocess': span('preprocess_start', 'preprocess_end'),
+        'inference': span('infer_start', 'infer_end') if t.get('inferred') else None,
+        'annotate': span('annotate_start', 'annotate_end'),
+        # 'encode' is observed per JPEG encode, outside the pipeline (see RenditionCache)
+        'publish': span('annotate_end', 'publish'),
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_prometheus(streams: Dict[str, StageMetrics],
+                      gauges: Iterable[Tuple[str, str, str, Dict[str, str], float]] = ()) -> str:
+    """
+    Prometheus text format for all streams' stage latencies plus extra samples.
+
+    Args:
+        streams: {stream_id: StageMetrics}.
+        gauges: (name, type, help, labels, value) tuples, e.g. frame counters.
+    """
+    lines = [
+        '# HELP gcs_stage_latency_ms Per-frame latency of each processing stage (rolling window quantiles).',
+        '# TYPE gcs_stage_latency_ms summary',
+    ]
+    now = time.time()
+    for stream_id, metrics in streams.items():
+        for stage, h in metrics.items():
+            if not h.count:
+                continue
+            labels = f'stream="{_escape(stream_id)}",stage="{stage}"'
+            _, qs = h.quantiles(now=now)
+            for q, v in qs.items():
+                if v is not None:
+                    lines.append(f'gcs_stage_latency_ms{{{labels},quantile="{q}"}} {v:.3f}')
+            lines.append(f'gcs_stage_latency_ms_sum{{{labels}}} {h.sum_ms:.3f}')
+            lines.append(f'gcs_stage_latency_ms_count{{{labels}}} {h.count}')
+
+    declared = set()
+    for name, kind, help_text, labels, value in gauges:
+        if value is None:
+            continue
+        if name not in declared:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            declared.add(name)
+        label_text = ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items())
+        lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class FrameTracer:
+    """Appends one JSON line per frame (stream, seq, stamps relative to the first stamp, durations) to path."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', buffering=1)
+        self._lock = threading.Lock()
+
+    def write(self, stream_id: str, seq: int, stamps: Dict[str, float], durations: Dict[str, Optional[float]]):
+        numeric = {k: v for k, v in stamps.items() if isinstance(v, float)}
+        origin = min(numeric.values()) if numeric else 0.0
+        record = {
+            'stream': stream_id,
+            'seq': seq,
+            'origin': round(origin, 6),
+            'stamps_ms': {k: round((v - origin) * 1000, 3) for k, v in numeric.items()},
+            'durations_ms': {k: round(v, 3) for k, v in durations.items() if v is not None},
+        }
+        line = json.dumps(record, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
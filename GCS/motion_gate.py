@@ -0,0 +1,149 @@
+"""
+Motion gating for inference: skip the detector on frames where nothing changed.
+
+MotionGate compares each candidate frame's luma thumbnail (see adaptive.motion_thumbnail)
+with the thumbnail of the frame that last ran inference. Global camera motion is
+estimated first and the reference is translated by it, so a slowly drifting hover
+does not count as change. The remaining per-pixel differences are pooled into a
+coarse grid of cells:
+
+ - no changed cell          -> 'skip': reuse the previous detections
+ - a few changed regions    -> 'roi':  run the detector only on crops around them
+ - widespread change        -> 'full': run the detector on the whole frame
+
+A full pass is still forced every `refresh_frames` frames (new objects that enter
+slowly, lighting drift, and a bounded age for reused detections) and whenever the
+camera moved more than `max_shift` of the frame width.
+"""
+
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from adaptive import estimate_shift
+
+Region = Tuple[int, int, int, int]
+
+
+class MotionGate:
+    """
+    Args:
+        pixel_threshold (float): luma difference (0-255) for a thumbnail pixel to count as changed.
+        cell_fraction (float): share of changed pixels for a grid cell to count as changed.
+        grid (Tuple[int, int]): (columns, rows) of the change grid.
+        refresh_frames (int): force a full-frame inference at least this often (in frames).
+        max_shift (float): camera motion, as a fraction of the width, above which the frame is always inferred.
+        roi_max_area (float): largest share of the frame the ROIs may cover before a full pass is cheaper.
+        max_regions (int): most ROIs per frame; more changed regions mean a full pass.
+        roi (bool): when False, changed frames always get a full pass.
+    """
+
+    def __init__(self, pixel_threshold: float = 12.0, cell_fraction: float = 0.03, grid: Tuple[int, int] = (8, 6),
+                 refresh_frames: int = 30, max_shift: float = 0.05, roi_max_area: float = 0.5,
+                 max_regions: int = 4, roi: bool = True):
+        self.pixel_threshold = pixel_threshold
+        self.cell_fraction = cell_fraction
+        self.grid = grid
+        self.refresh_frames = refresh_frames
+        self.max_shift = max_shift
+        self.roi_max_area = roi_max_area
+        self.max_regions = max_regions
+        self.roi = roi
+
+        self._reference = None
+        self._reference_seq = None
+        self._full_seq = None
+        # counters for /status
+        self.executed_full = 0
+        self.executed_roi = 0
+        self.gated = 0
+        self.forced_refreshes = 0
+
+    def reset(self):
+        self._reference = None
+        self._reference_seq = None
+        self._full_seq = None
+
+    def check(self, seq: int, thumb: np.ndarray, frame_size: Tuple[int, int]) -> Tuple[str, Optional[List[Region]]]:
+        """
+        Decides how frame seq (with luma thumbnail thumb) should be inferred.
+
+        Must be called in frame order. frame_size is the full frame's (width, height).
+
+        Returns:
+            ('full', None), ('roi', [(x1, y1, x2, y2), ...]) in full-frame pixels, or ('skip', None).
+        """
+        decision, regions = self._decide(seq, thumb, frame_size)
+        if decision == 'skip':
+            self.gated += 1
+            return decision, None
+        # the next comparison is against what the detector has now seen
+        self._reference = thumb
+        self._reference_seq = seq
+        if decision == 'full':
+            self._full_seq = seq
+            self.executed_full += 1
+        else:
+            self.executed_roi += 1
+        return decision, regions
+
+    def _decide(self, seq, thumb, frame_size):
+        ref = self._reference
+        if ref is None or ref.shape != thumb.shape or seq < self._reference_seq:
+            return 'full', None
+        if self._full_seq is None or seq - self._full_seq >= self.refresh_frames:
+            self.forced_refreshes += 1
+            return 'full', None
+
+        th, tw = thumb.shape
+        dx, dy = estimate_shift(ref, thumb, tw)
+        if abs(dx) > self.max_shift * tw or abs(dy) > self.max_shift * tw:
+            return 'full', None
+
+        # translate the reference onto the current view and ignore the uncovered border
+        shifted = cv2.warpAffine(ref, np.float32([[1, 0, dx], [0, 1, dy]]), (tw, th), borderMode=cv2.BORDER_REPLICATE)
+        changed = (cv2.absdiff(shifted, thumb) > self.pixel_threshold).astype(np.float32)
+        bx, by = int(np.ceil(abs(dx))) + 1, int(np.ceil(abs(dy))) + 1
+        changed[:by, :] = 0
+        changed[th - by:, :] = 0
+        changed[:, :bx] = 0
+        changed[:, tw - bx:] = 0
+
+        cols, rows = self.grid
+        cells = cv2.resize(changed, (cols, rows), interpolation=cv2.INTER_AREA) > self.cell_fraction
+        if not cells.any():
+            return 'skip', None
+        if not self.roi:
+            return 'full', None
+        return self._regions(cells, frame_size)
+
+    def _regions(self, cells: np.ndarray, frame_size):
+        # grow changed cells by one so objects straddling a cell edge are fully inside a crop
+        grown = cv2.dilate(cells.astype(np.uint8), np.ones((3, 3), np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(grown, connectivity=8)
+        if count - 1 > self.max_regions:
+            return 'full', None
+
+        width, height = frame_size
+        rows, cols = cells.shape
+        cw, ch = width / cols, height / rows
+        regions, area = [], 0
+        for x, y, w, h, _ in stats[1:]:
+            x1, y1 = int(x * cw), int(y * ch)
+            x2, y2 = min(width, int(np.ceil((x + w) * cw))), min(height, int(np.ceil((y + h) * ch)))
+            regions.append((x1, y1, x2, y2))
+            area += (x2 - x1) * (y2 - y1)
+        if area > self.roi_max_area * width * height:
+            return 'full', None
+        return 'roi', regions
+
+    def stats(self) -> dict:
+        considered = self.executed_full + self.executed_roi + self.gated
+        return {
+            'executed_full': self.executed_full,
+            'executed_roi': self.executed_roi,
+            'gated': self.gated,
+            'forced_refreshes': self.forced_refreshes,
+            'gated_ratio': round(self.gated / considered, 3) if considered else None,
+        }
@@ -0,0 +1,176 @@
+"""
+Staged frame-processing pipeline.
+
+A Pipeline is a chain of Stages connected by bounded queues. Each stage runs on its
+own pool of worker threads, so CPU-bound work that releases the GIL (OpenCV resize,
+drawing, JPEG encoding, YOLO inference) overlaps across stages and cores.
+
+Frame order is preserved: every submitted job gets a pipeline sequence number, and
+each stage hands its results downstream through a reorder buffer that only releases
+job N after job N-1. A stage that decides to discard a job sets `job.dropped`; the job
+still flows through (as a no-op) so that downstream stages never wait for a gap.
+
+Bounded queues give natural back-pressure: when inference falls behind, `submit`
+blocks and the caller decides what to drop upstream.
+"""
+
+import itertools
+import queue
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class FrameJob:
+    """One frame moving through the pipeline. Stages attach their outputs as attributes."""
+
+    def __init__(self, img, recv_time: float):
+        self.seq = -1
+        self.img = img
+        self.recv_time = recv_time
+        self.dropped = False
+
+
+def collect_batch(q: queue.Queue, max_size: int, timeout: float, first_timeout: float = 0.5) -> list:
+    """Blocks for the first item of q, then gathers more until max_size items or the deadline."""
+    try:
+        batch = [q.get(timeout=first_timeout)]
+    except queue.Empty:
+        return []
+    deadline = time.time() + timeout
+    while len(batch) < max_size:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(q.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+class Stage:
+    """
+    A pipeline step.
+
+    Args:
+        name (str): used in thread names and error messages.
+        fn (callable): fn(jobs) processes a list of FrameJob in place. The list holds a
+            single job unless batch_size > 1. Dropped jobs are filtered out beforehand.
+        workers (int): number of worker threads.
+        depth (int): capacity of the stage's input queue.
+        batch_size (int): maximum jobs handed to fn at once.
+        batch_timeout (float): how long a worker waits to fill a batch, in seconds.
+    """
+
+    def __init__(self, name: str, fn: Callable[[List[FrameJob]], None], workers: int = 1,
+                 depth: int = 4, batch_size: int = 1, batch_timeout: float = 0.0):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, int(workers))
+        self.depth = max(1, int(depth))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_timeout = batch_timeout
+        self.inbox: queue.Queue = queue.Queue(maxsize=self.depth)
+
+
+class _Reorderer:
+    """Releases jobs to `emit` strictly in sequence order."""
+
+    def __init__(self, emit: Callable[[FrameJob], None]):
+        self._emit = emit
+        self._pending = {}
+        self._next_seq = 0
+        self._lock = threading.Lock()
+
+    def push(self, jobs: List[FrameJob]):
+        with self._lock:
+            for job in jobs:
+                self._pending[job.seq] = job
+            while self._next_seq in self._pending:
+                self._emit(self._pending.pop(self._next_seq))
+                self._next_seq += 1
+
+
+class Pipeline:
+    """
+    Runs jobs through stages in order; finished jobs are passed to sink(job) in order.
+
+    Args:
+        stages (List[Stage]): the steps, first to last.
+        sink (callable): receives every job (including dropped ones) after the last stage.
+        stop_event (threading.Event): stops all workers when set.
+        on_error (callable): called with a message when a stage raises; the affected
+            jobs are marked dropped and the pipeline keeps running.
+    """
+
+    def __init__(self, stages: List[Stage], sink: Callable[[FrameJob], None],
+                 stop_event: threading.Event, on_error: Optional[Callable[[str], None]] = None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.sink = sink
+        self.stop_event = stop_event
+        self.on_error = on_error or (lambda msg: None)
+        self._seq = itertools.count()
+        self._threads: List[threading.Thread] = []
+
+        self._reorderers = []
+        for i, stage in enumerate(stages):
+            if i + 1 < len(stages):
+                emit = self._make_put(stages[i + 1].inbox)
+            else:
+                emit = self._deliver
+            self._reorderers.append(_Reorderer(emit))
+
+    def _make_put(self, q: queue.Queue):
+        def put(job):
+            # block on back-pressure, but never past shutdown
+            while not self.stop_event.is_set():
+                try:
+                    q.put(job, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+        return put
+
+    def _deliver(self, job: FrameJob):
+        try:
+            self.sink(job)
+        except Exception as e:
+            self.on_error(f"[Pipeline] sink error: {e}")
+
+    def start(self):
+        for i, stage in enumerate(self.stages):
+            for w in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(stage, self._reorderers[i]),
+                                     name=f"pipeline-{stage.name}-{w}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, job: FrameJob):
+        """Numbers job and queues it for the first stage, blocking while that stage is full."""
+        job.seq = next(self._seq)
+        self._make_put(self.stages[0].inbox)(job)
+
+    def depths(self) -> dict:
+        return {stage.name: stage.inbox.qsize() for stage in self.stages}
+
+    def _worker(self, stage: Stage, reorderer: _Reorderer):
+        while not self.stop_event.is_set():
+            jobs = collect_batch(stage.inbox, stage.batch_size, stage.batch_timeout)
+            if not jobs:
+                continue
+            live = [job for job in jobs if not job.dropped]
+            if live:
+                try:
+                    stage.fn(live)
+                except Exception as e:
+                    self.on_error(f"[Pipeline] {stage.name} stage error: {e}")
+                    for job in live:
+                        job.dropped = True
+            reorderer.push(jobs)
+
+    def join(self, timeout: float = 2.0):
+        for t in self._threads:
+            t.join(timeout)
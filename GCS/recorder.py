@@ -0,0 +1,550 @@
+"""
+Segmented recording of a drone's raw MPEG-TS, with a keyframe index and detections.
+
+The receiver tees every byte it reads from the link into Recorder.feed() (see
+TeeReader). That only appends to a bounded in-memory queue; a writer thread does all
+parsing and disk I/O, so recording never adds latency to the live path. If the disk
+falls behind and the queue fills, data is dropped and the next segment starts at the
+next keyframe.
+
+The writer scans TS packet headers (vectorized; no demuxing or decoding) to find the
+video PID, PAT/PMT and keyframes, and rotates segments on a keyframe once a segment is
+`segment_seconds` long. Per segment, in the stream's directory:
+
+    <name>.ts      the stream bytes as received, starting with PAT + PMT + a keyframe
+    <name>.idx     JSON lines: a header, one {"o": offset, "t": time, "pts": pts} per
+                   keyframe, and {"end": time, "bytes": size} when the segment closes
+    <name>.frames  DET_FRAME_DTYPE records, one per processed frame (time, pts, boxes)
+    <name>.boxes   DET_BOX_DTYPE records referenced by the frame records
+
+Times are wall-clock arrival times (time.time()) and pts is the 90 kHz video PTS. A
+clip from time a to b is PAT + PMT followed by the bytes from the last keyframe at or
+before a to the first keyframe after b, across segments, so it plays on its own.
+Frames with persons are found from the .frames files alone. The oldest segments are
+deleted once the stream's recordings exceed `max_bytes`.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+TS_PACKET_SIZE = 188
+_SYNC = 0x47
+# stream_type values of H.264 / HEVC video in the PMT
+_VIDEO_STREAM_TYPES = (0x1B, 0x24)
+_IDR_MARKERS = (b'\x00\x00\x01\x65', b'\x00\x00\x01\x67', b'\x00\x00\x01\x25', b'\x00\x00\x01\x27')
+
+DET_FRAME_DTYPE = np.dtype([('t', '<f8'), ('pts', '<i8'), ('first', '<u4'), ('count', '<u2'), ('flags', '<u2')])
+DET_BOX_DTYPE = np.dtype([('box', '<u2', (4,)), ('conf', 'u1'), ('cls', 'u1'), ('id', '<i4')])
+_FLAG_INFERRED = 1
+
+
+def _payload(pkt: bytes) -> bytes:
+    afc = (pkt[3] >> 4) & 0x3
+    if afc == 2:
+        return b''
+    if afc == 3:
+        return pkt[5 + pkt[4]:]
+    return pkt[4:]
+
+
+def _pes_pts(payload: bytes) -> Optional[int]:
+    """PTS of a PES packet that starts in this payload, if it has one."""
+    if len(payload) < 14 or payload[:3] != b'\x00\x00\x01' or not payload[7] & 0x80:
+        return None
+    p = payload[9:14]
+    return (((p[0] >> 1) & 0x07) << 30) | (p[1] << 22) | ((p[2] >> 1) << 15) | (p[3] << 7) | (p[4] >> 1)
+
+
+class ClipReader:
+    """Minimal read-only file object over an iterator of byte chunks."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, n: int = -1) -> bytes:
+        while n < 0 or len(self._buffer) < n:
+            data = next(self._chunks, None)
+            if data is None:
+                break
+            self._buffer += data
+        if n < 0:
+            n = len(self._buffer)
+        data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+
+class TeeReader:
+    """Wraps a receiver's reader (see stream_session.py) and copies every chunk it returns into a Recorder."""
+
+    def __init__(self, reader, recorder: "Recorder"):
+        self._reader = reader
+        self._recorder = recorder
+
+    def read(self, n: int) -> bytes:
+        data = self._reader.read(n)
+        if data:
+            self._recorder.feed(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._reader, name)
+
+
+class Recorder:
+    """
+    Args:
+        directory (str): where this stream's segments go (created by start() if needed).
+        segment_seconds (float): segment length; segments are cut at the first keyframe after it.
+        max_bytes (int): total size of the stream's recordings before the oldest segments are deleted.
+        queue_bytes (int): data buffered for the writer before new data is dropped.
+        log (callable): log(msg, level).
+    """
+
+    def __init__(self, directory: str, segment_seconds: float = 60.0, max_bytes: int = 10 * 1024 ** 3,
+                 queue_bytes: int = 16 * 1024 * 1024, log: Callable[..., None] = lambda msg, level='info': None):
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.max_bytes = max_bytes
+        self.queue_bytes = queue_bytes
+        self.log = log
+
+        self._queue = deque()
+        self._queued = 0
+        self._dropping = False
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+        # catalog: closed and open segments, oldest first; guarded by _catalog_lock.
+        # Filled from disk by start(), so constructing a Recorder touches nothing.
+        self._catalog_lock = threading.Lock()
+        self._segments = []
+
+        # writer state (writer thread only)
+        self._partial = b''
+        self._pat = None
+        self._pmt = None
+        self._pmt_pid = None
+        self._video_pid = None
+        self._seg = None
+        self._files = None
+
+        self.bytes_written = 0
+        self.bytes_dropped = 0
+        self.segments_deleted = 0
+
+    # ---------------------------------------------
+    # LIVE SIDE (receiver and pipeline threads): enqueue only
+    # ---------------------------------------------
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._scan()
+        with self._catalog_lock:
+            self._segments = segments
+        self._thread = threading.Thread(target=self._writer, name=f"recorder-{os.path.basename(self.directory)}",
+                                        daemon=True)
+        self._thread.start()
+
+    def feed(self, data: bytes, t: Optional[float] = None):
+        """Queues stream bytes received at time t."""
+        self._put(('data', data, t or time.time()), len(data))
+
+    def discontinuity(self):
+        """The link was re-established: the next bytes are a new stream (new segment at its first keyframe)."""
+        self._put(('reset', True), 0)
+
+    def record_detections(self, t: float, pts: Optional[int], dets: np.ndarray, track_ids: Optional[np.ndarray],
+                          inferred: bool):
+        """Queues one processed frame's detections (DETECTION_DTYPE, frame pixels)."""
+        self._put(('dets', t, pts, dets, track_ids, inferred), 0)
+
+    def _put(self, item, size: int):
+        with self._cond:
+            if self._closed:
+                return
+            if size and self._queued + size > self.queue_bytes:
+                self.bytes_dropped += size
+                if not self._dropping:
+                    self._dropping = True
+                    self._queue.append(('reset', False))
+                self._cond.notify()
+                return
+            if size:
+                # stream data got through again; detections alone do not end a drop
+                self._dropping = False
+            self._queue.append(item)
+            self._queued += size
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(5.0)
+
+    # ---------------------------------------------
+    # WRITER THREAD
+    # ---------------------------------------------
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait(1.0)
+                items = list(self._queue)
+                self._queue.clear()
+                self._queued = 0
+                closed = self._closed
+            try:
+                for item in items:
+                    if item[0] == 'data':
+                        self._write_data(item[1], item[2])
+                    elif item[0] == 'dets':
+                        self._write_detections(*item[1:])
+                    else:
+                        self._close_segment()
+                        self._partial = b''
+                        if item[1]:
+                            self._pat = self._pmt = self._pmt_pid = self._video_pid = None
+                if self._files is not None:
+                    self._files['ts'].flush()
+            except OSError as e:
+                self.log(f"[Recorder] Write error, recording paused until the next keyframe: {e}", 'error')
+                self._close_segment()
+            if closed:
+                self._close_segment()
+                return
+
+    def _write_data(self, data: bytes, t: float):
+        data = self._partial + data
+        start = data.find(bytes([_SYNC]))
+        if start < 0:
+            self._partial = b''
+            return
+        n = (len(data) - start) // TS_PACKET_SIZE
+        end = start + n * TS_PACKET_SIZE
+        self._partial = data[end:]
+        if not n:
+            return
+        packets = np.frombuffer(data, np.uint8, n * TS_PACKET_SIZE, start).reshape(n, TS_PACKET_SIZE)
+        if not (packets[:, 0] == _SYNC).all():
+            # lost alignment: drop up to the first bad packet and resync on the next read
+            bad = int(np.argmin(packets[:, 0] == _SYNC))
+            packets = packets[:bad]
+            self._partial = b''
+        pids = ((packets[:, 1].astype(np.uint16) & 0x1F) << 8) | packets[:, 2]
+        unit_start = (packets[:, 1] & 0x40) != 0
+
+        # only packets that start a table section or a PES are looked at (about one per frame)
+        cuts = []
+        for i in np.nonzero(unit_start)[0]:
+            pid = int(pids[i])
+            if pid == 0:
+                self._parse_pat(packets[i].tobytes())
+            elif pid == self._pmt_pid:
+                self._parse_pmt(packets[i].tobytes())
+            elif pid == self._video_pid:
+                pkt = packets[i].tobytes()
+                if self._is_keyframe(pkt):
+                    cuts.append((int(i), _pes_pts(_payload(pkt))))
+
+        raw = packets.reshape(-1)
+        pos = 0
+        for i, pts in cuts:
+            self._append(raw[pos * TS_PACKET_SIZE:i * TS_PACKET_SIZE])
+            pos = i
+            self._keyframe(t, pts)
+        self._append(raw[pos * TS_PACKET_SIZE:])
+
+    def _is_keyframe(self, pkt: bytes) -> bool:
+        # random_access_indicator, else an IDR/SPS NAL at the start of the access unit
+        if (pkt[3] & 0x20) and pkt[4] > 0 and pkt[5] & 0x40:
+            return True
+        payload = _payload(pkt)
+        return any(marker in payload for marker in _IDR_MARKERS)
+
+    def _parse_pat(self, pkt: bytes):
+        payload = _payload(pkt)
+        if not payload:
+            return
+        section = payload[1 + payload[0]:]
+        if len(section) < 12 or section[0] != 0x00:
+            return
+        self._pat = pkt
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        for i in range(8, min(3 + length - 4, len(section) - 3), 4):
+            if (section[i] << 8) | section[i + 1]:
+                self._pmt_pid = ((section[i + 2] & 0x1F) << 8) | section[i + 3]
+                return
+
+    def _parse_pmt(self, pkt: bytes):
+        payload = _payload(pkt)
+        if not payload:
+            return
+        section = payload[1 + payload[0]:]
+        if len(section) < 16 or section[0] != 0x02:
+            return
+        self._pmt = pkt
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        end = min(3 + length - 4, len(section))
+        i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        while i + 5 <= end:
+            if section[i] in _VIDEO_STREAM_TYPES:
+                self._video_pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+                return
+            i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
+
+    def _keyframe(self, t: float, pts: Optional[int]):
+        seg = self._seg
+        if seg is None or t - seg['start'] >= self.segment_seconds:
+            self._close_segment()
+            if self._pat is None or self._pmt is None:
+                return
+            self._open_segment(t)
+            seg = self._seg
+        entry = {'o': seg['bytes'], 't': round(t, 3), 'pts': pts}
+        seg['keyframes'].append((seg['bytes'], t, pts))
+        seg['end'] = t
+        self._files['idx'].write(json.dumps(entry) + '\n')
+        self._files['idx'].flush()
+
+    def _append(self, data: np.ndarray):
+        if self._files is None or not len(data):
+            return
+        self._files['ts'].write(data.tobytes())
+        self._seg['bytes'] += len(data)
+        self.bytes_written += len(data)
+
+    def _write_detections(self, t, pts, dets, track_ids, inferred):
+        if self._files is None:
+            return
+        boxes = np.zeros(len(dets), DET_BOX_DTYPE)
+        if len(dets):
+            boxes['box'] = np.clip(np.rint(dets['box']), 0, 65535)
+            boxes['conf'] = np.clip(np.rint(dets['conf'] * 255), 0, 255)
+            boxes['cls'] = np.clip(dets['cls'], 0, 255)
+            boxes['id'] = track_ids if track_ids is not None else -1
+        frame = np.zeros(1, DET_FRAME_DTYPE)
+        frame['t'] = t
+        frame['pts'] = pts if pts is not None else -1
+        frame['first'] = self._seg['boxes']
+        frame['count'] = len(dets)
+        frame['flags'] = _FLAG_INFERRED if inferred else 0
+        self._files['frames'].write(frame.tobytes())
+        self._files['boxes'].write(boxes.tobytes())
+        self._seg['boxes'] += len(dets)
+        self._seg['end'] = max(self._seg['end'], t)
+
+    def _open_segment(self, t: float):
+        name = time.strftime('%Y%m%d-%H%M%S', time.localtime(t)) + f"-{int(t * 1000) % 1000:03d}"
+        base = os.path.join(self.directory, name)
+        self._files = {
+            'ts': open(base + '.ts', 'wb', buffering=1024 * 1024),
+            'idx': open(base + '.idx', 'w'),
+            'frames': open(base + '.frames', 'wb', buffering=64 * 1024),
+            'boxes': open(base + '.boxes', 'wb', buffering=64 * 1024),
+        }
+        self._seg = {'name': name, 'start': t, 'end': t, 'bytes': 0, 'boxes': 0, 'keyframes': [], 'open': True}
+        self._files['idx'].write(json.dumps({'segment': name, 'start': round(t, 3)}) + '\n')
+        # every segment starts with the tables a demuxer needs
+        self._append(np.frombuffer(self._pat + self._pmt, np.uint8))
+        with self._catalog_lock:
+            self._segments.append(self._seg)
+
+    def _close_segment(self):
+        if self._files is None:
+            return
+        seg = self._seg
+        self._files['idx'].write(json.dumps({'end': round(seg['end'], 3), 'bytes': seg['bytes']}) + '\n')
+        for f in self._files.values():
+            f.close()
+        self._files = None
+        self._seg = None
+        with self._catalog_lock:
+            seg['open'] = False
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        with self._catalog_lock:
+            total = sum(s['bytes'] for s in self._segments)
+            doomed = []
+            while total > self.max_bytes and len(self._segments) > 1 and not self._segments[0].get('open'):
+                seg = self._segments.pop(0)
+                total -= seg['bytes']
+                doomed.append(seg)
+        for seg in doomed:
+            for ext in ('.ts', '.idx', '.frames', '.boxes'):
+                try:
+                    os.remove(os.path.join(self.directory, seg['name'] + ext))
+                except OSError:
+                    pass
+            self.segments_deleted += 1
+
+    # ---------------------------------------------
+    # CATALOG AND QUERIES (any thread)
+    # ---------------------------------------------
+    def _scan(self) -> list:
+        """Loads the index of segments left by earlier runs."""
+        segments = []
+        for entry in sorted(os.listdir(self.directory)):
+            if not entry.endswith('.idx'):
+                continue
+            name = entry[:-4]
+            try:
+                seg = read_index(os.path.join(self.directory, entry))
+                seg['bytes'] = os.path.getsize(os.path.join(self.directory, name + '.ts'))
+            except OSError:
+                continue
+            seg.update(name=name, boxes=0, open=False)
+            if seg['start'] is not None and seg['keyframes']:
+                segments.append(seg)
+        return segments
+
+    def segments(self) -> List[dict]:
+        with self._catalog_lock:
+            return [
+                {'name': s['name'], 'start': s['start'], 'end': s['end'], 'bytes': s['bytes'],
+                 'keyframes': len(s['keyframes']), 'recording': bool(s.get('open'))}
+                for s in self._segments
+            ]
+
+    def _overlapping(self, start: float, end: float) -> list:
+        with self._catalog_lock:
+            return [dict(s, keyframes=list(s['keyframes'])) for s in self._segments
+                    if s['start'] <= end and s['end'] >= start and s['keyframes']]
+
+    def clip_ranges(self, start: float, end: float) -> List[Tuple[str, int, int, int]]:
+        """
+        Byte ranges that make up the clip [start, end] (wall-clock seconds).
+
+        Returns:
+            [(path, header_bytes, offset, end_offset), ...]: from each segment, its first
+            header_bytes (PAT + PMT) followed by [offset, end_offset).
+        """
+        ranges = []
+        for seg in self._overlapping(start, end):
+            keyframes = seg['keyframes']
+            header = keyframes[0][0]
+            offset = header
+            for o, t, _ in keyframes:
+                if t <= start:
+                    offset = o
+            stop = seg['bytes']
+            for o, t, _ in keyframes:
+                if t > end:
+                    stop = o
+                    break
+            if stop > offset:
+                ranges.append((os.path.join(self.directory, seg['name'] + '.ts'), header, offset, stop))
+        return ranges
+
+    def iter_clip(self, start: float, end: float, chunk_size: int = 256 * 1024) -> Iterator[bytes]:
+        """
+        Yields the MPEG-TS bytes of the clip [start, end] (see clip_ranges).
+
+        Every segment file is opened before the first byte is yielded, so retention
+        deleting one while a client is still downloading cannot cut the clip short;
+        segments already gone by then are left out.
+        """
+        files = []
+        try:
+            for path, header, offset, stop in self.clip_ranges(start, end):
+                try:
+                    files.append((open(path, 'rb'), header, offset, stop))
+                except OSError:
+                    continue
+            for f, header, offset, stop in files:
+                yield f.read(header)
+                f.seek(offset)
+                remaining = stop - offset
+                while remaining > 0:
+                    data = f.read(min(chunk_size, remaining))
+                    if not data:
+                        break
+                    remaining -= len(data)
+                    yield data
+        finally:
+            for f, *_ in files:
+                f.close()
+
+    def open_clip(self, start: float, end: float) -> "ClipReader":
+        """File-like view of the clip [start, end], e.g. for av.open."""
+        return ClipReader(self.iter_clip(start, end))
+
+    def detections(self, start: float, end: float, min_count: int = 1, boxes: bool = False) -> List[dict]:
+        """Recorded frames in [start, end] with at least min_count detections, read without decoding video."""
+        out = []
+        for seg in self._overlapping(start, end):
+            base = os.path.join(self.directory, seg['name'])
+            frames = _read_records(base + '.frames', DET_FRAME_DTYPE)
+            keep = (frames['t'] >= start) & (frames['t'] <= end) & (frames['count'] >= min_count)
+            frames = frames[keep]
+            if not len(frames):
+                continue
+            all_boxes = _read_records(base + '.boxes', DET_BOX_DTYPE) if boxes else None
+            for f in frames:
+                rec = {'t': round(float(f['t']), 3), 'pts': int(f['pts']) if f['pts'] >= 0 else None,
+                       'count': int(f['count']), 'inferred': bool(f['flags'] & _FLAG_INFERRED)}
+                if all_boxes is not None:
+                    b = all_boxes[int(f['first']):int(f['first']) + int(f['count'])]
+                    rec['boxes'] = b['box'].tolist()
+                    rec['conf'] = [round(c / 255, 2) for c in b['conf'].tolist()]
+                    rec['ids'] = [i if i >= 0 else None for i in b['id'].tolist()]
+                out.append(rec)
+        return out
+
+    def stats(self) -> dict:
+        with self._catalog_lock:
+            count = len(self._segments)
+            total = sum(s['bytes'] for s in self._segments)
+        return {
+            'directory': self.directory,
+            'segments': count,
+            'bytes_stored': total,
+            'bytes_written': self.bytes_written,
+            'bytes_dropped': self.bytes_dropped,
+            'segments_deleted': self.segments_deleted,
+            'queued_bytes': self._queued,
+        }
+
+
+def read_index(path: str) -> dict:
+    """
+    Reads a segment's .idx file (a trailing partial line is ignored).
+
+    Returns:
+        dict: 'start' and 'end' (wall-clock seconds, None if the header is missing) and
+        'keyframes' as [(offset, time, pts), ...] in stream order.
+    """
+    index = {'start': None, 'end': None, 'keyframes': []}
+    with open(path) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                break
+            if 'segment' in rec:
+                index['start'] = index['end'] = rec['start']
+            elif 'o' in rec:
+                index['keyframes'].append((rec['o'], rec['t'], rec['pts']))
+                index['end'] = rec['t']
+            elif 'end' in rec:
+                index['end'] = rec['end']
+    return index
+
+
+def _read_records(path: str, dtype: np.dtype) -> np.ndarray:
+    # files may be mid-append: ignore a trailing partial record
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return np.zeros(0, dtype)
+    return np.frombuffer(data, dtype, len(data) // dtype.itemsize)
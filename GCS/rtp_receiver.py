@@ -0,0 +1,259 @@
+"""
+RTP/UDP receiver for MPEG-TS (RFC 2250), the GCS side of drone/src/rtp_transport.py.
+
+RtpReader is a file-like source for av.open, like the TCP _SocketReader in
+stream_session.py. It subscribes by sending HELLO datagrams to the drone every
+`hello_interval` seconds and puts incoming RTP packets through a small jitter buffer:
+
+ - packets are released in sequence-number order;
+ - a missing packet is waited for at most `jitter_ms` after the first packet behind
+   it arrived, then declared lost and skipped;
+ - late and duplicate packets are dropped.
+
+Every skipped gap sets a loss flag (take_loss()) so the decoder can discard the
+damaged frame and resume at the next intact keyframe instead of decoding garbage.
+Counters (received, lost, late, duplicates, reordered, RFC 3550 interarrival jitter)
+accumulate in an RtpStats shared by all connections of a session.
+
+`induced_loss` drops that share of received datagrams before the jitter buffer, to
+exercise the loss path over a clean loopback link.
+"""
+
+import random
+import socket
+import struct
+import time
+from typing import Optional
+
+RTP_PAYLOAD_TYPE = 33
+HELLO = b'GCS-HELLO'
+BYE = b'GCS-BYE'
+# most packets held while waiting for a gap to fill, whatever the deadline
+_MAX_BUFFERED = 512
+
+
+def parse_rtp(datagram: bytes):
+    """(seq, timestamp, ssrc, payload) of an RTP packet with payload type 33, else None."""
+    if len(datagram) < 12 or datagram[0] >> 6 != 2:
+        return None
+    if datagram[1] & 0x7F != RTP_PAYLOAD_TYPE:
+        return None
+    seq, timestamp, ssrc = struct.unpack_from('!HII', datagram, 2)
+    offset = 12 + 4 * (datagram[0] & 0x0F)
+    if datagram[0] & 0x10:
+        # header extension: 16-bit profile, 16-bit length in 32-bit words
+        if len(datagram) < offset + 4:
+            return None
+        offset += 4 + 4 * struct.unpack_from('!H', datagram, offset + 2)[0]
+    end = len(datagram)
+    if datagram[0] & 0x20:
+        end -= datagram[-1]
+    if offset > end:
+        return None
+    return seq, timestamp, ssrc, datagram[offset:end]
+
+
+class RtpStats:
+    """Counters of one stream's RTP reception, across reconnects."""
+
+    def __init__(self):
+        self.packets = 0
+        self.lost = 0
+        self.late = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.invalid = 0
+        self.induced_drops = 0
+        self.gaps = 0
+        self.ssrc_changes = 0
+        self.jitter = 0.0
+
+    def as_dict(self) -> dict:
+        expected = self.packets + self.lost
+        return {
+            'packets': self.packets,
+            'lost': self.lost,
+            'loss_ratio': round(self.lost / expected, 4) if expected else None,
+            'gaps': self.gaps,
+            'late': self.late,
+            'duplicates': self.duplicates,
+            'reordered': self.reordered,
+            'invalid': self.invalid,
+            'induced_drops': self.induced_drops,
+            'ssrc_changes': self.ssrc_changes,
+            'jitter_ms': round(self.jitter / 90.0, 2),
+        }
+
+
+class RtpReader:
+    """
+    Args:
+        sock (socket.socket): UDP socket connected to the drone's address.
+        session (StreamSession): provides stop_event and the bytes_received counter.
+        stats (RtpStats): counters to update.
+        jitter_ms (float): longest wait for a missing packet.
+        read_timeout (float): seconds without any datagram before the link counts as lost.
+        hello_interval (float): seconds between subscription refreshes.
+        induced_loss (float): share of datagrams to drop on purpose (testing).
+    """
+
+    def __init__(self, sock: socket.socket, session, stats: RtpStats, jitter_ms: float = 30.0,
+                 read_timeout: float = 5.0, hello_interval: float = 1.0, induced_loss: float = 0.0):
+        self.sock = sock
+        self.session = session
+        self.stats = stats
+        self.jitter = jitter_ms / 1000.0
+        self.read_timeout = read_timeout
+        self.hello_interval = hello_interval
+        self.induced_loss = induced_loss
+        self.error = None
+        self.last_read_at = None
+
+        self._buffer = {}
+        self._expected = None
+        self._ssrc = None
+        self._pending = b''
+        self._pending_since = None
+        self._loss = False
+        self._last_hello = 0.0
+        self._last_datagram = time.time()
+        self._prev_transit = None
+
+    # ---------------------------------------------
+    # FILE-LIKE INTERFACE (for av.open)
+    # ---------------------------------------------
+    def read(self, n: int) -> bytes:
+        while not self._pending:
+            if self.session.stop_event.is_set():
+                return b''
+            payload = self._release()
+            if payload is not None:
+                self._pending = payload
+                break
+            if not self._receive():
+                return b''
+        data, self._pending = self._pending[:n], self._pending[n:]
+        return data
+
+    def take_arrival(self) -> Optional[float]:
+        arrival = self._pending_since if self._pending_since is not None else self.last_read_at
+        self._pending_since = None
+        return arrival
+
+    def take_loss(self) -> bool:
+        """True once after packets were skipped as lost (or the sender restarted)."""
+        loss, self._loss = self._loss, False
+        return loss
+
+    def wait_first(self, timeout: float) -> bool:
+        """Subscribes and waits up to timeout seconds for the first packet."""
+        deadline = time.time() + timeout
+        self._last_datagram = time.time()
+        while not self._buffer and time.time() < deadline and not self.session.stop_event.is_set():
+            if not self._receive(deadline):
+                return False
+        return bool(self._buffer)
+
+    def close(self):
+        try:
+            self.sock.send(BYE)
+        except OSError:
+            pass
+
+    # ---------------------------------------------
+    # JITTER BUFFER
+    # ---------------------------------------------
+    def _release(self) -> Optional[bytes]:
+        if not self._buffer:
+            return None
+        entry = self._buffer.pop(self._expected, None)
+        if entry is None:
+            oldest = min(arrival for _, arrival in self._buffer.values())
+            if time.time() - oldest < self.jitter and len(self._buffer) < _MAX_BUFFERED:
+                return None
+            # give up on the gap: skip to the first packet we have
+            first = min(self._buffer)
+            self.stats.lost += first - self._expected
+            self.stats.gaps += 1
+            self._loss = True
+            self._expected = first
+            entry = self._buffer.pop(first)
+        self._expected += 1
+        return entry[0]
+
+    def _receive(self, deadline: Optional[float] = None) -> bool:
+        """Receives one datagram into the buffer (or times out towards a deadline); False when the link is gone."""
+        now = time.time()
+        if now - self._last_hello >= self.hello_interval:
+            self._last_hello = now
+            try:
+                self.sock.send(HELLO)
+            except OSError as e:
+                self.error = e
+                return False
+
+        wait = self._last_hello + self.hello_interval - now
+        if self._buffer:
+            oldest = min(arrival for _, arrival in self._buffer.values())
+            wait = min(wait, oldest + self.jitter - now)
+        if deadline is not None:
+            wait = min(wait, deadline - now)
+        self.sock.settimeout(max(wait, 0.001))
+        try:
+            datagram = self.sock.recv(65536)
+        except socket.timeout:
+            if time.time() - self._last_datagram > self.read_timeout:
+                self.error = socket.timeout(f"no RTP packets for {self.read_timeout:.0f}s")
+                return False
+            return True
+        except OSError as e:
+            self.error = e
+            return False
+
+        now = time.time()
+        self._last_datagram = now
+        self.session.bytes_received += len(datagram)
+        self.last_read_at = now
+        if self._pending_since is None:
+            self._pending_since = now
+        if self.induced_loss and random.random() < self.induced_loss:
+            self.stats.induced_drops += 1
+            return True
+        self._insert(datagram, now)
+        return True
+
+    def _insert(self, datagram: bytes, now: float):
+        parsed = parse_rtp(datagram)
+        if parsed is None:
+            self.stats.invalid += 1
+            return
+        seq, timestamp, ssrc, payload = parsed
+        if ssrc != self._ssrc:
+            # new subscription on the drone: restart sequence tracking
+            if self._ssrc is not None:
+                self.stats.ssrc_changes += 1
+                self._loss = True
+            self._ssrc = ssrc
+            self._buffer.clear()
+            self._expected = seq
+            self._prev_transit = None
+
+        delta = (seq - self._expected) & 0xFFFF
+        if delta >= 0x8000:
+            self.stats.late += 1
+            return
+        ext = self._expected + delta
+        if ext in self._buffer:
+            self.stats.duplicates += 1
+            return
+        if self._buffer and ext < max(self._buffer):
+            self.stats.reordered += 1
+        self._buffer[ext] = (payload, now)
+        self.stats.packets += 1
+
+        # RFC 3550 interarrival jitter, in 90 kHz units
+        transit = int(now * 90000) - timestamp
+        if self._prev_transit is not None:
+            d = abs(((transit - self._prev_transit) + 0x80000000) % 0x100000000 - 0x80000000)
+            self.stats.jitter += (d - self.stats.jitter) / 16.0
+        self._prev_transit = transit
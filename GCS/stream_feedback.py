@@ -0,0 +1,261 @@
+"""
+Receiver feedback to the drone's encoder, the GCS side of drone/src/stream_control.py.
+
+LinkMonitor turns the stamps the receiver already takes per frame into link signals:
+
+ - throughput_kbps: bytes read from the link per second;
+ - queue_delay_ms: how much longer frames currently take to arrive than the fastest
+   arrival of the last BASELINE_WINDOW seconds. Computed as arrival time minus PTS,
+   so it needs no clock sync: any constant offset cancels. Growing buffers anywhere
+   on the path (drone send buffer, radio, GCS socket) show up here first;
+ - decode_lag_ms: from a frame's first bytes arriving to it being decoded;
+ - loss: lost packets, decode errors and keyframe resyncs.
+
+The report also carries the GCS's own processing backlog in a separate 'processing'
+field: decoded frames waiting for the pipeline (queue_depth) and the ones it skipped
+(frames_dropped). These say the GCS is slower than the stream, not that the link is
+congested, so the drone does not adapt to them.
+
+FeedbackClient keeps a TCP connection to the drone's control port and sends one
+JSON line with these signals every `interval` seconds. The drone adapts bitrate and
+resolution to them, and sends back its encoder state. After loss the receiver also
+asks for an immediate keyframe (request_keyframe), so it does not wait a whole GOP to
+resync. The connection is optional: without a control server on the drone the client
+keeps retrying quietly, and the video is unaffected.
+"""
+
+import json
+import random
+import socket
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+# the fastest arrival in this many seconds is the zero point of queue_delay_ms
+BASELINE_WINDOW = 10.0
+# an arrival-minus-PTS jump this large (seconds) means the sender restarted its clock
+_RESET_JUMP = 5.0
+_RECONNECT_MAX = 10.0
+
+
+class LinkMonitor:
+    """Per-frame arrival/decode stamps in, a feedback report per interval out. Thread-safe."""
+
+    def __init__(self, baseline_window: float = BASELINE_WINDOW):
+        self.baseline_window = baseline_window
+        self._lock = threading.Lock()
+        # (arrival, arrival - pts) with increasing delays: the front is the window minimum
+        self._minima = deque()
+        self._last_delay = None
+        self._delays = []
+        self._decode_lags = []
+        self._frames = 0
+        self._last_report = time.time()
+        self._last_bytes = 0
+        self._last_loss = 0
+        self._last_dropped = 0
+
+    def on_frame(self, received_at: Optional[float], pts_seconds: Optional[float], decoded_at: float):
+        if received_at is None:
+            return
+        with self._lock:
+            self._frames += 1
+            self._decode_lags.append(decoded_at - received_at)
+            if pts_seconds is None:
+                return
+            delay = received_at - pts_seconds
+            if self._last_delay is not None and abs(delay - self._last_delay) > _RESET_JUMP:
+                self._minima.clear()
+            self._last_delay = delay
+            while self._minima and self._minima[-1][1] >= delay:
+                self._minima.pop()
+            self._minima.append((received_at, delay))
+            while self._minima[0][0] < received_at - self.baseline_window:
+                self._minima.popleft()
+            self._delays.append(delay)
+
+    def report(self, bytes_received: int, queue_depth: int, frames_dropped: int, loss: int) -> dict:
+        """Signals since the previous report; the counters are the session's running totals."""
+        now = time.time()
+        with self._lock:
+            elapsed = max(now - self._last_report, 1e-3)
+            baseline = self._minima[0][1] if self._minima else None
+            delays, self._delays = self._delays, []
+            lags, self._decode_lags = self._decode_lags, []
+            frames, self._frames = self._frames, 0
+        report = {
+            'type': 'feedback',
+            'interval': round(elapsed, 3),
+            'throughput_kbps': round((bytes_received - self._last_bytes) * 8 / elapsed / 1000, 1),
+            'frame_rate': round(frames / elapsed, 1),
+            'queue_delay_ms': round((sum(delays) / len(delays) - baseline) * 1000, 1) if delays and baseline is not None else None,
+            'decode_lag_ms': round(sum(lags) / len(lags) * 1000, 1) if lags else None,
+            'loss': loss - self._last_loss,
+            'processing': {'queue_depth': queue_depth, 'frames_dropped': frames_dropped - self._last_dropped},
+        }
+        self._last_report = now
+        self._last_bytes = bytes_received
+        self._last_dropped = frames_dropped
+        self._last_loss = loss
+        return report
+
+
+class FeedbackClient:
+    """
+    Args:
+        host (str), port (int): the drone's control server.
+        make_report (callable): returns the next feedback dict (see LinkMonitor.report).
+        interval (float): seconds between reports.
+        log (callable): log(msg, level).
+        tag (str): log prefix.
+    """
+
+    def __init__(self, host: str, port: int, make_report: Callable[[], dict], interval: float = 0.5,
+                 log: Callable[..., None] = lambda msg, level='info': None, tag: str = '[Control]'):
+        self.host = host
+        self.port = port
+        self.make_report = make_report
+        self.interval = interval
+        self.log = log
+        self.tag = tag
+
+        self.connected = False
+        self.encoder_state = None
+        self._logged_state = None
+        self.last_report = None
+        self.reports_sent = 0
+        self.keyframes_requested = 0
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"feedback-{self.tag}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # ---------------------------------------------
+    # COMMANDS (any thread)
+    # ---------------------------------------------
+    def request_keyframe(self):
+        """Asks for an IDR frame now (the drone rate-limits these)."""
+        if self._send({'type': 'keyframe'}):
+            self.keyframes_requested += 1
+
+    def configure(self, **settings) -> bool:
+        """Sets encoder parameters on the drone: bitrate, keyframe_interval, resolution, adaptive."""
+        return self._send(dict(settings, type='set'))
+
+    def _send(self, message: dict) -> bool:
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            with self._send_lock:
+                sock.sendall((json.dumps(message, separators=(',', ':')) + '\n').encode())
+            return True
+        except OSError:
+            return False
+
+    # ---------------------------------------------
+    # CONNECTION
+    # ---------------------------------------------
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=2.0)
+            except OSError as e:
+                if attempt == 0:
+                    self.log(f"{self.tag} No encoder control at {self.host}:{self.port} ({e}); retrying", 'info')
+                attempt += 1
+                delay = min(_RECONNECT_MAX, 0.5 * 2 ** attempt)
+                self._stop.wait(delay / 2 + random.uniform(0, delay / 2))
+                continue
+            attempt = 0
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._sock = sock
+            self.connected = True
+            self.log(f"{self.tag} Encoder control connected to {self.host}:{self.port}")
+            reader = threading.Thread(target=self._read_states, args=(sock,), daemon=True)
+            reader.start()
+            # start the report interval afresh: the first one would span the disconnect
+            self.make_report()
+            try:
+                while not self._stop.wait(self.interval) and reader.is_alive():
+                    self.last_report = self.make_report()
+                    if not self._send(self.last_report):
+                        break
+                    self.reports_sent += 1
+            finally:
+                self._sock = None
+                self.connected = False
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+                reader.join(1.0)
+            if not self._stop.is_set():
+                self.log(f"{self.tag} Encoder control connection lost", 'warning')
+
+    def _read_states(self, sock: socket.socket):
+        buffer = b''
+        try:
+            while True:
+                try:
+                    data = sock.recv(4096)
+                except socket.timeout:
+                    # the drone only sends on changes and every few seconds
+                    if self._sock is not sock:
+                        return
+                    continue
+                if not data:
+                    return
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    if message.get('type') == 'state':
+                        self.encoder_state = message
+                        if self._worth_logging(message):
+                            interval = message.get('keyframe_interval')
+                            self.log(f"{self.tag} Drone encoder: {message['bitrate'] // 1000} kbps, "
+                                     f"{message['resolution'][0]}x{message['resolution'][1]}, "
+                                     + (f"keyframe every {interval} frames" if interval else "default keyframe interval")
+                                     + (f" ({message['reason']})" if message.get('reason') else ''))
+        except OSError:
+            return
+
+    def _worth_logging(self, state: dict) -> bool:
+        # resolution and GOP changes always; bitrate only once it moved by a quarter
+        logged = self._logged_state
+        if (logged is not None and logged['resolution'] == state['resolution']
+                and logged.get('keyframe_interval') == state.get('keyframe_interval')
+                and abs(state['bitrate'] - logged['bitrate']) < logged['bitrate'] / 4):
+            return False
+        self._logged_state = state
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'connected': self.connected,
+            'encoder': self.encoder_state,
+            'last_report': self.last_report,
+            'reports_sent': self.reports_sent,
+            'keyframes_requested': self.keyframes_requested,
+        }
+
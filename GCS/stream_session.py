@@ -0,0 +1,884 @@
+"""
+One drone video stream inside the GCS.
+
+A StreamSession owns everything that used to be module-level state in
+video_server.py for a single sender: the receiver thread, the decoded-frame ring,
+the processing pipeline, the MJPEG broadcast hub and the connection status. Many
+sessions run side by side in one server process and share a single
+InferenceEngine (and therefore a single loaded model).
+"""
+
+import json
+import os
+import random
+import socket
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+import av
+import cv2
+import numpy as np
+
+from adaptive import AdaptiveScheduler, carry_forward, estimate_shift, motion_thumbnail
+from broadcast import BroadcastHub, QueueBroadcast
+from detections import boxes_outside, empty_detections, offset_detections, scale_detections
+from frame_convert import BufferPool, copy_frame_i420, i420_shape, i420_to_bgr, i420_to_bgr_resized
+from frame_ring import FrameRing
+from inference_engine import InferenceEngine
+from jpeg_encoder import DEFAULT_KEY, JpegEncoder, RenditionCache
+from metrics import FrameTracer, StageMetrics, frame_durations
+from motion_gate import MotionGate
+from pipeline import FrameJob, Pipeline, Stage
+from recorder import Recorder, TeeReader
+from rtp_receiver import RtpReader, RtpStats
+from stream_feedback import FeedbackClient, LinkMonitor
+from tiling import merge_detections, tile_grid
+from tracker import Tracker
+
+# Per-stream defaults
+# Decoded frames wait in a preallocated ring as I420. 'latest' hands the pipeline the
+# newest frame and recycles older unread ones; 'lossless' never overwrites (for recording).
+# A slot is only held until preprocess has converted it to BGR.
+FRAME_RING_SLOTS = 8
+FRAME_RING_MODE = 'latest'
+# Starting inference stride and size. With ADAPTIVE_INFERENCE the scheduler then moves
+# them (size within INFERENCE_SIZES, not below MIN_INFERENCE_SIZE, then stride up to
+# MAX_INFERENCE_STRIDE) to hold TARGET_LATENCY_MS from frame arrival to publish.
+RUN_INFERENCE_EVERY_N = 1
+INFERENCE_WIDTH = 640
+ADAPTIVE_INFERENCE = True
+TARGET_LATENCY_MS = 150
+INFERENCE_SIZES = (320, 416, 512, 640)
+MIN_INFERENCE_SIZE = 416
+MAX_INFERENCE_STRIDE = 6
+# Frames that skip inference show the last detections, shifted by the estimated
+# global camera motion when MOTION_COMPENSATION is on.
+CARRY_FORWARD_DETECTIONS = True
+MOTION_COMPENSATION = True
+# Tracking between inference and drawing: persistent IDs and predicted boxes on frames
+# without detections, so the scheduler can raise the inference stride under load without
+# boxes freezing. Replaces plain carry-forward when on. TRACKING_DETECT_EVERY_N > 1 is an
+# opt-in floor on the stride (saves compute even when the budget allows every frame,
+# at the cost of slower confirmation of new tracks).
+TRACKING = True
+TRACKING_DETECT_EVERY_N = 1
+TRACK_IOU_THRESHOLD = 0.3
+# detector runs (not frames) a track coasts unmatched: 1/3 s at stride 1, 2 s at stride 6
+TRACK_MAX_AGE = 10
+TRACK_MIN_HITS = 2
+# Motion gating: a frame due for inference whose luma barely changed since the last
+# inferred frame skips the detector and reuses its detections. With ROI_INFERENCE,
+# change confined to a few regions is inferred on crops around them (at the same pixel
+# density as a full pass), and merged with the previous detections elsewhere. A full
+# pass still runs at least every MOTION_REFRESH_FRAMES frames.
+MOTION_GATING = True
+MOTION_PIXEL_THRESHOLD = 12
+MOTION_CELL_FRACTION = 0.03
+MOTION_REFRESH_FRAMES = 30
+ROI_INFERENCE = True
+ROI_MAX_AREA = 0.5
+# Tiled inference for small, distant persons: overlapping TILE_SIZE tiles at native
+# resolution, batched in one engine call and merged with cross-tile NMS. 'off',
+# 'always' (tiles plus the downscaled full frame), or 'fallback' (tiles only when the
+# full-frame pass found nothing). Applies to full-frame passes, not to motion ROIs.
+TILED_INFERENCE = 'off'
+TILE_SIZE = 640
+TILE_OVERLAP = 0.2
+TILE_NMS_THRESHOLD = 0.6
+# The infer stage hands up to INFERENCE_BATCH_SIZE frames to the shared engine at once,
+# flushing a partial batch after INFERENCE_BATCH_TIMEOUT seconds.
+INFERENCE_BATCH_SIZE = 4
+INFERENCE_BATCH_TIMEOUT = 0.02
+# Worker threads and input-queue depth per pipeline stage. Inference keeps a single
+# worker so there is one engine request in flight per stream; the other stages are pools.
+PIPELINE_STAGES = {
+    'preprocess': {'workers': 2, 'depth': 1},
+    'infer': {'workers': 1, 'depth': INFERENCE_BATCH_SIZE},
+    'annotate': {'workers': 2, 'depth': 1},
+    'output': {'workers': 1, 'depth': 1},
+}
+SOCKET_RCVBUF = 4 * 1024 * 1024
+# 'tcp' connects to the drone's MPEG-TS server; 'rtp' subscribes to its RTP/UDP stream
+# (drone/src/rtp_transport.py), which degrades to skipped frames instead of stalls on
+# a lossy link. Missing packets are waited for RTP_JITTER_MS before being declared
+# lost. GCS_RTP_INDUCED_LOSS drops that share of datagrams on purpose (testing).
+RECEIVER_TRANSPORT = 'tcp'
+RTP_JITTER_MS = 30
+RTP_SOCKET_RCVBUF = 1024 * 1024
+RTP_HELLO_INTERVAL = 1.0
+RTP_INDUCED_LOSS = float(os.environ.get('GCS_RTP_INDUCED_LOSS', 0))
+# Receiver supervision: reconnect forever with jittered exponential backoff. A link
+# that delivers no bytes for RECEIVER_READ_TIMEOUT seconds is treated as dropped.
+RECEIVER_CONNECT_TIMEOUT = 5.0
+RECEIVER_READ_TIMEOUT = 5.0
+RECONNECT_BACKOFF_INITIAL = 0.25
+RECONNECT_BACKOFF_MAX = 8.0
+# How much of a new connection PyAV analyzes before decoding starts (microseconds)
+RECEIVER_ANALYZE_US = 200000
+# The drone can stamp each frame's PTS with its wall-clock capture time (see
+# WallClockPyavOutput in drone/src/video_streamer.py), which makes network and
+# glass-to-glass latency measurable. Off on both sides by default; enable it together
+# with the drone's capture_timestamps, and only with synced clocks;
+# stamps further than CAPTURE_MAX_SKEW seconds from the GCS clock are ignored.
+CAPTURE_TIMESTAMPS = False
+CAPTURE_MAX_SKEW = 10.0
+# Encoder feedback: link signals (throughput, queueing delay, decode lag, queue depth,
+# loss) go to the drone's control server on port + CONTROL_PORT_OFFSET every
+# FEEDBACK_INTERVAL seconds, and the drone adapts bitrate and resolution to them (see
+# stream_feedback.py). After loss, keyframes are requested at most every
+# KEYFRAME_REQUEST_INTERVAL seconds. Off by default; GCS_ENCODER_FEEDBACK=1 turns it on,
+# and the drone only adapts when its VideoStreamer runs with adaptive=True (or after
+# POST /streams/{id}/encoder?adaptive=true).
+ENCODER_FEEDBACK = os.environ.get('GCS_ENCODER_FEEDBACK', '0') == '1'
+CONTROL_PORT_OFFSET = 1
+FEEDBACK_INTERVAL = 0.5
+KEYFRAME_REQUEST_INTERVAL = 1.0
+# Window of the per-stage latency histograms (status and /metrics), in seconds
+LATENCY_WINDOW = 60.0
+MJPEG_BOUNDARY = 'frame'
+# Detections are also pushed as one compact JSON event per published frame (see
+# detection_event); each event subscriber buffers up to DETECTION_QUEUE_SIZE of them.
+# With ANNOTATE_FRAMES off the video is served clean and clients draw the overlay
+# themselves from those events, which skips all drawing on the GCS.
+ANNOTATE_FRAMES = True
+DETECTION_QUEUE_SIZE = 32
+
+_PTS_WRAP = 1 << 33
+
+
+def mjpeg_chunk(jpg: bytes, boundary: str = MJPEG_BOUNDARY) -> bytes:
+    return (b"--%b\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % (boundary.encode(), len(jpg))) + jpg + b"\r\n"
+
+
+def _round_ms(value):
+    return None if value is None else round(value, 1)
+
+
+def pts_capture_time(frame, now: float) -> Optional[float]:
+    """Wall-clock capture time from a frame's 90 kHz PTS (wall-clock based, modulo 2^33), or None."""
+    if frame.pts is None or frame.time_base is None:
+        return None
+    ticks = round(float(frame.pts * frame.time_base) * 90000)
+    delta = (round(now * 90000) - ticks) % _PTS_WRAP
+    if delta >= _PTS_WRAP // 2:
+        # stamped slightly ahead of our clock
+        delta -= _PTS_WRAP
+    age = delta / 90000
+    return now - age if abs(age) <= CAPTURE_MAX_SKEW else None
+
+
+def detection_event(stream_id: str, job, published_at: float, annotated: bool) -> bytes:
+    """One server-sent event with a frame's detections (boxes in frame pixels, ids when tracking)."""
+    dets = job.detections
+    height, width = job.img.shape[:2]
+    message = {
+        'stream': stream_id,
+        'seq': job.frame_seq,
+        'ts': round(published_at, 3),
+        'captured': job.t.get('capture'),
+        'w': width,
+        'h': height,
+        'inferred': bool(job.run_inference),
+        'annotated': annotated,
+        'boxes': np.rint(dets['box']).astype(np.int32).tolist(),
+        'conf': [round(c, 2) for c in dets['conf'].tolist()],
+        'cls': dets['cls'].tolist(),
+        'ids': job.track_ids.tolist() if job.track_ids is not None else None,
+    }
+    data = json.dumps(message, separators=(',', ':'))
+    return f"id: {job.frame_seq}\ndata: {data}\n\n".encode()
+
+
+class EncodedFrame(NamedTuple):
+    """
+    What the session publishes to viewers: the frame's renditions (multipart chunks,
+    encoded on demand; None when nobody was watching) plus the stamps needed for
+    delivery metrics.
+    """
+    output: Optional[RenditionCache]
+    published_at: float
+    received_at: Optional[float]
+    captured_at: Optional[float]
+
+
+class _SocketReader:
+    """
+    Unbuffered file-like source for av.open that counts received bytes.
+
+    read() returns whatever the socket has (like recv), so PyAV gets each packet as
+    soon as it arrives instead of waiting for a full buffered block. Socket errors
+    are recorded and reported to PyAV as EOF, which ends demuxing cleanly.
+
+    take_arrival() gives the time of the first read since the previous call, i.e.
+    roughly when the bytes of the packet the demuxer just returned started arriving.
+    """
+
+    def __init__(self, sock: socket.socket, session: "StreamSession"):
+        self.sock = sock
+        self.session = session
+        self.error = None
+        self.last_read_at = None
+        self._pending_since = None
+
+    def read(self, n: int) -> bytes:
+        if self.session.stop_event.is_set():
+            return b''
+        try:
+            data = self.sock.recv(n)
+        except (socket.timeout, OSError) as e:
+            self.error = e
+            return b''
+        self.session.bytes_received += len(data)
+        self.last_read_at = time.time()
+        if self._pending_since is None:
+            self._pending_since = self.last_read_at
+        return data
+
+    def take_arrival(self) -> Optional[float]:
+        arrival = self._pending_since if self._pending_since is not None else self.last_read_at
+        self._pending_since = None
+        return arrival
+
+    def take_loss(self) -> bool:
+        # TCP never loses data; stalls show up as read timeouts instead
+        return False
+
+
+class StreamSession:
+    """
+    Args:
+        stream_id (str): name used in URLs (/streams/{stream_id}/...) and log messages.
+        host (str), port (int): the drone's MPEG-TS sender.
+        engine (InferenceEngine): shared model; frames are scheduled fairly across sessions.
+        log (callable): log(msg, level) sink shared with the server.
+        tracer (FrameTracer): optional per-frame trace dump.
+        transport (str): 'tcp' or 'rtp' (see RECEIVER_TRANSPORT).
+        annotate (bool): draw detections into the video (see ANNOTATE_FRAMES).
+        recorder (Recorder): optional on-disk recording of the raw stream and detections.
+        feedback (bool): send receiver feedback to the drone's encoder (see ENCODER_FEEDBACK).
+    """
+
+    def __init__(self, stream_id: str, host: str, port: int, engine: InferenceEngine,
+                 log: Callable[..., None], tracer: Optional[FrameTracer] = None,
+                 transport: str = RECEIVER_TRANSPORT, annotate: bool = ANNOTATE_FRAMES,
+                 recorder: Optional[Recorder] = None, feedback: bool = ENCODER_FEEDBACK):
+        if transport not in ('tcp', 'rtp'):
+            raise ValueError(f"unknown transport {transport!r}")
+        self.stream_id = stream_id
+        self.host = host
+        self.port = port
+        self.transport = transport
+        self.annotate = annotate
+        self.recorder = recorder
+        self.engine = engine
+        self.log = log
+        self.tracer = tracer
+        self.metrics = StageMetrics(LATENCY_WINDOW)
+
+        self.frame_ring = FrameRing(FRAME_RING_SLOTS, FRAME_RING_MODE)
+        self.bgr_pool = BufferPool()
+        # Annotated frames as ready-to-send multipart chunks, shared by all viewers
+        self.frame_hub = BroadcastHub()
+        # per-frame detection events, for dashboards and client-side overlays
+        self.detection_hub = QueueBroadcast(DETECTION_QUEUE_SIZE)
+        # JPEG output: (rendition, quality) -> viewers currently wanting it; the output
+        # stage keeps frames for them and drops them when the map is empty
+        self.jpeg = JpegEncoder()
+        self._output_demand = {}
+        self._demand_lock = threading.Lock()
+        self.frames_not_encoded = 0
+        # the RenditionCache viewers can still fetch from; released when the next frame is published
+        self._published_output = None
+        self.stop_event = threading.Event()
+        self.receiver_connected = False
+        self.pipeline = None
+        self.scheduler = AdaptiveScheduler(
+            target_latency_ms=TARGET_LATENCY_MS, sizes=INFERENCE_SIZES, initial_size=INFERENCE_WIDTH,
+            initial_stride=RUN_INFERENCE_EVERY_N, min_size=MIN_INFERENCE_SIZE,
+            min_stride=TRACKING_DETECT_EVERY_N if TRACKING else 1,
+            max_stride=MAX_INFERENCE_STRIDE, enabled=ADAPTIVE_INFERENCE)
+        self.tracker = Tracker(TRACK_IOU_THRESHOLD, TRACK_MAX_AGE, TRACK_MIN_HITS) if TRACKING else None
+        self.motion_gate = MotionGate(MOTION_PIXEL_THRESHOLD, MOTION_CELL_FRACTION, refresh_frames=MOTION_REFRESH_FRAMES,
+                                      roi_max_area=ROI_MAX_AREA, roi=ROI_INFERENCE) if MOTION_GATING else None
+        # carry-forward / tracking state, only touched by the (single) infer worker
+        self._last_detections = None
+        self._last_thumb = None
+        self._prev_thumb = None
+        self._shift = (0.0, 0.0)
+
+        # receiver counters (see status())
+        self.connections = 0
+        self.reconnects = 0
+        self.bytes_received = 0
+        self.decode_errors = 0
+        self.demux_errors = 0
+        self.keyframe_resyncs = 0
+        self.link_lost_at = None
+        self.last_time_to_first_frame_ms = None
+        self.last_recovery_ms = None
+        self.capture_stamps_rejected = 0
+        self.rtp_stats = RtpStats() if transport == 'rtp' else None
+        self._threads = []
+
+        # receiver -> drone encoder feedback
+        self.link_monitor = LinkMonitor()
+        self.feedback = FeedbackClient(host, port + CONTROL_PORT_OFFSET, self._feedback_report, FEEDBACK_INTERVAL,
+                                       log, f"[Control:{stream_id}]") if feedback else None
+        self._last_keyframe_request = 0.0
+
+    # ---------------------------------------------
+    # LIFECYCLE
+    # ---------------------------------------------
+    def start(self, loop):
+        self.frame_hub.bind(loop)
+        self.detection_hub.bind(loop)
+        if self.recorder is not None:
+            self.recorder.start()
+        self.stop_event.clear()
+        if self.feedback is not None:
+            self.feedback.start()
+        self._threads = [
+            threading.Thread(target=self.receiver_thread, name=f"receiver-{self.stream_id}", daemon=True),
+            threading.Thread(target=self.processing_thread, name=f"processor-{self.stream_id}", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.feedback is not None:
+            self.feedback.stop()
+        self.frame_hub.close()
+        self.detection_hub.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def status(self) -> dict:
+        return {
+            'stream_id': self.stream_id,
+            'sender': f"{self.host}:{self.port}",
+            'transport': self.transport,
+            'receiver_connected': bool(self.receiver_connected),
+            'receiver': {
+                'reconnects': self.reconnects,
+                'bytes_received': self.bytes_received,
+                'decode_errors': self.decode_errors,
+                'demux_errors': self.demux_errors,
+                'keyframe_resyncs': self.keyframe_resyncs,
+                'last_time_to_first_frame_ms': _round_ms(self.last_time_to_first_frame_ms),
+                'last_recovery_ms': _round_ms(self.last_recovery_ms),
+                'rtp': self.rtp_stats.as_dict() if self.rtp_stats is not None else None,
+            },
+            'frames': self.frame_ring.stats(),
+            'viewers': self.frame_hub.subscribers,
+            'annotated': self.annotate,
+            'output': {
+                'encoder': self.jpeg.backend,
+                'frames_encoded': self.jpeg.frames_encoded,
+                'bytes_encoded': self.jpeg.bytes_encoded,
+                'frames_not_encoded': self.frames_not_encoded,
+                'demand': {f"{r}@{q}": n for (r, q), n in self.output_demand().items()},
+            },
+            'detection_subscribers': self.detection_hub.subscribers,
+            'detection_events_dropped': self.detection_hub.dropped,
+            'scheduler': self.scheduler.stats(),
+            'tracks': len(self.tracker) if self.tracker is not None else None,
+            'motion_gate': self.motion_gate.stats() if self.motion_gate is not None else None,
+            'latency': self.metrics.snapshot(),
+            'recording': self.recorder.stats() if self.recorder is not None else None,
+            'encoder_control': self.feedback.stats() if self.feedback is not None else None,
+        }
+
+    def _feedback_report(self) -> dict:
+        ring = self.frame_ring.stats()
+        loss = self.decode_errors + self.demux_errors + (self.rtp_stats.gaps if self.rtp_stats is not None else 0)
+        return self.link_monitor.report(self.bytes_received, ring['ready'], ring['frames_dropped'], loss)
+
+    def _request_keyframe(self):
+        # the next GOP may be seconds away; ask the drone for an IDR frame now
+        now = time.time()
+        if self.feedback is not None and now - self._last_keyframe_request >= KEYFRAME_REQUEST_INTERVAL:
+            self._last_keyframe_request = now
+            self.feedback.request_keyframe()
+
+    # ---------------------------------------------
+    # RECEIVER: socket -> PyAV demux/decode -> frame_ring, supervised
+    # ---------------------------------------------
+    def receiver_thread(self):
+        """Keeps a connection to the sender forever, reconnecting with jittered exponential backoff."""
+        tag = f"[Receiver:{self.stream_id}]"
+        attempt = 0
+        while not self.stop_event.is_set():
+            got_frames = False
+            try:
+                got_frames = self._receive_once(tag)
+            except Exception as e:
+                self.log(f"{tag} Error: {e}", 'error')
+            finally:
+                self.receiver_connected = False
+
+            if self.stop_event.is_set():
+                break
+            if got_frames or self.link_lost_at is None:
+                self.link_lost_at = time.time()
+            # a connection that delivered video resets the backoff
+            attempt = 0 if got_frames else attempt + 1
+            delay = min(RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_INITIAL * (2 ** attempt))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            self.log(f"{tag} Reconnecting in {delay:.1f}s", 'warning')
+            self.stop_event.wait(delay)
+        self.log(f"{tag} Receiver thread exiting")
+
+    def _receive_once(self, tag: str) -> bool:
+        """One connection: connect, then demux and decode until the link drops. Returns True if any frame was decoded."""
+        if self.transport == 'rtp':
+            return self._receive_rtp(tag)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
+            sock.settimeout(RECEIVER_CONNECT_TIMEOUT)
+            try:
+                sock.connect((self.host, self.port))
+            except (socket.timeout, OSError) as e:
+                self.log(f"{tag} Connection to {self.host}:{self.port} failed: {e}", 'warning')
+                return False
+            sock.settimeout(RECEIVER_READ_TIMEOUT)
+            return self._run_connection(tag, _SocketReader(sock, self))
+        finally:
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+    def _receive_rtp(self, tag: str) -> bool:
+        """One RTP subscription: send HELLOs until packets arrive, then demux and decode until they stop."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RTP_SOCKET_RCVBUF)
+            # connecting a UDP socket sets the HELLO destination and filters out other senders
+            sock.connect((self.host, self.port))
+            reader = RtpReader(sock, self, self.rtp_stats, RTP_JITTER_MS, RECEIVER_READ_TIMEOUT,
+                               RTP_HELLO_INTERVAL, RTP_INDUCED_LOSS)
+            try:
+                if not reader.wait_first(RECEIVER_CONNECT_TIMEOUT):
+                    reason = reader.error or 'no packets'
+                    self.log(f"{tag} No RTP stream from {self.host}:{self.port}: {reason}", 'warning')
+                    return False
+                return self._run_connection(tag, reader)
+            finally:
+                reader.close()
+        finally:
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+    def _run_connection(self, tag: str, reader) -> bool:
+        connected_at = time.time()
+        # mark receiver connected (used by /status)
+        self.receiver_connected = True
+        self.reconnects += 1 if self.connections else 0
+        self.connections += 1
+        self.log(f"{tag} Connected to sender at {self.host}:{self.port} ({self.transport})")
+        if self.recorder is not None:
+            # the raw bytes are copied to disk as read, before demuxing
+            self.recorder.discontinuity()
+            reader = TeeReader(reader, self.recorder)
+
+        # a short probe window: the TS carries SPS/PPS in-band, and a long analyze
+        # phase adds directly to time-to-first-frame after every reconnect
+        container = av.open(reader, format='mpegts', options={'analyzeduration': str(RECEIVER_ANALYZE_US)})
+        try:
+            return self._decode_loop(tag, container, reader, connected_at)
+        finally:
+            container.close()
+            if reader.error is not None:
+                self.log(f"{tag} Link lost: {reader.error}", 'warning')
+
+    def _decode_loop(self, tag: str, container, reader, connected_at: float) -> bool:
+        stream = container.streams.video[0]
+        codec = stream.codec_context
+        got_frames = False
+        # after a demux or decode error, skip packets until the next keyframe
+        # instead of reopening the container
+        waiting_for_keyframe = False
+
+        while not self.stop_event.is_set():
+            try:
+                for packet in container.demux(stream):
+                    if self.stop_event.is_set():
+                        break
+                    if packet.size == 0:
+                        continue
+                    stamps = {'receive': reader.take_arrival(), 'demux': time.time()}
+                    if reader.take_loss():
+                        # datagrams of this packet were lost; later frames reference it
+                        waiting_for_keyframe = True
+                        self._request_keyframe()
+                        continue
+                    if waiting_for_keyframe:
+                        if not packet.is_keyframe:
+                            continue
+                        codec.flush_buffers()
+                        waiting_for_keyframe = False
+                        self.keyframe_resyncs += 1
+                    try:
+                        frames = codec.decode(packet)
+                    except av.error.FFmpegError as e:
+                        self.decode_errors += 1
+                        self.log(f"{tag} decode error, resyncing on next keyframe: {e}", 'warning')
+                        waiting_for_keyframe = True
+                        self._request_keyframe()
+                        continue
+                    for frame in frames:
+                        if not got_frames:
+                            got_frames = True
+                            now = time.time()
+                            self.last_time_to_first_frame_ms = (now - connected_at) * 1000
+                            if self.link_lost_at is not None:
+                                self.last_recovery_ms = (now - self.link_lost_at) * 1000
+                                self.log(f"{tag} Video resumed {self.last_recovery_ms:.0f} ms after link loss")
+                                self.link_lost_at = None
+                        self._commit_frame(tag, frame, dict(stamps, decode=time.time(), pts=frame.pts))
+                # demux ended: EOF or the socket reader gave up
+                return got_frames
+            except av.error.FFmpegError as e:
+                self.demux_errors += 1
+                self.log(f"{tag} demux error, resyncing on next keyframe: {e}", 'warning')
+                waiting_for_keyframe = True
+                self._request_keyframe()
+        return got_frames
+
+    def _commit_frame(self, tag: str, frame, stamps: dict):
+        # link signals count every decoded frame, also ones the pipeline has no room for
+        pts_seconds = float(frame.pts * frame.time_base) if frame.pts is not None and frame.time_base is not None else None
+        self.link_monitor.on_frame(stamps.get('receive'), pts_seconds, stamps['decode'])
+        # frames stay in native I420 until a pipeline stage needs BGR pixels
+        reserved = self.frame_ring.acquire(i420_shape(frame.width, frame.height))
+        if reserved is None:
+            # every slot is busy in the pipeline; this frame is counted as dropped
+            return
+        slot, buf = reserved
+        try:
+            copy_frame_i420(frame, buf)
+        except Exception as e:
+            self.frame_ring.cancel(slot)
+            self.log(f"{tag} frame conversion error: {e}", 'warning')
+            return
+        now = time.time()
+        if CAPTURE_TIMESTAMPS:
+            captured = pts_capture_time(frame, now)
+            if captured is None:
+                self.capture_stamps_rejected += 1
+            else:
+                stamps['capture'] = captured
+        self.frame_ring.commit(slot, now, stamps)
+
+    # ---------------------------------------------
+    # PIPELINE STAGES: preprocess -> infer -> annotate -> output, then publish in order
+    # Each stage mutates the FrameJob objects it is handed (see pipeline.py).
+    # ---------------------------------------------
+    def preprocess_stage(self, jobs):
+        """Converts the ring's I420 frame to BGR buffers from bgr_pool and frees the ring slot."""
+        for job in jobs:
+            yuv = job.img
+            h = yuv.shape[0] * 2 // 3
+            w = yuv.shape[1]
+
+            # decide whether to run inference on this frame, and at what size
+            job.run_inference = self.scheduler.should_infer(job.seq)
+            job.imgsz = self.scheduler.size
+            job.detections = empty_detections()
+            job.track_ids = None
+            job.img_small = None
+            job.regions = None
+            job.roi_detections = []
+            job.tile_detections = []
+            # luma thumbnail for motion gating and for motion-compensating carried-forward boxes
+            job.thumb = motion_thumbnail(yuv[:h]) if MOTION_COMPENSATION or MOTION_GATING else None
+            if job.run_inference:
+                job.scale = 1.0
+                if max(w, h) > job.imgsz:
+                    job.scale = job.imgsz / float(max(w, h))
+                    # I420 needs even dimensions
+                    new_w = int(w * job.scale) & ~1
+                    new_h = int(h * job.scale) & ~1
+                    # resize happens on the YUV planes, so only the small image is colour-converted
+                    scratch = self.bgr_pool.acquire(i420_shape(new_w, new_h))
+                    job.img_small = i420_to_bgr_resized(yuv, (new_w, new_h), self.bgr_pool.acquire((new_h, new_w, 3)), scratch)
+                    self.bgr_pool.release(scratch)
+
+            # full-size BGR for drawing and encoding
+            job.img = i420_to_bgr(yuv, self.bgr_pool.acquire((h, w, 3)))
+            if job.img_small is None and job.run_inference:
+                job.img_small = job.img
+            self.frame_ring.release(job.slot)
+            job.slot = None
+
+    def infer_stage(self, jobs):
+        """
+        Runs YOLO through the shared engine for all jobs of the batch that need it; boxes end up in
+        full-frame coordinates. With MOTION_GATING, unchanged frames skip the detector and frames
+        with localized change are inferred on crops; with TILED_INFERENCE, full-frame passes add
+        native-resolution tiles. Jobs that skip inference carry the last detections forward (or get
+        the tracker's predictions).
+        """
+        if not self.engine.ready():
+            # the model is loading (or failed to): its empty results are not inferences, so the
+            # motion gate and tracker must not take them as "checked, nothing there"
+            for job in jobs:
+                job.run_inference = False
+        # one entry per engine image: (job, image, imgsz, kind, region); kind is 'full', 'roi' or 'tile'
+        requests, full = [], []
+        for job in jobs:
+            if not job.run_inference:
+                continue
+            decision, regions = 'full', None
+            if self.motion_gate is not None:
+                h, w = job.img.shape[:2]
+                decision, regions = self.motion_gate.check(job.seq, job.thumb, (w, h))
+            if decision == 'skip':
+                job.run_inference = False
+            elif decision == 'roi':
+                job.regions = regions
+                for region in regions:
+                    x1, y1, x2, y2 = region
+                    requests.append((job, job.img[y1:y2, x1:x2], self._roi_size(job, region), 'roi', region))
+            else:
+                requests.append((job, job.img_small, job.imgsz, 'full', None))
+                full.append(job)
+                if TILED_INFERENCE == 'always':
+                    requests.extend(self._tile_requests(job))
+        self._run_requests(requests)
+
+        if TILED_INFERENCE == 'fallback':
+            self._run_requests([request for job in full if job.run_inference and not len(job.detections)
+                                for request in self._tile_requests(job)])
+        for job in full:
+            if job.tile_detections:
+                job.detections = merge_detections([job.detections] + job.tile_detections, TILE_NMS_THRESHOLD)
+
+        # jobs are in frame order here (single worker), so tracks and carried boxes
+        # always come from earlier frames
+        for job in jobs:
+            if job.run_inference:
+                if job.regions is not None:
+                    job.detections = self._merge_roi(job)
+                self._last_detections = job.detections
+                self._last_thumb = job.thumb
+                self._shift = (0.0, 0.0)
+            elif self.tracker is None and CARRY_FORWARD_DETECTIONS and self._last_detections is not None:
+                if job.thumb is not None and self._last_thumb is not None and job.thumb.shape == self._last_thumb.shape:
+                    self._shift = estimate_shift(self._last_thumb, job.thumb, job.img.shape[1])
+                job.detections = carry_forward(self._last_detections, self._shift)
+        if self.tracker is not None:
+            self._track(jobs)
+
+    def _run_requests(self, requests):
+        """Sends requests through the engine, one call per input size, and files the boxes on their jobs."""
+        # the scheduler may change size mid-batch, and crops and tiles have their own
+        # sizes; each engine request has a single size
+        by_size = {}
+        for request in requests:
+            by_size.setdefault(request[2], []).append(request)
+        for imgsz, group in by_size.items():
+            started = time.time()
+            try:
+                results = self.engine.infer(self.stream_id, [request[1] for request in group], imgsz=imgsz)
+            except Exception as e:
+                self.log(f"[Processor:{self.stream_id}] YOLO inference error: {e}", 'error')
+                for job, *_ in group:
+                    job.run_inference = False
+                continue
+            self.scheduler.record_inference((time.time() - started) * 1000, len({id(request[0]) for request in group}))
+
+            # map boxes back to full-frame coordinates
+            for (job, _, _, kind, region), detections in zip(group, results):
+                if kind == 'full':
+                    job.detections = scale_detections(detections, job.scale)
+                elif kind == 'roi':
+                    job.roi_detections.append(offset_detections(detections, region[0], region[1]))
+                else:
+                    job.tile_detections.append(offset_detections(detections, region[0], region[1]))
+
+    def _tile_requests(self, job):
+        # tiles are views into the full-size frame; all have the same shape, so they batch together
+        h, w = job.img.shape[:2]
+        return [(job, job.img[y1:y2, x1:x2], TILE_SIZE, 'tile', (x1, y1, x2, y2))
+                for x1, y1, x2, y2 in tile_grid(w, h, TILE_SIZE, TILE_OVERLAP)]
+
+    def _roi_size(self, job, region) -> int:
+        # same pixel density as a full-frame pass at job.imgsz, rounded up to an allowed size
+        x1, y1, x2, y2 = region
+        needed = max(x2 - x1, y2 - y1) * job.scale
+        return min(next((s for s in INFERENCE_SIZES if s >= needed), job.imgsz), job.imgsz)
+
+    def _merge_roi(self, job):
+        """Previous detections outside the inferred regions, plus the new detections inside them."""
+        previous = self._last_detections if self._last_detections is not None else empty_detections()
+        if len(previous) and job.thumb is not None and self._last_thumb is not None and job.thumb.shape == self._last_thumb.shape:
+            previous = carry_forward(previous, estimate_shift(self._last_thumb, job.thumb, job.img.shape[1]))
+        return np.concatenate([previous[boxes_outside(previous, job.regions)]] + job.roi_detections)
+
+    def _track(self, jobs):
+        for job in jobs:
+            shift = (0.0, 0.0)
+            if job.thumb is not None and self._prev_thumb is not None and job.thumb.shape == self._prev_thumb.shape:
+                shift = estimate_shift(self._prev_thumb, job.thumb, job.img.shape[1])
+            self._prev_thumb = job.thumb
+            self.tracker.predict(shift)
+            if job.run_inference:
+                self.tracker.update(job.detections)
+            job.detections, job.track_ids = self.tracker.output()
+
+    def annotate_stage(self, jobs):
+        """Draws detections (a DETECTION_DTYPE array) and the info box onto each frame."""
+        if not self.annotate:
+            return
+        for job in jobs:
+            img = job.img
+            detections = job.detections
+
+            # draw detections (detect_batch only returns persons)
+            person_count = len(detections)
+            track_ids = job.track_ids.tolist() if job.track_ids is not None else [None] * person_count
+            for (x1, y1, x2, y2), conf, track_id in zip(detections['box'].astype(np.int32).tolist(), detections['conf'].tolist(), track_ids):
+                cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                label = f"person {conf:.2f}" if track_id is None else f"#{track_id} person {conf:.2f}"
+                cv2.putText(img, label, (x1, max(y1 - 10, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+            # draw info box: resolution, fps, latency, detections count
+            height, width = img.shape[:2]
+            latency_ms = (time.time() - job.recv_time) * 1000
+
+            box_x, box_y, box_w, box_h = 10, 10, 380, 110
+            cv2.rectangle(img, (box_x, box_y), (box_x + box_w, box_y + box_h), (0, 0, 0), -1)
+            cv2.rectangle(img, (box_x, box_y), (box_x + box_w, box_y + box_h), (0, 255, 0), 2)
+            cv2.putText(img, f"Resolution: {width}x{height}", (box_x + 12, box_y + 28), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            cv2.putText(img, f"Persons: {person_count}", (box_x + 12, box_y + 55), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            cv2.putText(img, f"Latency: {latency_ms:.1f} ms", (box_x + 12, box_y + 82), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+
+    def output_stage(self, jobs):
+        """
+        Wraps frames for viewers; JPEG versions are encoded when a viewer first fetches them,
+        so frames skipped by DISPLAY_FPS throttling are never encoded (each encode is timed
+        into the 'encode' metric). Without viewers the frame is not kept at all.
+        """
+        watched = bool(self.output_demand())
+        for job in jobs:
+            if not watched:
+                job.output = None
+                self.frames_not_encoded += 1
+                continue
+            job.output = RenditionCache(job.img, self.jpeg, mjpeg_chunk, self.bgr_pool.release,
+                                        self._observe_encode)
+
+    def _observe_encode(self, ms: float):
+        self.metrics.observe('encode', ms)
+
+    def add_output_demand(self, key=DEFAULT_KEY):
+        """A viewer wants (rendition, quality) for upcoming frames; pair with remove_output_demand."""
+        with self._demand_lock:
+            self._output_demand[key] = self._output_demand.get(key, 0) + 1
+
+    def remove_output_demand(self, key=DEFAULT_KEY):
+        with self._demand_lock:
+            n = self._output_demand.get(key, 0) - 1
+            if n > 0:
+                self._output_demand[key] = n
+            else:
+                self._output_demand.pop(key, None)
+
+    def output_demand(self) -> dict:
+        with self._demand_lock:
+            return dict(self._output_demand)
+
+    def publish_frame(self, job):
+        """Pipeline sink: called in frame order, so viewers never see frames go backwards."""
+        output = job.output if not job.dropped else None
+        # buffers go back to their pools whether or not the job made it through; a
+        # published frame keeps its image for on-demand renditions until the next one
+        # replaces it
+        if job.slot is not None:
+            self.frame_ring.release(job.slot)
+        else:
+            if job.img_small is not None and job.img_small is not job.img:
+                self.bgr_pool.release(job.img_small)
+            if output is None:
+                self.bgr_pool.release(job.img)
+        if job.dropped:
+            return
+        now = time.time()
+        self.scheduler.record_latency((now - job.recv_time) * 1000)
+        job.t['publish'] = now
+        job.t['inferred'] = job.run_inference
+        durations = frame_durations(job.t)
+        self.metrics.observe_frame(durations, now)
+        if self.tracer is not None:
+            self.tracer.write(self.stream_id, job.frame_seq, job.t, durations)
+        # each rendition is built once, then sent as the same bytes object to every viewer
+        self.frame_hub.publish(EncodedFrame(output, now, job.t.get('receive'), job.t.get('capture')))
+        previous, self._published_output = self._published_output, output
+        if previous is not None:
+            previous.release()
+        if self.detection_hub.subscribers:
+            self.detection_hub.publish(detection_event(self.stream_id, job, now, self.annotate))
+        if self.recorder is not None:
+            self.recorder.record_detections(job.t.get('receive') or now, job.t.get('pts'), job.detections,
+                                            job.track_ids, job.run_inference)
+
+    def record_delivery(self, frame: EncodedFrame):
+        """Called by a viewer's generator once frame has been written to its connection."""
+        now = time.time()
+        self.metrics.observe('send', (now - frame.published_at) * 1000, now)
+        if frame.received_at is not None:
+            self.metrics.observe('total', (now - frame.received_at) * 1000, now)
+        if frame.captured_at is not None:
+            self.metrics.observe('glass_to_glass', (now - frame.captured_at) * 1000, now)
+
+    @staticmethod
+    def _timed(name: str, fn):
+        # stamps <name>_start / <name>_end on every job of the batch (see metrics.frame_durations)
+        def run(jobs):
+            started = time.time()
+            try:
+                fn(jobs)
+            finally:
+                ended = time.time()
+                for job in jobs:
+                    job.t[f"{name}_start"] = started
+                    job.t[f"{name}_end"] = ended
+        return run
+
+    def build_pipeline(self) -> Pipeline:
+        stages = [
+            Stage('preprocess', self._timed('preprocess', self.preprocess_stage), **PIPELINE_STAGES['preprocess']),
+            Stage('infer', self._timed('infer', self.infer_stage), batch_size=INFERENCE_BATCH_SIZE,
+                  batch_timeout=INFERENCE_BATCH_TIMEOUT, **PIPELINE_STAGES['infer']),
+            Stage('annotate', self._timed('annotate', self.annotate_stage), **PIPELINE_STAGES['annotate']),
+            Stage('output', self._timed('output', self.output_stage), **PIPELINE_STAGES['output']),
+        ]
+        return Pipeline(stages, self.publish_frame, self.stop_event, on_error=lambda msg: self.log(msg, 'error'))
+
+    # Processing thread: feeds decoded frames from frame_ring into the staged pipeline
+    def processing_thread(self):
+        self.pipeline = self.build_pipeline()
+        self.pipeline.start()
+
+        while not self.stop_event.is_set():
+            item = self.frame_ring.get(timeout=0.5)
+            if item is None:
+                continue
+            slot, img, frame_seq, recv_time = item
+            job = FrameJob(img, recv_time)
+            job.slot = slot
+            job.frame_seq = frame_seq
+            job.output = None
+            # per-frame stamps from the receiver (see metrics.py); stages add their own
+            job.t = self.frame_ring.meta(slot) or {}
+            # blocks while the pipeline is full; meanwhile the ring keeps only the newest frames
+            self.pipeline.submit(job)
+
+        self.pipeline.join()
+        self.log(f'[Processor:{self.stream_id}] Processing thread exiting')
@@ -0,0 +1,75 @@
+"""
+Tiled inference helpers for small, distant objects.
+
+Downscaling a 1280x720 frame to 640 halves every person's size; seen from altitude
+they end up a few pixels tall and are missed. Tiled inference instead runs the
+detector on overlapping tiles cut from the full-resolution frame (views, no copies)
+and merges the per-tile boxes:
+
+ - tile_grid(w, h, tile, overlap) lays out the fewest tiles of `tile` pixels that
+   overlap by at least `overlap` of a tile, spaced evenly from edge to edge, so every
+   tile has the same size (which keeps them in one batch).
+ - merge_detections(parts) concatenates detections already in frame coordinates and
+   removes cross-tile duplicates with per-class greedy NMS. Overlap is measured as
+   intersection over the *smaller* box, so a person cut by a tile edge (a truncated
+   box inside the full one) is suppressed by the complete detection.
+"""
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from detections import empty_detections
+
+Region = Tuple[int, int, int, int]
+
+
+def _starts(length: int, tile: int, overlap: float) -> List[int]:
+    # fewest tiles that keep at least the requested overlap, spread evenly
+    if length <= tile:
+        return [0]
+    step = max(1, int(tile * (1.0 - overlap)))
+    count = int(np.ceil((length - tile) / step)) + 1
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def tile_grid(width: int, height: int, tile: int = 640, overlap: float = 0.2) -> List[Region]:
+    """(x1, y1, x2, y2) tiles covering a width x height frame."""
+    return [
+        (x, y, min(width, x + tile), min(height, y + tile))
+        for y in _starts(height, tile, overlap)
+        for x in _starts(width, tile, overlap)
+    ]
+
+
+def nms(dets: np.ndarray, threshold: float = 0.6) -> np.ndarray:
+    """Per-class greedy NMS on a DETECTION_DTYPE array using intersection over the smaller box."""
+    if len(dets) < 2:
+        return dets
+    order = np.argsort(-dets['conf'], kind='stable')
+    boxes = dets['box'][order].astype(np.float32)
+    cls = dets['cls'][order]
+    area = np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+    alive = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if not alive[i]:
+            continue
+        rest = np.nonzero(alive[i + 1:] & (cls[i + 1:] == cls[i]))[0] + i + 1
+        if not len(rest):
+            continue
+        tl = np.maximum(boxes[i, :2], boxes[rest, :2])
+        br = np.minimum(boxes[i, 2:], boxes[rest, 2:])
+        inter = np.prod(np.clip(br - tl, 0, None), axis=1)
+        smaller = np.maximum(np.minimum(area[i], area[rest]), 1e-6)
+        alive[rest[inter / smaller > threshold]] = False
+    return dets[np.sort(order[alive])]
+
+
+def merge_detections(parts: Sequence[np.ndarray], threshold: float = 0.6) -> np.ndarray:
+    """Concatenates DETECTION_DTYPE arrays (frame coordinates) and removes duplicates across them."""
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return empty_detections()
+    if len(parts) == 1:
+        return parts[0]
+    return nms(np.concatenate(parts), threshold)
@@ -0,0 +1,229 @@
+"""
+Lightweight multi-object tracker (SORT-style, pure NumPy).
+
+Each track keeps a constant-velocity Kalman filter over (cx, cy, w, h). On every
+frame the tracker predicts all tracks forward; on frames that ran the detector it
+also associates detections to tracks by IoU (greedy, highest overlap first) and
+corrects the matched filters. Unmatched detections start new tracks; tracks that go
+unmatched by `max_age` detector runs are removed. Frames the detector skips (inference
+stride, motion gating) only coast the tracks and never count against them, so the
+age limit does not shrink as the detector runs less often.
+
+This gives persistent IDs, a stable person count, and plausible boxes on frames
+where the detector is skipped, so the detector can run every few frames.
+
+All filter maths is batched over tracks (no per-track Python loops in predict/update).
+"""
+
+import itertools
+import threading
+import time
+from typing import Tuple
+
+import numpy as np
+
+from detections import DETECTION_DTYPE, empty_detections
+
+_NDIM = 4
+# constant-velocity transition for [cx, cy, w, h, vcx, vcy, vw, vh]
+_F = np.eye(2 * _NDIM, dtype=np.float64)
+_F[:_NDIM, _NDIM:] = np.eye(_NDIM)
+_H = np.eye(_NDIM, 2 * _NDIM, dtype=np.float64)
+# process/measurement noise, relative to box height (as in DeepSORT)
+_STD_POS = 1.0 / 20
+_STD_VEL = 1.0 / 160
+
+
+def _xyxy_to_cxcywh(boxes: np.ndarray) -> np.ndarray:
+    wh = boxes[:, 2:4] - boxes[:, 0:2]
+    return np.concatenate([boxes[:, 0:2] + wh / 2, wh], axis=1)
+
+
+def _cxcywh_to_xyxy(z: np.ndarray) -> np.ndarray:
+    half = z[:, 2:4] / 2
+    return np.concatenate([z[:, 0:2] - half, z[:, 0:2] + half], axis=1)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N, 4) and (M, 4) xyxy boxes."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def greedy_match(iou: np.ndarray, threshold: float):
+    """Pairs (row, col) by descending IoU above threshold; each row and column used once."""
+    pairs = []
+    if iou.size == 0:
+        return pairs
+    iou = iou.copy()
+    while True:
+        r, c = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[r, c] < threshold:
+            break
+        pairs.append((int(r), int(c)))
+        iou[r, :] = -1
+        iou[:, c] = -1
+    return pairs
+
+
+class Tracker:
+    """
+    Args:
+        iou_threshold (float): minimum IoU to associate a detection with a track.
+        max_age (int): detector runs a track survives without a matching detection.
+        min_hits (int): matched detections before a track is reported.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: int = 15, min_hits: int = 2):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self.x = np.zeros((0, 2 * _NDIM))
+        self.P = np.zeros((0, 2 * _NDIM, 2 * _NDIM))
+        self.track_ids = np.zeros(0, dtype=np.int32)
+        self.hits = np.zeros(0, dtype=np.int32)
+        # detector runs without a match, and frames (run or skipped) since the last match
+        self.misses = np.zeros(0, dtype=np.int32)
+        self.unseen = np.zeros(0, dtype=np.int32)
+        self.age = np.zeros(0, dtype=np.int32)
+        self.conf = np.zeros(0, dtype=np.float32)
+        self.cls = np.zeros(0, dtype=np.int16)
+        self.first_seen = np.zeros(0)
+        self.last_seen = np.zeros(0)
+
+    def reset(self):
+        with self._lock:
+            self._reset_state()
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    # ---------------------------------------------
+    # KALMAN STEPS (batched over tracks)
+    # ---------------------------------------------
+    def predict(self, shift: Tuple[float, float] = (0.0, 0.0)):
+        """Advances every track by one frame; shift is the camera's global motion since the previous frame."""
+        with self._lock:
+            if not len(self.x):
+                return
+            h = np.maximum(self.x[:, 3], 1.0)
+            std = np.concatenate([np.repeat((_STD_POS * h)[:, None], _NDIM, axis=1),
+                                  np.repeat((_STD_VEL * h)[:, None], _NDIM, axis=1)], axis=1)
+            Q = np.einsum('ni,ij->nij', std ** 2, np.eye(2 * _NDIM))
+            self.x = self.x @ _F.T
+            self.x[:, 0] += shift[0]
+            self.x[:, 1] += shift[1]
+            # keep sizes positive when a shrinking velocity overshoots
+            self.x[:, 2:4] = np.maximum(self.x[:, 2:4], 1.0)
+            self.P = _F @ self.P @ _F.T + Q
+            self.age += 1
+            self.unseen += 1
+
+    def update(self, dets: np.ndarray):
+        """
+        Associates a DETECTION_DTYPE array with the predicted tracks and corrects them.
+        Call only on frames the detector ran on; skipped frames just predict().
+        """
+        now = time.time()
+        with self._lock:
+            boxes = dets['box'].astype(np.float64)
+            # the detector ran on this frame: every track it did not find missed once
+            self.misses += 1
+            pairs = greedy_match(iou_matrix(_cxcywh_to_xyxy(self.x[:, :_NDIM]), boxes), self.iou_threshold)
+
+            if pairs:
+                ti = np.array([p[0] for p in pairs])
+                di = np.array([p[1] for p in pairs])
+                z = _xyxy_to_cxcywh(boxes[di])
+                x, P = self.x[ti], self.P[ti]
+                h = np.maximum(x[:, 3], 1.0)
+                R = np.einsum('ni,ij->nij', np.repeat(((_STD_POS * h) ** 2)[:, None], _NDIM, axis=1), np.eye(_NDIM))
+                S = _H @ P @ _H.T + R
+                PHt = P @ _H.T
+                # K = P H^T S^-1, solved per track without explicit inverses
+                K = np.linalg.solve(S, PHt.transpose(0, 2, 1)).transpose(0, 2, 1)
+                y = z - x[:, :_NDIM]
+                self.x[ti] = x + np.einsum('nij,nj->ni', K, y)
+                self.P[ti] = P - K @ _H @ P
+                self.hits[ti] += 1
+                self.misses[ti] = 0
+                self.unseen[ti] = 0
+                self.conf[ti] = dets['conf'][di]
+                self.cls[ti] = dets['cls'][di]
+                self.last_seen[ti] = now
+
+            # new tracks for unmatched detections
+            matched = {p[1] for p in pairs}
+            new = np.array([i for i in range(len(dets)) if i not in matched], dtype=np.int64)
+            if len(new):
+                z = _xyxy_to_cxcywh(boxes[new])
+                n = len(new)
+                x = np.concatenate([z, np.zeros((n, _NDIM))], axis=1)
+                h = np.maximum(z[:, 3], 1.0)
+                std = np.concatenate([np.repeat((2 * _STD_POS * h)[:, None], _NDIM, axis=1),
+                                      np.repeat((10 * _STD_VEL * h)[:, None], _NDIM, axis=1)], axis=1)
+                P = np.einsum('ni,ij->nij', std ** 2, np.eye(2 * _NDIM))
+                self.x = np.concatenate([self.x, x])
+                self.P = np.concatenate([self.P, P])
+                self.track_ids = np.concatenate([self.track_ids, np.array([next(self._ids) for _ in range(n)], dtype=np.int32)])
+                self.hits = np.concatenate([self.hits, np.ones(n, dtype=np.int32)])
+                self.misses = np.concatenate([self.misses, np.zeros(n, dtype=np.int32)])
+                self.unseen = np.concatenate([self.unseen, np.zeros(n, dtype=np.int32)])
+                self.age = np.concatenate([self.age, np.zeros(n, dtype=np.int32)])
+                self.conf = np.concatenate([self.conf, dets['conf'][new]])
+                self.cls = np.concatenate([self.cls, dets['cls'][new]])
+                self.first_seen = np.concatenate([self.first_seen, np.full(n, now)])
+                self.last_seen = np.concatenate([self.last_seen, np.full(n, now)])
+
+            # drop tracks that have not been matched for too long
+            keep = self.misses <= self.max_age
+            if not keep.all():
+                for name in ('x', 'P', 'track_ids', 'hits', 'misses', 'unseen', 'age', 'conf', 'cls', 'first_seen', 'last_seen'):
+                    setattr(self, name, getattr(self, name)[keep])
+
+    # ---------------------------------------------
+    # OUTPUT
+    # ---------------------------------------------
+    def output(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Reported tracks as (DETECTION_DTYPE array, track id array)."""
+        with self._lock:
+            shown = self.hits >= self.min_hits
+            if not shown.any():
+                return empty_detections(), np.zeros(0, dtype=np.int32)
+            out = np.empty(int(shown.sum()), dtype=DETECTION_DTYPE)
+            out['box'] = _cxcywh_to_xyxy(self.x[shown, :_NDIM])
+            out['conf'] = self.conf[shown]
+            out['cls'] = self.cls[shown]
+            return out, self.track_ids[shown].copy()
+
+    def tracks(self) -> list:
+        """Snapshot of all live tracks, for the API."""
+        now = time.time()
+        with self._lock:
+            boxes = _cxcywh_to_xyxy(self.x[:, :_NDIM]) if len(self.x) else np.zeros((0, 4))
+            return [
+                {
+                    'track_id': int(self.track_ids[i]),
+                    'box': [round(float(v), 1) for v in boxes[i]],
+                    'confidence': round(float(self.conf[i]), 3),
+                    'class_id': int(self.cls[i]),
+                    'confirmed': bool(self.hits[i] >= self.min_hits),
+                    'hits': int(self.hits[i]),
+                    'frames_since_detection': int(self.unseen[i]),
+                    'missed_detections': int(self.misses[i]),
+                    'age_frames': int(self.age[i]),
+                    'lifetime_s': round(now - float(self.first_seen[i]), 2),
+                }
+                for i in range(len(self.track_ids))
+            ]
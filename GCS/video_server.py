@@ -1,8 +1,32 @@
 """
-FastAPI video server that runs the socket receiver + YOLO processing in the background
-and exposes:
- - GET /video_feed -> MJPEG stream of annotated frames
- - GET /logs -> recent log entries (simple in-memory log)
+FastAPI video server that runs one socket receiver + processing pipeline per drone
+stream (see stream_session.py), all sharing a single YOLO inference engine, and exposes:
+ - GET /video_feed -> MJPEG stream of annotated frames. Frames are only JPEG-encoded while
+   someone watches, each version once for all viewers. ?size=full|preview picks the
+   rendition, ?quality= the JPEG quality, and ?max_kbps= a bandwidth target: the stream
+   then steps down in quality and size to fit it (and adapts to a slow link anyway).
+ - GET /logs -> recent log entries, oldest first, each with a sequence number;
+   ?since=<seq> returns only newer ones, ?level=warning filters, ?limit= caps the count
+ - GET /status -> health of the default stream, a summary of all streams, and the model
+   load state (the model loads in the background; see yolo_inference.py)
+ - GET /streams -> configured streams
+ - GET /streams/{id}/video_feed, /streams/{id}/status -> the same, per stream
+ - GET /streams/{id}/tracks -> live object tracks (ids, boxes, lifetimes)
+ - GET /streams/{id}/encoder -> the drone encoder's state and the last receiver feedback
+   sent to it; POST ?bitrate=&keyframe_interval=&width=&height=&adaptive= overrides it
+   (adaptive=true lets the drone adapt to the link, false pins the settings; opt-in with
+   GCS_ENCODER_FEEDBACK=1; see stream_feedback.py, drone/src/stream_control.py)
+ - GET /detections, /streams/{id}/detections -> server-sent events, one compact JSON
+   message per published frame (seq, timestamp, boxes, confidences, track ids)
+ - GET /metrics -> per-stage latency quantiles and counters in Prometheus text format
+ - GET /streams/{id}/recordings -> recorded segments of the raw drone stream (opt-in with
+   GCS_RECORDING_DIR; see recorder.py)
+ - GET /streams/{id}/recordings/clip?start=&end= -> MPEG-TS clip between two unix times,
+   cut on keyframes, served straight from the segment files
+ - GET /streams/{id}/recordings/detections?start=&end=&min_count= -> frames recorded with
+   at least min_count detections (?boxes=true adds the boxes), without decoding video
+ - GET /streams/{id}/recordings/detect?start=&end=&every= -> runs detection again on the
+   recorded clip (every n-th frame)
 
 Run with:
     uvicorn gcs_backend.video.video_server:app --host 0.0.0.0 --port 8000
@@ -11,16 +35,14 @@ This file integrates the existing receiver/YOLO logic and provides an easy way f
 `gcs_frontend_new` to consume the processed frames at http://localhost:8000/video_feed
 """
 
-import threading
-import time
-import socket
+import asyncio
 import io
-import cv2
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 import av
-import queue
-from typing import List, Dict, Any
-from fastapi import FastAPI, Response
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 # Add repo root imports
@@ -34,7 +56,13 @@ if _REPO_ROOT not in sys.path:
 if _THIS_DIR not in sys.path:
     sys.path.insert(0, _THIS_DIR)
 
-from yolo_inference import run_yolo_inference
+from yolo_inference import detect_batch, is_ready, model_status, start_background_load
+from inference_engine import InferenceEngine
+from jpeg_encoder import RENDITIONS, ViewerQuality
+from log_buffer import LEVELS, LogBuffer
+from metrics import FrameTracer, render_prometheus
+from recorder import Recorder
+from stream_session import StreamSession, MJPEG_BOUNDARY, INFERENCE_WIDTH
 # optional local stream adapter (for testing with webcam or video files)
 try:
     from local_stream import start_local_stream
@@ -55,233 +83,356 @@ app.add_middleware(
 # Configuration (fixed for RPi stream)
 SENDER_IP = '192.168.50.1'
 PORT = 8888
-FRAME_QUEUE_SIZE = 60
-RUN_INFERENCE_EVERY_N = 1
-INFERENCE_WIDTH = 640
+# Drone video streams served by this GCS: stream id -> (sender ip, port), or
+# (sender ip, port, 'rtp') to receive RTP/UDP instead of TCP (see RECEIVER_TRANSPORT in
+# stream_session.py). The first entry also backs the legacy /video_feed and /status endpoints.
+STREAMS = {
+    'drone1': (SENDER_IP, PORT),
+}
+# GCS_STREAMS="drone1=192.168.50.1:8888,drone2=rtp://192.168.50.2:8888" replaces STREAMS
+# (e.g. to point the server at local stand-in senders, see benchmarks/run_benchmark.py)
+if os.environ.get('GCS_STREAMS'):
+    STREAMS = {}
+    for _entry in os.environ['GCS_STREAMS'].split(','):
+        _sid, _addr = _entry.strip().split('=', 1)
+        _transport, _, _addr = _addr.rpartition('://')
+        _host, _port = _addr.rsplit(':', 1)
+        STREAMS[_sid] = (_host, int(_port), _transport or 'tcp')
 DISPLAY_FPS = 10
-SOCKET_RCVBUF = 4 * 1024 * 1024
+# threads that JPEG-encode frames for viewers (on their first fetch); a bounded pool of
+# its own, so many viewers cannot take over the event loop's default executor
+JPEG_ENCODE_WORKERS = min(4, os.cpu_count() or 1)
+# Default bandwidth target per MJPEG viewer in kbit/s (None: only adapt to the link)
+VIEWER_MAX_KBPS = None
+# GCS_ANNOTATE=0 serves the video without drawn boxes; clients overlay the detection
+# events instead, and the GCS does no drawing at all
+ANNOTATE_FRAMES = os.environ.get('GCS_ANNOTATE', '1') != '0'
+# Comment line sent on idle detection streams so proxies keep them open (seconds)
+SSE_KEEPALIVE = 15.0
+# The shared engine batches up to ENGINE_MAX_BATCH frames across all streams per model call
+ENGINE_MAX_BATCH = 8
+ENGINE_BATCH_TIMEOUT = 0.01
+# Recording is opt-in: set GCS_RECORDING_DIR to record the raw streams to
+# RECORDING_DIR/<stream id>/ (created when the server starts)
+RECORDING_DIR = os.environ.get('GCS_RECORDING_DIR', '')
+RECORDING_SEGMENT_SECONDS = float(os.environ.get('GCS_RECORDING_SEGMENT_SECONDS', 60))
+# per stream; the oldest segments are deleted beyond this
+RECORDING_MAX_BYTES = 20 * 1024 ** 3
+# longest clip served by /recordings/clip, and re-analysed by /recordings/detect (seconds)
+MAX_CLIP_SECONDS = 600
+MAX_DETECT_SECONDS = 120
+# Set GCS_FRAME_TRACE to a file path to append one JSON line of stage timestamps per frame
+FRAME_TRACE_PATH = os.environ.get('GCS_FRAME_TRACE')
+
+# Log entries kept for /logs; lower levels than GCS_LOG_LEVEL are dropped, and a message
+# repeated within LOG_REPEAT_WINDOW seconds is only counted (see log_buffer.py)
+LOG_CAPACITY = 1000
+LOG_LEVEL = os.environ.get('GCS_LOG_LEVEL', 'info')
+LOG_REPEAT_WINDOW = 5.0
 
 # Shared state
-frame_queue = queue.Queue(maxsize=FRAME_QUEUE_SIZE)
-latest_frame_jpg = None
-latest_frame_lock = threading.Lock()
-stop_event = threading.Event()
-receiver_connected = False
-logs: List[Dict[str, Any]] = []
+logs = LogBuffer(LOG_CAPACITY, LOG_LEVEL, LOG_REPEAT_WINDOW)
 
 
 def log(msg: str, level: str = 'info'):
-    entry = {'timestamp': time.time(), 'level': level, 'message': msg}
-    logs.append(entry)
-    # keep log size bounded
-    if len(logs) > 500:
-        del logs[0]
-    print(msg)
+    logs.log(msg, level)
 
 
-# Receiver thread
-def receiver_thread():
-    # expose status flag from this thread
-    global receiver_connected
+engine = InferenceEngine(detect_batch, max_batch=ENGINE_MAX_BATCH, batch_timeout=ENGINE_BATCH_TIMEOUT,
+                         on_error=lambda msg: log(msg, 'error'), ready_fn=is_ready)
+tracer = FrameTracer(FRAME_TRACE_PATH) if FRAME_TRACE_PATH else None
+jpeg_executor = ThreadPoolExecutor(JPEG_ENCODE_WORKERS, thread_name_prefix='jpeg')
 
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RCVBUF)
-        sock.settimeout(10)
-        max_retries = 3
-        for attempt in range(1, max_retries + 1):
-            try:
-                sock.connect((SENDER_IP, PORT))
-                # mark receiver connected (used by /status)
-                receiver_connected = True
-                log(f"[Receiver] Connected to sender at {SENDER_IP}:{PORT} (attempt {attempt})")
-                break
-            except socket.timeout:
-                log(f"[Receiver] Connection attempt {attempt} timed out", 'warning')
-            except Exception as e:
-                log(f"[Receiver] Connection attempt {attempt} failed: {e}", 'warning')
-            if attempt < max_retries:
-                time.sleep(1.0)
-        else:
-            log("[Receiver] Failed to connect after retries", 'error')
-            return
-
-        sock_file = sock.makefile('rb')
-        container = av.open(sock_file, format='mpegts')
-
-        for frame in container.decode(video=0):
-            if stop_event.is_set():
-                break
-            try:
-                img = frame.to_ndarray(format='bgr24')
-            except Exception as e:
-                log(f"[Receiver] frame conversion error: {e}", 'warning')
-                continue
-            timestamp = time.time()
-            try:
-                frame_queue.put_nowait((img, timestamp))
-            except queue.Full:
-                try:
-                    _ = frame_queue.get_nowait()
-                    frame_queue.put_nowait((img, timestamp))
-                except queue.Full:
-                    pass
-    except Exception as e:
-        log(f"[Receiver] Error: {e}", 'error')
-        # on any error, mark disconnected
-        try:
-            receiver_connected = False
-        except Exception:
-            pass
-    finally:
-        try:
-            sock.close()
-        except Exception:
-            pass
-        # ensure status cleared when thread exits
-        try:
-            receiver_connected = False
-        except Exception:
-            pass
-        log("[Receiver] Receiver thread exiting")
-
-
-# Processing thread: pulls frames, runs YOLO, draws boxes, updates latest_frame_jpg
-def processing_thread():
-    frame_count = 0
-    prev_time = time.time()
-    infer_counter = 0
-    last_display = 0
-
-    while not stop_event.is_set():
-        try:
-            img, recv_time = frame_queue.get(timeout=0.5)
-        except queue.Empty:
-            continue
-
-        frame_count += 1
-        now = time.time()
-
-        # decide whether to run inference on this frame
-        run_inference = (infer_counter % RUN_INFERENCE_EVERY_N == 0)
-        infer_counter += 1
-
-        detections = {"boxes": [], "confidences": [], "class_ids": [], "class_names": []}
-
-        if run_inference:
-            h, w = img.shape[:2]
-            scale = 1.0
-            if max(w, h) > INFERENCE_WIDTH:
-                scale = INFERENCE_WIDTH / float(max(w, h))
-                new_w = int(w * scale)
-                new_h = int(h * scale)
-                img_small = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
-            else:
-                img_small = img
-
-            try:
-                detections = run_yolo_inference(img_small)
-            except Exception as e:
-                log(f"[Processor] YOLO inference error: {e}", 'error')
-                detections = {"boxes": [], "confidences": [], "class_ids": [], "class_names": []}
-
-            # scale boxes back to original coordinates if resized
-            if scale != 1.0 and detections.get("boxes"):
-                scaled_boxes = []
-                for box in detections["boxes"]:
-                    x1 = int(box[0] / scale)
-                    y1 = int(box[1] / scale)
-                    x2 = int(box[2] / scale)
-                    y2 = int(box[3] / scale)
-                    scaled_boxes.append([x1, y1, x2, y2])
-                detections["boxes"] = scaled_boxes
-
-        # draw detections (only persons)
-        person_count = 0
-        if detections and detections.get("boxes"):
-            for box, cls_name, conf in zip(detections["boxes"], detections["class_names"], detections["confidences"]):
-                if cls_name != "person":
-                    continue
-                person_count += 1
-                x1, y1, x2, y2 = map(int, box)
-                cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                label = f"{cls_name} {conf:.2f}"
-                cv2.putText(img, label, (x1, max(y1 - 10, 0)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
-        # draw info box: resolution, fps, latency, detections count
-        height, width = img.shape[:2]
-        latency_ms = (time.time() - recv_time) * 1000
+def make_recorder(stream_id: str) -> Optional[Recorder]:
+    if not RECORDING_DIR:
+        return None
+    return Recorder(os.path.join(RECORDING_DIR, stream_id), RECORDING_SEGMENT_SECONDS, RECORDING_MAX_BYTES, log=log)
 
-        box_x, box_y, box_w, box_h = 10, 10, 380, 110
-        cv2.rectangle(img, (box_x, box_y), (box_x + box_w, box_y + box_h), (0, 0, 0), -1)
-        cv2.rectangle(img, (box_x, box_y), (box_x + box_w, box_y + box_h), (0, 255, 0), 2)
-        cv2.putText(img, f"Resolution: {width}x{height}", (box_x + 12, box_y + 28), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        cv2.putText(img, f"Persons: {person_count}", (box_x + 12, box_y + 55), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-        cv2.putText(img, f"Latency: {latency_ms:.1f} ms", (box_x + 12, box_y + 82), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
 
-        # encode to JPEG
-        ret, jpg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
-        if ret:
-            with latest_frame_lock:
-                global latest_frame_jpg
-                latest_frame_jpg = jpg.tobytes()
+sessions: Dict[str, StreamSession] = {
+    stream_id: StreamSession(stream_id, host, port, engine, log, tracer, *transport, annotate=ANNOTATE_FRAMES,
+                             recorder=make_recorder(stream_id))
+    for stream_id, (host, port, *transport) in STREAMS.items()
+}
+default_stream_id = next(iter(STREAMS))
 
-        # small sleep to avoid hogging CPU if upstream is very fast
-        time.sleep(0.001)
 
-    log('[Processor] Processing thread exiting')
+def get_session(stream_id: str) -> StreamSession:
+    session = sessions.get(stream_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Unknown stream '{stream_id}'")
+    return session
 
 
 @app.on_event('startup')
-def start_workers():
-    # Always start the RPi receiver and processor threads
-    t_recv = threading.Thread(target=receiver_thread, daemon=True)
-    t_proc = threading.Thread(target=processing_thread, daemon=True)
-    t_recv.start()
-    t_proc.start()
-    log('[Server] Workers started')
+async def start_workers():
+    loop = asyncio.get_running_loop()
+    # the model loads and warms up in the background so the app serves immediately;
+    # until it is warm, frames are streamed without detections
+    start_background_load(INFERENCE_WIDTH, log)
+    engine.start()
+    # one receiver + processor pair per configured drone
+    for session in sessions.values():
+        session.start(loop)
+    log(f'[Server] Workers started for {len(sessions)} stream(s)')
 
 
 @app.on_event('shutdown')
 def stop_workers():
-    stop_event.set()
+    for session in sessions.values():
+        session.stop()
+    engine.stop()
+    jpeg_executor.shutdown(wait=False)
+    if tracer is not None:
+        tracer.close()
     log('[Server] Shutdown requested')
+    logs.close()
+
+
+async def mjpeg_generator(session: StreamSession, quality: ViewerQuality):
+    # yields multipart/x-mixed-replace chunks as the pipeline publishes them;
+    # a client that falls behind skips straight to the newest frame
+    loop = asyncio.get_running_loop()
+    key = quality.key
+    session.add_output_demand(key)
+    try:
+        async for frame in session.frame_hub.subscribe(min_interval=1.0 / max(1, DISPLAY_FPS)):
+            if frame.output is None:
+                continue
+            if quality.key != key:
+                session.remove_output_demand(key)
+                key = quality.key
+                session.add_output_demand(key)
+            chunk = frame.output.cached(key)
+            if chunk is None:
+                # first viewer of this version of the frame: encode it off the event loop
+                chunk = await loop.run_in_executor(jpeg_executor, frame.output.get, key)
+                if chunk is None:
+                    # replaced by a newer frame in the meantime
+                    continue
+            started = time.perf_counter()
+            yield chunk
+            # resumed once the server has written the chunk to this client
+            quality.observe(len(chunk), time.perf_counter() - started)
+            session.record_delivery(frame)
+    finally:
+        session.remove_output_demand(key)
+
+
+def mjpeg_response(session: StreamSession, size: str = 'full', quality: Optional[int] = None,
+                   max_kbps: Optional[float] = None) -> StreamingResponse:
+    if size not in RENDITIONS:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(RENDITIONS)}")
+    if quality is not None and not 1 <= quality <= 100:
+        raise HTTPException(status_code=400, detail="quality must be between 1 and 100")
+    viewer = ViewerQuality(max_kbps if max_kbps is not None else VIEWER_MAX_KBPS, DISPLAY_FPS, size, quality)
+    return StreamingResponse(mjpeg_generator(session, viewer), media_type=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}')
 
 
-def mjpeg_generator(boundary: str = 'frame'):
-    # yields multipart/x-mixed-replace frames using latest_frame_jpg
-    while not stop_event.is_set():
-        with latest_frame_lock:
-            img = latest_frame_jpg
-        if img is None:
-            # no frame yet; wait a bit
-            time.sleep(0.05)
-            continue
-        # yield multipart chunk
-        yield (b"--%b\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % (boundary.encode(), len(img))) + img + b"\r\n"
-        time.sleep(1.0 / max(1, DISPLAY_FPS))
+async def detection_events(session: StreamSession):
+    # reconnect quickly after a dropped connection (EventSource retry in ms)
+    yield b'retry: 2000\n\n'
+    async for event in session.detection_hub.subscribe(idle_timeout=SSE_KEEPALIVE):
+        yield event if event is not None else b': keepalive\n\n'
+
+
+def detections_response(session: StreamSession) -> StreamingResponse:
+    return StreamingResponse(detection_events(session), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.get('/video_feed')
-def video_feed():
-    return StreamingResponse(mjpeg_generator(), media_type='multipart/x-mixed-replace; boundary=frame')
+async def video_feed(size: str = 'full', quality: Optional[int] = None, max_kbps: Optional[float] = None):
+    return mjpeg_response(sessions[default_stream_id], size, quality, max_kbps)
+
+
+@app.get('/detections')
+async def detections():
+    return detections_response(sessions[default_stream_id])
+
+
+@app.get('/streams')
+def list_streams():
+    return JSONResponse(content=[session.status() for session in sessions.values()])
+
+
+@app.get('/streams/{stream_id}/video_feed')
+async def stream_video_feed(stream_id: str, size: str = 'full', quality: Optional[int] = None,
+                            max_kbps: Optional[float] = None):
+    return mjpeg_response(get_session(stream_id), size, quality, max_kbps)
+
+
+@app.get('/streams/{stream_id}/detections')
+async def stream_detections(stream_id: str):
+    return detections_response(get_session(stream_id))
+
+
+@app.get('/streams/{stream_id}/status')
+def stream_status(stream_id: str):
+    status = get_session(stream_id).status()
+    status['inference'] = engine.stats()['streams'].get(stream_id, {})
+    return JSONResponse(content=status)
+
+
+@app.get('/streams/{stream_id}/tracks')
+def stream_tracks(stream_id: str):
+    session = get_session(stream_id)
+    if session.tracker is None:
+        raise HTTPException(status_code=404, detail="Tracking is disabled")
+    return JSONResponse(content=session.tracker.tracks())
+
+
+@app.get('/streams/{stream_id}/encoder')
+def stream_encoder(stream_id: str):
+    session = get_session(stream_id)
+    if session.feedback is None:
+        raise HTTPException(status_code=404, detail="Encoder feedback is disabled")
+    return JSONResponse(content=session.feedback.stats())
+
+
+@app.post('/streams/{stream_id}/encoder')
+def configure_encoder(stream_id: str, bitrate: Optional[int] = None, keyframe_interval: Optional[int] = None,
+                      width: Optional[int] = None, height: Optional[int] = None, adaptive: Optional[bool] = None):
+    session = get_session(stream_id)
+    if session.feedback is None:
+        raise HTTPException(status_code=404, detail="Encoder feedback is disabled")
+    if (width is None) != (height is None):
+        raise HTTPException(status_code=400, detail="width and height go together")
+    settings = {'bitrate': bitrate, 'keyframe_interval': keyframe_interval, 'adaptive': adaptive,
+                'resolution': [width, height] if width is not None else None}
+    settings = {k: v for k, v in settings.items() if v is not None}
+    if not settings:
+        raise HTTPException(status_code=400, detail="nothing to set")
+    if not session.feedback.configure(**settings):
+        raise HTTPException(status_code=503, detail="No control connection to the drone")
+    return JSONResponse(content={'sent': settings, 'encoder': session.feedback.encoder_state})
+
+
+def get_recorder(stream_id: str) -> Recorder:
+    session = get_session(stream_id)
+    if session.recorder is None:
+        raise HTTPException(status_code=404, detail="Recording is disabled")
+    return session.recorder
+
+
+def clip_window(start: float, end: Optional[float], duration: float, limit: float):
+    end = start + duration if end is None else end
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if end - start > limit:
+        raise HTTPException(status_code=400, detail=f"clips are limited to {limit:.0f} seconds")
+    return start, end
+
+
+@app.get('/streams/{stream_id}/recordings')
+def stream_recordings(stream_id: str):
+    recorder = get_recorder(stream_id)
+    return JSONResponse(content={'stats': recorder.stats(), 'segments': recorder.segments()})
+
+
+@app.get('/streams/{stream_id}/recordings/clip')
+def recording_clip(stream_id: str, start: float, end: Optional[float] = None, duration: float = 10.0):
+    recorder = get_recorder(stream_id)
+    start, end = clip_window(start, end, duration, MAX_CLIP_SECONDS)
+    if not recorder.clip_ranges(start, end):
+        raise HTTPException(status_code=404, detail="Nothing recorded in that interval")
+    # a sync iterator: Starlette reads the files in its threadpool
+    return StreamingResponse(recorder.iter_clip(start, end), media_type='video/mp2t', headers={
+        'Content-Disposition': f'attachment; filename="{stream_id}-{int(start)}-{int(end)}.ts"'})
+
+
+@app.get('/streams/{stream_id}/recordings/detections')
+def recording_detections(stream_id: str, start: float, end: Optional[float] = None, min_count: int = 1,
+                         boxes: bool = False):
+    recorder = get_recorder(stream_id)
+    frames = recorder.detections(start, time.time() if end is None else end, min_count, boxes)
+    return JSONResponse(content=frames)
+
+
+@app.get('/streams/{stream_id}/recordings/detect')
+def recording_detect(stream_id: str, start: float, end: Optional[float] = None, duration: float = 10.0,
+                     every: int = 1):
+    recorder = get_recorder(stream_id)
+    start, end = clip_window(start, end, duration, MAX_DETECT_SECONDS)
+    if every < 1:
+        raise HTTPException(status_code=400, detail="every must be at least 1")
+    if not recorder.clip_ranges(start, end):
+        raise HTTPException(status_code=404, detail="Nothing recorded in that interval")
+    if not engine.ready():
+        raise HTTPException(status_code=503, detail="The model is not loaded")
+
+    # decode the clip as recorded and push it through the shared engine under its own
+    # stream id, so the live streams keep their fair share of the model
+    frames, results = [], []
+
+    def flush():
+        dets = engine.infer(f"{stream_id}:clip", [img for _, img in frames], INFERENCE_WIDTH)
+        for (pts, _), d in zip(frames, dets):
+            results.append({'pts': pts, 'boxes': d['box'].round().astype(int).tolist(),
+                            'conf': [round(c, 2) for c in d['conf'].tolist()]})
+        frames.clear()
+
+    try:
+        with av.open(recorder.open_clip(start, end), format='mpegts') as container:
+            for i, frame in enumerate(container.decode(video=0)):
+                if i % every:
+                    continue
+                frames.append((frame.pts, frame.to_ndarray(format='bgr24')))
+                if len(frames) >= ENGINE_MAX_BATCH:
+                    flush()
+    except av.error.FFmpegError as e:
+        # a clip cut short by retention or a damaged tail: report what decoded
+        log(f'[Recorder] Clip decode stopped for {stream_id}: {e}', 'warning')
+    if frames:
+        flush()
+    return JSONResponse(content={'start': start, 'end': end, 'frames': results})
+
+
+@app.get('/metrics')
+def get_metrics():
+    gauges = []
+    for sid, session in sessions.items():
+        labels = {'stream': sid}
+        frames = session.frame_ring.stats()
+        gauges += [
+            ('gcs_frames_received_total', 'counter', 'Decoded frames committed to the frame ring.', labels, frames['frames_written']),
+            ('gcs_frames_dropped_total', 'counter', 'Decoded frames dropped before processing.', labels, frames['frames_dropped']),
+            ('gcs_bytes_received_total', 'counter', 'Bytes read from the drone link.', labels, session.bytes_received),
+            ('gcs_reconnects_total', 'counter', 'Receiver reconnects.', labels, session.reconnects),
+            ('gcs_receiver_connected', 'gauge', '1 while the receiver is connected.', labels, int(bool(session.receiver_connected))),
+            ('gcs_viewers', 'gauge', 'Connected MJPEG viewers.', labels, session.frame_hub.subscribers),
+            ('gcs_detection_subscribers', 'gauge', 'Connected detection event streams.', labels, session.detection_hub.subscribers),
+            ('gcs_detection_events_dropped_total', 'counter', 'Detection events dropped for slow subscribers.', labels, session.detection_hub.dropped),
+        ]
+    gauges.append(('gcs_inference_batches_total', 'counter', 'Model calls made by the shared engine.', {}, engine.batches))
+    gauges.append(('gcs_log_repeats_suppressed_total', 'counter', 'Repeated log messages counted instead of logged.', {}, logs.suppressed))
+    body = render_prometheus({sid: session.metrics for sid, session in sessions.items()}, gauges)
+    return PlainTextResponse(body, media_type='text/plain; version=0.0.4')
 
 
 @app.get('/logs')
-def get_logs():
-    return JSONResponse(content=logs)
+def get_logs(since: int = 0, level: Optional[str] = None, limit: Optional[int] = None):
+    if level is not None and level not in LEVELS:
+        raise HTTPException(status_code=400, detail=f"level must be one of {list(LEVELS)}")
+    return JSONResponse(content=logs.since(since, level, limit))
 
 
 @app.get('/status')
 def get_status():
     """Return simple health info useful to the frontend: whether receiver/local stream is connected and recent logs count."""
-    try:
-        rc = bool(receiver_connected)
-    except Exception:
-        rc = False
+    default = sessions[default_stream_id].status()
     return JSONResponse(content={
-        'receiver_connected': rc,
-        'log_count': len(logs)
+        'receiver_connected': default['receiver_connected'],
+        'log_count': len(logs),
+        'log_seq': logs.last_seq,
+        'receiver': default['receiver'],
+        'frames': default['frames'],
+        'viewers': default['viewers'],
+        'annotated': default['annotated'],
+        'streams': {sid: bool(s.receiver_connected) for sid, s in sessions.items()},
+        'inference': engine.stats(),
+        'model': model_status(),
     })
 
 
@@ -1,72 +1,208 @@
-from ultralytics import YOLO
+"""
+YOLO person detection for the GCS.
+
+Nothing heavy happens at import: torch, Ultralytics and the weights are loaded by
+load_model(), which the server runs in a background thread (start_background_load)
+so the HTTP app answers /status and /logs immediately. Loading ends with a warm-up
+inference so the first real frame does not pay for lazy initialisation. Until the
+model is warm, detect_batch returns no detections and frames pass through
+un-annotated. Standalone callers that never started a load get a synchronous one on
+first use.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
 import numpy as np
-import torch
 
-# Load model once and move to GPU if available. Use FP16 on CUDA for speed.
-_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+from detections import class_ids_for, detections_to_dict, empty_detections, extract_detections
+from inference_backends import DetectorBackend
+
+# PyTorch runs on the GPU if available, with FP16 on CUDA for speed. The exported
+# backends ('onnx', 'openvino', 'openvino-int8', see inference_backends.py) run on CPU
+# and are usually much faster there; GCS_INFERENCE_BACKEND selects one.
 _MODEL_PATH = "yolov8m.pt"
+INFERENCE_BACKEND = os.environ.get('GCS_INFERENCE_BACKEND', 'torch')
+MODEL_CACHE_DIR = os.environ.get('GCS_MODEL_CACHE', 'model_cache')
+# size exported (for exported backends) and warmed up by default; the model runs at any size
+_WARMUP_SIZE = 640
+# background load retries after a failure: first delay (seconds), doubled up to the max
+LOAD_RETRY_DELAY = 5.0
+LOAD_RETRY_MAX_DELAY = 300.0
+
+backend = None
+model = None
+_load_lock = threading.Lock()
+_load_thread = None
+# 'not_started' -> 'loading' -> 'warming' -> 'warm', or 'failed' (the background loader
+# retries from 'failed', see start_background_load)
+_status = {'state': 'not_started', 'error': None, 'load_s': None, 'warmup_s': None, 'ready_at': None,
+           'attempts': 0, 'retry_in_s': None}
+
+
+def _set_status(**fields):
+    _status.update(fields)
 
-try:
-    model = YOLO(_MODEL_PATH)
-    # move underlying model to device where supported
-    if _DEVICE == "cuda":
+
+def load_model(imgsz: int = _WARMUP_SIZE, log: Callable[[str], None] = print,
+               threads: Optional[int] = None) -> bool:
+    """
+    Loads the configured backend and runs one warm-up inference at imgsz.
+
+    threads limits the ONNX Runtime / OpenVINO intra-op threads (None: runtime default).
+
+    Safe to call more than once; only the first call loads. Returns True when the
+    model is warm, False if loading failed (the error is in model_status()).
+    """
+    global backend, model
+    with _load_lock:
+        if _status['state'] == 'warm':
+            return True
+        if _status['state'] == 'failed':
+            return False
+        started = time.time()
+        _set_status(state='loading', started_at=started, imgsz=imgsz, backend=INFERENCE_BACKEND,
+                    attempts=_status['attempts'] + 1, retry_in_s=None)
         try:
-            model.model.to('cuda')
-        except Exception:
-            pass
-except Exception as e:
-    # lazy fallback if model fails to load here
-    model = None
-    print(f"[yolo_inference] Failed to load model '{_MODEL_PATH}': {e}")
+            import torch
 
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            _set_status(device=device)
+            b = DetectorBackend(_MODEL_PATH, INFERENCE_BACKEND, MODEL_CACHE_DIR, device, log, export_imgsz=imgsz,
+                                threads=threads)
+            m = b.model()
+            loaded = time.time()
+            _set_status(state='warming', load_s=round(loaded - started, 2))
+            # the first call initialises the predictor, runtime graph and memory pools
+            b.predict([np.zeros((imgsz, imgsz, 3), dtype=np.uint8)], imgsz, 0.5)
+            warm = time.time()
+        except Exception as e:
+            _set_status(state='failed', error=str(e), failed_after_s=round(time.time() - started, 2))
+            log(f"[Model] Failed to load '{_MODEL_PATH}' ({INFERENCE_BACKEND}): {e}")
+            return False
+        backend, model = b, m
+        _set_status(state='warm', error=None, warmup_s=round(warm - loaded, 2), ready_at=warm)
+        log(f"[Model] {INFERENCE_BACKEND} model warm in {warm - started:.1f}s "
+            f"(load {loaded - started:.1f}s, warm-up {warm - loaded:.1f}s)")
+        return True
 
-def run_yolo_inference(frame: np.ndarray, imgsz: int = 640, conf_thresh: float = 0.2):
+
+def _load_with_retry(imgsz: int, log: Callable[[str], None]):
+    # a failed load (download error, broken cache entry, missing runtime) is retried with
+    # exponential backoff, so a transient failure does not leave the server without a model
+    delay = LOAD_RETRY_DELAY
+    while not load_model(imgsz, log):
+        log(f"[Model] Retrying load in {delay:.0f}s")
+        _set_status(retry_in_s=delay)
+        time.sleep(delay)
+        with _load_lock:
+            _set_status(state='not_started')
+        delay = min(delay * 2, LOAD_RETRY_MAX_DELAY)
+
+
+def start_background_load(imgsz: int = _WARMUP_SIZE, log: Callable[[str], None] = print) -> threading.Thread:
     """
-    Runs YOLOv8 inference on a single frame and returns only 'person' detections.
+    Starts load_model in a daemon thread (once) and returns the thread.
+
+    A failed load is retried every LOAD_RETRY_DELAY seconds, doubling up to
+    LOAD_RETRY_MAX_DELAY; model_status() shows the error and the attempts so far.
+    """
+    global _load_thread
+    if _load_thread is None:
+        _set_status(state='loading', started_at=time.time(), imgsz=imgsz, backend=INFERENCE_BACKEND)
+        _load_thread = threading.Thread(target=_load_with_retry, args=(imgsz, log), name='model-loader',
+                                        daemon=True)
+        _load_thread.start()
+    return _load_thread
+
+
+def is_ready() -> bool:
+    return _status['state'] == 'warm'
+
+
+def model_status() -> dict:
+    """Load state and timings for /status; includes backend details once loaded."""
+    status = {k: v for k, v in _status.items() if k not in ('started_at', 'ready_at')}
+    if _status['state'] in ('loading', 'warming'):
+        status['elapsed_s'] = round(time.time() - _status['started_at'], 2)
+    if backend is not None:
+        status.update(backend.stats())
+    return status
+
+
+_person_ids = None
+
+
+def _target_class_ids() -> np.ndarray:
+    # resolved once from the model's label map; 'person' is the only class the GCS draws
+    global _person_ids
+    if _person_ids is None:
+        _person_ids = class_ids_for(model.names, ('person',))
+    return _person_ids
+
+
+def detect_batch(frames: List[np.ndarray], imgsz: int = 640, conf_thresh: float = 0.2) -> List[np.ndarray]:
+    """
+    Runs YOLOv8 inference on several frames in a single model call and returns only 'person' detections.
+
+    All frames are letterboxed to the same tensor size, so the predictor's per-call
+    overhead (pre-processing setup, NMS launch, device sync) is paid once per batch
+    instead of once per frame. Post-processing is vectorized (see detections.py).
 
     Args:
-        frame (np.ndarray): The input image/frame (BGR, as from OpenCV).
+        frames (List[np.ndarray]): Input images/frames (BGR, as from OpenCV).
         imgsz (int): Inference image size (max dimension); model will be given this size.
+        conf_thresh (float): Minimum confidence to keep.
 
     Returns:
-        dict: {"boxes": [[x1,y1,x2,y2],...], "confidences": [...], "class_ids": [...], "class_names": [...]}
+        list: one DETECTION_DTYPE structured array per input frame, in input order
+        (empty arrays while a background load is still in progress).
+
+    Raises:
+        RuntimeError: the model failed to load (a background load keeps retrying).
     """
-    global model
-    if model is None:
-        raise RuntimeError("YOLO model is not loaded")
+    if not frames:
+        return []
+    if not is_ready():
+        if _load_thread is not None:
+            if _status['state'] == 'failed':
+                raise RuntimeError(f"YOLO model failed to load (retrying): {_status['error']}")
+            return [empty_detections() for _ in frames]
+        # standalone use: load on first call
+        if not load_model():
+            raise RuntimeError(f"YOLO model failed to load: {_status['error']}")
 
-    # ultralytics accepts BGR numpy arrays; pass device and half flag
-    half_flag = True if _DEVICE == "cuda" else False
+    # A list source is stacked into one batch by the predictor
+    results = backend.predict(list(frames), imgsz, conf_thresh)
 
-    # Call model with resized imgsz for faster inference
-    results = model(frame, device=_DEVICE, imgsz=imgsz, half=half_flag)
+    class_ids = _target_class_ids()
+    return [extract_detections(r, class_ids, conf_thresh) for r in results]
 
-    boxes = []
-    confidences = []
-    class_ids = []
-    class_names = []
 
-    r = results[0]
-    # r.boxes may be empty
-    for b in getattr(r, 'boxes', []):
-        try:
-            cls = int(b.cls[0])
-            name = model.names[cls]
-            # filter for person only to reduce downstream work
-            if name != 'person':
-                continue
-            xyxy = [float(x) for x in b.xyxy[0]]
-            conf = float(b.conf[0])
-            boxes.append(xyxy)
-            confidences.append(conf)
-            class_ids.append(cls)
-            class_names.append(name)
-        except Exception:
-            continue
-
-    return {
-        "boxes": boxes,
-        "confidences": confidences,
-        "class_ids": class_ids,
-        "class_names": class_names,
-    }
\ No newline at end of file
+def run_yolo_inference_batch(frames: List[np.ndarray], imgsz: int = 640, conf_thresh: float = 0.2):
+    """
+    Batched variant of run_yolo_inference.
+
+    Returns:
+        list: one dict per input frame, in input order, shaped like run_yolo_inference's result.
+    """
+    detections = detect_batch(frames, imgsz, conf_thresh)
+    # while a background load runs the results are empty and there are no names yet
+    names = model.names if model is not None else None
+    return [detections_to_dict(d, names) for d in detections]
+
+
+def run_yolo_inference(frame: np.ndarray, imgsz: int = 640, conf_thresh: float = 0.2):
+    """
+    Runs YOLOv8 inference on a single frame and returns only 'person' detections.
+
+    Args:
+        frame (np.ndarray): The input image/frame (BGR, as from OpenCV).
+        imgsz (int): Inference image size (max dimension); model will be given this size.
+
+    Returns:
+        dict: {"boxes": [[x1,y1,x2,y2],...], "confidences": [...], "class_ids": [...], "class_names": [...]}
+    """
+    return run_yolo_inference_batch([frame], imgsz=imgsz, conf_thresh=conf_thresh)[0]
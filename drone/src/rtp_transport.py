@@ -0,0 +1,162 @@
+"""
+MPEG-TS over RTP/UDP (RFC 2250) as an alternative to the TCP stream.
+
+On a lossy radio link TCP turns every lost segment into a retransmission stall for
+everything behind it. Over UDP a lost datagram costs only the frames it belonged to;
+the GCS notices the gap in RTP sequence numbers and resumes at the next keyframe.
+
+The GCS keeps the same (host, port) configuration as for TCP: its receiver sends a
+small HELLO datagram to the drone's UDP port every second, and RtpServer streams to
+every address that said hello within SUBSCRIBER_TIMEOUT seconds (BYE unsubscribes).
+Each subscriber is a TsFanout sink that starts at the next keyframe and gets 7 TS
+packets (1316 bytes) per datagram, with its own sequence numbers and SSRC. Sends are
+non-blocking; a datagram the kernel cannot take is dropped, never waited for.
+"""
+
+import os
+import socket
+import struct
+import time
+from threading import Lock, Thread
+
+from stream_fanout import TS_PACKET_SIZE
+
+RTP_PAYLOAD_TYPE = 33
+# 7 TS packets keep a datagram under a 1500-byte MTU with IP/UDP/RTP headers
+TS_PACKETS_PER_DATAGRAM = 7
+HELLO = b'GCS-HELLO'
+BYE = b'GCS-BYE'
+SUBSCRIBER_TIMEOUT = 5.0
+
+
+class RtpSubscriber:
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.last_seen = time.monotonic()
+        self.ssrc = struct.unpack('!I', os.urandom(4))[0]
+        self._seq = struct.unpack('!H', os.urandom(2))[0]
+        self._lock = Lock()
+        self._closed = False
+        self.waiting = True
+
+        self.datagrams_sent = 0
+        self.bytes_sent = 0
+        self.send_drops = 0
+
+    def offer(self, data, keyframe, header):
+        """Packetizes a run of TS packets into RTP datagrams (called by TsFanout)."""
+        with self._lock:
+            if self._closed:
+                return
+            if self.waiting:
+                if not keyframe:
+                    return
+                self.waiting = False
+                data = header + data
+            # 90 kHz clock, as for the PES timestamps
+            timestamp = int(time.time() * 90000) & 0xFFFFFFFF
+            step = TS_PACKET_SIZE * TS_PACKETS_PER_DATAGRAM
+            for i in range(0, len(data), step):
+                rtp = struct.pack('!BBHII', 0x80, RTP_PAYLOAD_TYPE, self._seq, timestamp, self.ssrc)
+                self._seq = (self._seq + 1) & 0xFFFF
+                try:
+                    self.sock.sendto(rtp + data[i:i + step], socket.MSG_DONTWAIT, self.addr)
+                except OSError:
+                    # full send buffer (EAGAIN/ENOBUFS) or unreachable peer
+                    self.send_drops += 1
+                    continue
+                self.datagrams_sent += 1
+                self.bytes_sent += len(rtp) + min(step, len(data) - i)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+
+    def stats(self):
+        return {
+            'addr': f"{self.addr[0]}:{self.addr[1]}",
+            'transport': 'rtp',
+            'bytes_sent': self.bytes_sent,
+            'datagrams_sent': self.datagrams_sent,
+            'send_drops': self.send_drops,
+            'waiting_keyframe': self.waiting,
+        }
+
+
+class RtpServer:
+    """
+    Args:
+        fanout (TsFanout): the encoded stream to serve.
+        port (int): UDP port receiving HELLOs and sending RTP.
+        max_subscribers (int): further HELLOs are ignored.
+    """
+
+    def __init__(self, fanout, port=8888, max_subscribers=4):
+        self.fanout = fanout
+        self.port = port
+        self.max_subscribers = max_subscribers
+        self.sock = None
+        self.thread = None
+        self._subscribers = {}
+        self._running = False
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1024 * 1024)
+        self.sock.bind(("0.0.0.0", self.port))
+        self.sock.settimeout(1.0)
+        self._running = True
+        self.thread = Thread(target=self._control_loop, daemon=True)
+        self.thread.start()
+        print(f"[RTP] Ready on UDP port {self.port}")
+
+    def stop(self):
+        self._running = False
+        if self.thread:
+            self.thread.join()
+        for sub in list(self._subscribers.values()):
+            self.fanout.detach(sub)
+            sub.close()
+        self._subscribers.clear()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    # ---------------------------------------------
+    # SUBSCRIPTIONS (HELLO / BYE / timeout)
+    # ---------------------------------------------
+    def _control_loop(self):
+        while self._running:
+            try:
+                data, addr = self.sock.recvfrom(64)
+            except socket.timeout:
+                data, addr = None, None
+            except OSError:
+                # ICMP unreachable from a vanished subscriber surfaces here on Linux
+                data, addr = None, None
+
+            if data == HELLO:
+                sub = self._subscribers.get(addr)
+                if sub is not None:
+                    sub.last_seen = time.monotonic()
+                elif len(self._subscribers) < self.max_subscribers:
+                    sub = RtpSubscriber(self.sock, addr)
+                    self._subscribers[addr] = sub
+                    # no GOP burst over UDP: it would mostly be lost; start at the next keyframe
+                    self.fanout.attach(sub, prefill=False)
+                    print(f"[RTP] Streaming to {addr[0]}:{addr[1]}")
+            elif data == BYE and addr in self._subscribers:
+                self._drop(addr)
+
+            now = time.monotonic()
+            for addr, sub in list(self._subscribers.items()):
+                if now - sub.last_seen > SUBSCRIBER_TIMEOUT:
+                    self._drop(addr)
+
+    def _drop(self, addr):
+        sub = self._subscribers.pop(addr)
+        sub.close()
+        self.fanout.detach(sub)
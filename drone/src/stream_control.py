@@ -0,0 +1,374 @@
+"""
+Adaptive encoder control on the drone, driven by receiver feedback from the GCS.
+
+The GCS keeps a TCP connection to the control port (streaming port + 1 by default,
+see GCS/stream_feedback.py) and sends one JSON line every ~0.5 s:
+
+    {"type": "feedback", "throughput_kbps": .., "queue_delay_ms": .., "decode_lag_ms": ..,
+     "loss": .., "frame_rate": .., "processing": {"queue_depth": .., "frames_dropped": ..}}
+
+plus {"type": "keyframe"} after loss and {"type": "set", ...} for manual overrides.
+The drone answers with {"type": "state", "bitrate", "resolution", "keyframe_interval",
+"adaptive", "reason"} whenever something changes, and every STATE_INTERVAL seconds.
+
+BitrateController decides, from the worst fresh report and from the fan-out's own
+send buffers (a backlog there means the link is slower than the encoder):
+
+ - congestion (queueing delay or decode lag growing, loss, client buffers backing
+   up): bitrate drops to 3/4, and below what actually arrived, at most once per
+   DECREASE_INTERVAL. The GCS's processing backlog ('processing') is not congestion:
+   a slow detector on a clean link must not cost video quality;
+ - no congestion for PROBE_DELAY seconds: bitrate grows by PROBE_STEP per second up
+   to the configured maximum;
+ - resolution follows bits per pixel: one rung down the ladder when the bitrate is
+   too low for the current size (blocky), one up once the higher size would get
+   enough, at most once per RESOLUTION_HOLD seconds, since changing size restarts
+   the encoder.
+
+Bitrate and forced keyframes go to the running hardware encoder; a resolution
+change restarts it into the same fan-out (see VideoStreamer).
+"""
+
+import json
+import socket
+import time
+from threading import Lock, Thread
+
+# a receiver report older than this is ignored
+REPORT_MAX_AGE = 2.0
+# congestion thresholds on the GCS link signals
+QUEUE_DELAY_MS = 150.0
+DECODE_LAG_MS = 200.0
+# share of a client's send buffer queued on the drone that counts as a backlog
+BACKLOG_SHARE = 0.25
+DECREASE_FACTOR = 0.75
+# never ask for more than this share of the measured throughput when backing off
+THROUGHPUT_SHARE = 0.9
+DECREASE_INTERVAL = 1.0
+PROBE_DELAY = 3.0
+PROBE_STEP = 0.08
+MIN_BITRATE = 300_000
+# bits per pixel per frame: below LOW the picture breaks up, HIGH is plenty for a smaller size
+BPP_LOW = 0.04
+BPP_HIGH = 0.08
+RESOLUTION_HOLD = 10.0
+# scales of the configured resolution the controller may use, largest first
+LADDER_SCALES = (1.0, 0.75, 0.5)
+DEFAULT_FRAME_RATE = 30.0
+KEYFRAME_MIN_INTERVAL = 1.0
+TICK = 0.5
+STATE_INTERVAL = 2.0
+
+
+def _ladder(resolution, scales=LADDER_SCALES):
+    # even dimensions, as the encoder needs for YUV420
+    return [(int(resolution[0] * s) // 2 * 2, int(resolution[1] * s) // 2 * 2) for s in scales]
+
+
+class BitrateController:
+    """
+    Args:
+        bitrate (int): starting and maximum bitrate (bit/s).
+        resolution (tuple): starting and largest (width, height).
+        min_bitrate (int): floor for the bitrate.
+    """
+
+    def __init__(self, bitrate, resolution, min_bitrate=MIN_BITRATE):
+        self.max_bitrate = bitrate
+        self.min_bitrate = min(min_bitrate, bitrate)
+        self.bitrate = bitrate
+        self.ladder = _ladder(resolution)
+        self.rung = 0
+        now = time.monotonic()
+        self._last_decrease = 0.0
+        self._clear_since = now
+        self._last_probe = now
+        self._last_resize = now
+
+    @property
+    def resolution(self):
+        return self.ladder[self.rung]
+
+    def reset(self, bitrate=None, resolution=None):
+        """Manual settings: the bitrate becomes the new ceiling, the resolution the top of the ladder."""
+        if bitrate is not None:
+            self.max_bitrate = bitrate
+            self.min_bitrate = min(self.min_bitrate, bitrate)
+            self.bitrate = bitrate
+        if resolution is not None:
+            self.ladder = _ladder(resolution)
+            self.rung = 0
+        now = time.monotonic()
+        self._clear_since = self._last_probe = self._last_resize = now
+
+    def congestion(self, reports, backlog, send_losses):
+        """Why the link looks congested (a short reason), or None."""
+        if backlog >= BACKLOG_SHARE:
+            return f"drone send buffer {backlog:.0%} full"
+        if send_losses:
+            return f"{send_losses} send drops on the drone"
+        for r in reports:
+            if r.get('loss'):
+                return f"{r['loss']} losses at the GCS"
+            if (r.get('queue_delay_ms') or 0) > QUEUE_DELAY_MS:
+                return f"queueing delay {r['queue_delay_ms']:.0f} ms"
+            if (r.get('decode_lag_ms') or 0) > DECODE_LAG_MS:
+                return f"decode lag {r['decode_lag_ms']:.0f} ms"
+        return None
+
+    def update(self, reports, backlog=0.0, send_losses=0):
+        """
+        Next (bitrate, resolution, reason); reason is None when nothing changed.
+
+        Args:
+            reports (list): fresh receiver reports, one per GCS connection.
+            backlog (float): fullest client send buffer on the drone, as a share of its size.
+            send_losses (int): client buffer overflows and dropped datagrams since the last call.
+        """
+        now = time.monotonic()
+        reason = None
+        cause = self.congestion(reports, backlog, send_losses)
+        if cause is not None:
+            self._clear_since = now
+            if now - self._last_decrease >= DECREASE_INTERVAL:
+                target = self.bitrate * DECREASE_FACTOR
+                throughputs = [r['throughput_kbps'] * 1000 for r in reports if r.get('throughput_kbps')]
+                if throughputs:
+                    target = min(target, THROUGHPUT_SHARE * min(throughputs))
+                target = max(self.min_bitrate, int(target))
+                if target < self.bitrate:
+                    self.bitrate = target
+                    reason = cause
+                self._last_decrease = now
+            self._last_probe = now
+        elif (now - self._clear_since >= PROBE_DELAY and now - self._last_probe >= 1.0
+              and self.bitrate < self.max_bitrate):
+            self.bitrate = min(self.max_bitrate, int(self.bitrate * (1 + PROBE_STEP)))
+            self._last_probe = now
+            reason = 'probing'
+
+        if now - self._last_resize >= RESOLUTION_HOLD:
+            rates = [r['frame_rate'] for r in reports if r.get('frame_rate')]
+            fps = max(rates) if rates else DEFAULT_FRAME_RATE
+            width, height = self.resolution
+            if self.rung + 1 < len(self.ladder) and self.bitrate / (width * height * fps) < BPP_LOW:
+                self.rung += 1
+                self._last_resize = now
+                reason = f"{reason or 'low bitrate'}, {self.bitrate / (width * height * fps):.3f} bits/pixel"
+            elif self.rung > 0:
+                width, height = self.ladder[self.rung - 1]
+                if cause is None and self.bitrate / (width * height * fps) >= BPP_HIGH:
+                    self.rung -= 1
+                    self._last_resize = now
+                    reason = reason or 'bitrate allows a larger picture'
+        return self.bitrate, self.resolution, reason
+
+
+class _Connection:
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.report = None
+        self.report_at = 0.0
+        self._send_lock = Lock()
+
+    def send(self, message):
+        try:
+            with self._send_lock:
+                self.conn.sendall((json.dumps(message, separators=(',', ':')) + '\n').encode())
+        except OSError:
+            pass
+
+
+class ControlServer:
+    """
+    Args:
+        streamer (VideoStreamer): the encoder to control.
+        port (int): TCP port the GCS connects to.
+        adaptive (bool): let the controller change bitrate and resolution (off by default; a
+            'set' message with "adaptive" switches it); manual settings always apply.
+        max_connections (int): further connections are refused.
+    """
+
+    def __init__(self, streamer, port, adaptive=False, max_connections=4):
+        self.streamer = streamer
+        self.port = port
+        self.adaptive = adaptive
+        self.max_connections = max_connections
+        self.controller = BitrateController(streamer.bitrate, streamer.resolution)
+
+        self.server_socket = None
+        self._connections = []
+        self._lock = Lock()
+        self._running = False
+        self._threads = []
+        self._last_keyframe = 0.0
+        self._last_losses = 0
+        self._reason = None
+
+    def start(self):
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind(("0.0.0.0", self.port))
+        self.server_socket.listen(self.max_connections)
+        self.server_socket.settimeout(1.0)
+        self._running = True
+        self._threads = [Thread(target=self._accept_loop, daemon=True), Thread(target=self._control_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        print(f"[Control] Ready on port {self.port}")
+
+    def stop(self):
+        self._running = False
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        with self._lock:
+            connections = list(self._connections)
+        for c in connections:
+            try:
+                c.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        try:
+            self.server_socket.close()
+        except OSError:
+            pass
+
+    # ---------------------------------------------
+    # CONNECTIONS
+    # ---------------------------------------------
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn, addr = self.server_socket.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            with self._lock:
+                if len(self._connections) >= self.max_connections:
+                    conn.close()
+                    continue
+                connection = _Connection(conn, addr)
+                self._connections.append(connection)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            print(f"[Control] GCS connected from {addr[0]}:{addr[1]}")
+            connection.send(self.state())
+            Thread(target=self._read_loop, args=(connection,), daemon=True).start()
+
+    def _read_loop(self, connection):
+        buffer = b''
+        try:
+            while self._running:
+                data = connection.conn.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue
+                    self._handle(connection, message)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+            connection.conn.close()
+            print(f"[Control] GCS {connection.addr[0]}:{connection.addr[1]} disconnected")
+
+    def _handle(self, connection, message):
+        kind = message.get('type')
+        if kind == 'feedback':
+            connection.report = message
+            connection.report_at = time.monotonic()
+        elif kind == 'keyframe':
+            now = time.monotonic()
+            # every GCS connection has its own reader thread
+            with self._lock:
+                due = now - self._last_keyframe >= KEYFRAME_MIN_INTERVAL
+                if due:
+                    self._last_keyframe = now
+            if due:
+                self.streamer.request_keyframe()
+        elif kind == 'set':
+            self._apply_settings(message)
+
+    def _apply_settings(self, message):
+        try:
+            bitrate = int(message['bitrate']) if message.get('bitrate') is not None else None
+            interval = int(message['keyframe_interval']) if message.get('keyframe_interval') is not None else None
+            resolution = tuple(int(v) for v in message['resolution']) if message.get('resolution') else None
+        except (TypeError, ValueError):
+            print(f"[Control] Ignoring invalid settings: {message}")
+            return
+        if message.get('adaptive') is not None:
+            self.adaptive = bool(message['adaptive'])
+        if bitrate is not None:
+            self.streamer.set_bitrate(bitrate)
+        if interval is not None:
+            self.streamer.set_keyframe_interval(interval)
+        if resolution is not None:
+            self.streamer.set_resolution(resolution)
+        self.controller.reset(bitrate, resolution)
+        self._reason = 'set by GCS'
+        print(f"[Control] Settings from GCS: {self.state()}")
+        self._broadcast(self.state())
+
+    # ---------------------------------------------
+    # ADAPTATION
+    # ---------------------------------------------
+    def _control_loop(self):
+        last_state = 0.0
+        while self._running:
+            time.sleep(TICK)
+            now = time.monotonic()
+            with self._lock:
+                reports = [c.report for c in self._connections
+                           if c.report is not None and now - c.report_at <= REPORT_MAX_AGE]
+            changed = False
+            if self.adaptive and reports:
+                backlog, losses = self._send_pressure()
+                bitrate, resolution, reason = self.controller.update(reports, backlog, losses)
+                if reason is not None:
+                    changed = True
+                    self._reason = reason
+                    # bitrate first, so a restarted encoder starts with it
+                    if bitrate != self.streamer.bitrate:
+                        self.streamer.set_bitrate(bitrate)
+                    if resolution != tuple(self.streamer.resolution):
+                        print(f"[Control] Resolution {resolution[0]}x{resolution[1]} ({reason})")
+                        self.streamer.set_resolution(resolution)
+            if changed or now - last_state >= STATE_INTERVAL:
+                self._broadcast(self.state())
+                last_state = now
+
+    def _send_pressure(self):
+        """Fullest client buffer (share of its size) and new overflows/send drops across the fan-out."""
+        stats = self.streamer.stats()
+        backlog = max((c.get('queued_bytes', 0) / self.streamer.client_buffer for c in stats['clients']), default=0.0)
+        losses = sum(c.get('overflows', 0) + c.get('send_drops', 0) for c in stats['clients'])
+        # counters restart with each client; only growth counts
+        new = max(0, losses - self._last_losses)
+        self._last_losses = losses
+        return backlog, new
+
+    def _broadcast(self, message):
+        with self._lock:
+            connections = list(self._connections)
+        for c in connections:
+            c.send(message)
+
+    def state(self):
+        return {
+            'type': 'state',
+            'bitrate': self.streamer.bitrate,
+            'resolution': list(self.streamer.resolution),
+            'keyframe_interval': self.streamer.keyframe_interval,
+            'adaptive': self.adaptive,
+            'reason': self._reason,
+        }
@@ -0,0 +1,337 @@
+"""
+Fan-out of one encoded MPEG-TS stream to several clients (TCP, or RTP via rtp_transport.py).
+
+The encoder runs once; its muxed output is fed to TsFanout in arbitrary chunks and
+split into 188-byte TS packets. Only packet headers are inspected:
+
+ - PAT (PID 0) and the PMT it points to are cached, and the PMT gives the video PID.
+ - A video packet that starts a PES with the random access indicator set (or an IDR/SPS
+   NAL in its payload) starts a new GOP. With picamera2's repeated inline headers the
+   access unit begins with SPS/PPS, so the cached GOP is decodable on its own.
+
+Each client has a bounded buffer and its own sender thread, so a slow link never
+blocks the encoder or the other clients. A new client starts with PAT + PMT + the
+cached current GOP and sees video immediately. A client whose buffer overflows has it
+cleared and resumes at the next keyframe, dropping whole GOPs instead of corrupting
+frames or stalling.
+"""
+
+import socket
+from collections import deque
+from threading import Condition, Lock, Thread
+
+TS_PACKET_SIZE = 188
+_SYNC = 0x47
+_PAT_PID = 0
+# stream_type values of H.264 / HEVC video in the PMT
+_VIDEO_STREAM_TYPES = (0x1B, 0x24)
+
+
+def _pid(pkt):
+    return ((pkt[1] & 0x1F) << 8) | pkt[2]
+
+
+def _payload(pkt):
+    """Payload of a TS packet (after the adaptation field), or b'' if it has none."""
+    afc = (pkt[3] >> 4) & 0x3
+    if afc == 2:
+        return b''
+    if afc == 3:
+        return pkt[5 + pkt[4]:]
+    return pkt[4:]
+
+
+def _random_access(pkt):
+    # adaptation field present, non-empty and random_access_indicator set
+    return (pkt[3] & 0x20) and pkt[4] > 0 and (pkt[5] & 0x40)
+
+
+def _has_idr(payload):
+    # Annex B start code followed by an SPS (7) or IDR slice (5) NAL header
+    for nal in (b'\x00\x00\x01\x67', b'\x00\x00\x01\x65', b'\x00\x00\x01\x27', b'\x00\x00\x01\x25'):
+        if nal in payload:
+            return True
+    return False
+
+
+def _section(pkt):
+    """PSI section of a packet that starts one (pointer field skipped)."""
+    payload = _payload(pkt)
+    if not payload:
+        return b''
+    return payload[1 + payload[0]:]
+
+
+class _Client:
+    def __init__(self, conn, addr, max_buffer, on_close):
+        self.conn = conn
+        self.addr = addr
+        self.max_buffer = max_buffer
+        self._on_close = on_close
+
+        self._queue = deque()
+        self._queued = 0
+        self._cond = Condition()
+        self._closed = False
+        # waiting for a keyframe before anything can be sent
+        self.waiting = True
+
+        self.bytes_sent = 0
+        self.overflows = 0
+        self.bytes_skipped = 0
+
+        self.thread = Thread(target=self._send_loop, daemon=True)
+
+    def offer(self, data, keyframe, header):
+        """Queues a run of TS packets; data starts with a keyframe when keyframe is True."""
+        with self._cond:
+            if self._closed:
+                return
+            if self.waiting:
+                if not keyframe:
+                    self.bytes_skipped += len(data)
+                    return
+                self.waiting = False
+                data = header + data
+            if self._queued + len(data) > self.max_buffer:
+                # lagging: drop everything queued and resume at the next keyframe
+                self.overflows += 1
+                self.bytes_skipped += self._queued + len(data)
+                self._queue.clear()
+                self._queued = 0
+                self.waiting = True
+                return
+            self._queue.append(data)
+            self._queued += len(data)
+            self._cond.notify()
+
+    def _send_loop(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    data = b''.join(self._queue)
+                    self._queue.clear()
+                    self._queued = 0
+                self.conn.sendall(data)
+                self.bytes_sent += len(data)
+        except OSError:
+            pass
+        finally:
+            self.close()
+            self._on_close(self)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.conn.close()
+
+    def stats(self):
+        with self._cond:
+            queued = self._queued
+        return {
+            'addr': f"{self.addr[0]}:{self.addr[1]}",
+            'bytes_sent': self.bytes_sent,
+            'queued_bytes': queued,
+            'overflows': self.overflows,
+            'bytes_skipped': self.bytes_skipped,
+            'waiting_keyframe': self.waiting,
+        }
+
+
+class TsFanout:
+    """
+    Args:
+        max_client_buffer (int): bytes queued per client before it is dropped to the next keyframe.
+        max_gop_bytes (int): largest GOP kept for new clients; longer GOPs make them wait for a keyframe.
+        send_timeout (float): seconds a blocked send may take before the client is disconnected.
+    """
+
+    def __init__(self, max_client_buffer=2_000_000, max_gop_bytes=4_000_000, send_timeout=5.0):
+        self.max_client_buffer = max_client_buffer
+        self.max_gop_bytes = max_gop_bytes
+        self.send_timeout = send_timeout
+
+        self._lock = Lock()
+        self._clients = []
+        self._partial = b''
+        self._pat = b''
+        self._pmt = b''
+        self._pmt_pid = None
+        self.video_pid = None
+        # TS packets from the latest keyframe on; None until the first keyframe or after an oversized GOP
+        self._gop = None
+        self._gop_bytes = 0
+
+        self.packets = 0
+        self.keyframes = 0
+        self.resyncs = 0
+        self.restarts = 0
+
+    # ---------------------------------------------
+    # CLIENTS
+    # ---------------------------------------------
+    def add_client(self, conn, addr):
+        """Attaches a TCP client; it starts with the cached GOP."""
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.settimeout(self.send_timeout)
+        client = _Client(conn, addr, self.max_client_buffer, self.detach)
+        self.attach(client)
+        client.thread.start()
+        return client
+
+    def attach(self, sink, prefill=True):
+        """
+        Adds a sink with offer(data, keyframe, header), close() and stats() (e.g. an RTP subscriber).
+
+        Args:
+            prefill (bool): hand it the cached GOP now; otherwise it starts at the next keyframe.
+        """
+        with self._lock:
+            if prefill and self._gop is not None:
+                sink.offer(b''.join(self._gop), True, self._pat + self._pmt)
+            self._clients.append(sink)
+
+    def detach(self, sink):
+        with self._lock:
+            if sink not in self._clients:
+                return
+            self._clients.remove(sink)
+        stats = sink.stats()
+        print(f"[Fanout] Client {stats['addr']} disconnected "
+              f"({stats['bytes_sent']} bytes sent, {stats.get('overflows', 0)} overflows)")
+
+    @property
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+
+    # ---------------------------------------------
+    # INPUT
+    # ---------------------------------------------
+    def restart_input(self):
+        """
+        Forgets the current stream before a new encoder output is fed (e.g. after a
+        resolution change). Clients stay attached and continue at its first keyframe,
+        whose PAT/PMT and SPS/PPS describe the new stream.
+        """
+        with self._lock:
+            self._partial = b''
+            self._pat = b''
+            self._pmt = b''
+            self._pmt_pid = None
+            self.video_pid = None
+            self._gop, self._gop_bytes = None, 0
+            self.restarts += 1
+
+    def feed(self, data):
+        """Takes the next bytes of the muxed stream, in any chunk size."""
+        data = self._partial + data
+        n = len(data)
+        pos = 0
+        # runs of packets split at keyframe starts: [(starts_with_keyframe, [packets])]
+        runs = [(False, [])]
+        while pos + TS_PACKET_SIZE <= n:
+            if data[pos] != _SYNC:
+                nxt = data.find(bytes([_SYNC]), pos + 1)
+                self.resyncs += 1
+                pos = nxt if nxt >= 0 else n
+                continue
+            pkt = data[pos:pos + TS_PACKET_SIZE]
+            pos += TS_PACKET_SIZE
+            self.packets += 1
+
+            pid = _pid(pkt)
+            unit_start = pkt[1] & 0x40
+            if pid == self.video_pid and unit_start and (_random_access(pkt) or _has_idr(_payload(pkt))):
+                self.keyframes += 1
+                runs.append((True, [pkt]))
+                continue
+            if pid == _PAT_PID and unit_start:
+                self._parse_pat(pkt)
+            elif pid == self._pmt_pid and unit_start:
+                self._parse_pmt(pkt)
+            runs[-1][1].append(pkt)
+        self._partial = data[pos:]
+
+        with self._lock:
+            clients = list(self._clients)
+            for keyframe, packets in runs:
+                if not packets:
+                    continue
+                self._cache(keyframe, packets)
+                chunk = b''.join(packets)
+                header = self._pat + self._pmt
+                for client in clients:
+                    client.offer(chunk, keyframe, header)
+
+    def _cache(self, keyframe, packets):
+        if keyframe:
+            self._gop, self._gop_bytes = [], 0
+        if self._gop is None:
+            return
+        self._gop.extend(packets)
+        self._gop_bytes += len(packets) * TS_PACKET_SIZE
+        if self._gop_bytes > self.max_gop_bytes:
+            self._gop, self._gop_bytes = None, 0
+
+    def _parse_pat(self, pkt):
+        section = _section(pkt)
+        if len(section) < 12 or section[0] != 0x00:
+            return
+        self._pat = pkt
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        # program loop between the 8-byte header and the CRC
+        for i in range(8, min(3 + length - 4, len(section) - 3), 4):
+            program = (section[i] << 8) | section[i + 1]
+            if program != 0:
+                self._pmt_pid = ((section[i + 2] & 0x1F) << 8) | section[i + 3]
+                return
+
+    def _parse_pmt(self, pkt):
+        section = _section(pkt)
+        if len(section) < 16 or section[0] != 0x02:
+            return
+        self._pmt = pkt
+        length = ((section[1] & 0x0F) << 8) | section[2]
+        end = min(3 + length - 4, len(section))
+        i = 12 + (((section[10] & 0x0F) << 8) | section[11])
+        while i + 5 <= end:
+            stream_type = section[i]
+            pid = ((section[i + 1] & 0x1F) << 8) | section[i + 2]
+            if stream_type in _VIDEO_STREAM_TYPES:
+                self.video_pid = pid
+                return
+            i += 5 + (((section[i + 3] & 0x0F) << 8) | section[i + 4])
+
+    # ---------------------------------------------
+    # STATUS
+    # ---------------------------------------------
+    def stats(self):
+        with self._lock:
+            clients = [c.stats() for c in self._clients]
+            gop_bytes = self._gop_bytes if self._gop is not None else None
+        return {
+            'packets': self.packets,
+            'keyframes': self.keyframes,
+            'resyncs': self.resyncs,
+            'restarts': self.restarts,
+            'gop_bytes': gop_bytes,
+            'clients': clients,
+        }
@@ -1,19 +1,110 @@
+import fcntl
+import os
 import socket
-from threading import Event, Thread
+import struct
+import time
+from threading import Event, RLock, Thread
 from picamera2 import Picamera2
 from picamera2.encoders import H264Encoder
 from picamera2.outputs import PyavOutput
 
+from rtp_transport import RtpServer
+from stream_control import ControlServer
+from stream_fanout import TsFanout
+
+TRANSPORTS = ('tcp', 'rtp', 'both')
+
+# V4L2 controls of the hardware H.264 encoder, set while it runs
+# (VIDIOC_S_CTRL with struct v4l2_control {__u32 id; __s32 value})
+_VIDIOC_S_CTRL = 0xC008561C
+_CID_MPEG_BASE = 0x00990900
+_CID_BITRATE = _CID_MPEG_BASE + 207
+_CID_FORCE_KEY_FRAME = _CID_MPEG_BASE + 229
+_CID_H264_I_PERIOD = _CID_MPEG_BASE + 358
+
+
+class WallClockPyavOutput(PyavOutput):
+    """
+    PyavOutput that stamps every packet with its capture time in wall-clock microseconds.
+
+    picamera2 hands outputs timestamps relative to the first frame's sensor timestamp
+    (CLOCK_BOOTTIME). Adding that first timestamp back and the boot-to-wall-clock offset
+    gives time.time() at capture. The MPEG-TS muxer keeps this as the 90 kHz PTS (modulo
+    2^33, about 26.5 hours); mpegts_copyts stops it from adding its own delay. The GCS
+    turns the PTS back into a capture time (CAPTURE_TIMESTAMPS in GCS/stream_session.py)
+    to measure network and glass-to-glass latency, so both clocks must be synced (NTP/chrony).
+    """
+
+    def __init__(self, output_name, encoder, format=None, options=None):
+        super().__init__(output_name, format=format, options=dict(options or {}, mpegts_copyts='1'))
+        self._encoder = encoder
+        self._offset_us = None
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        first = self._encoder.firsttimestamp
+        if timestamp is not None and not audio and first is not None:
+            if self._offset_us is None:
+                self._offset_us = int((time.time() - time.clock_gettime(time.CLOCK_BOOTTIME)) * 1_000_000)
+            timestamp = first + timestamp + self._offset_us
+        super().outputframe(frame, keyframe, timestamp, packet, audio)
+
 
 class VideoStreamer:
-    def __init__(self, port=8888, resolution=(1280, 720), bitrate=10_000_000):
+    """
+    Encodes the camera once and serves the MPEG-TS to up to max_clients clients.
+
+    The encoder keeps running while the streamer is started, independent of clients:
+    its output goes through a pipe into a TsFanout (see stream_fanout.py), which gives
+    each client its own bounded buffer and starts new clients at the latest keyframe.
+
+    transport selects how clients connect on `port`: 'tcp' (GCS connects), 'rtp'
+    (GCS subscribes over UDP and gets RTP, see rtp_transport.py) or 'both'.
+
+    With control, a ControlServer on control_port (default port + 1) takes keyframe
+    requests and manual settings from the GCS (see stream_control.py). With adaptive
+    (off by default) it also adapts bitrate and resolution to the link from the GCS's
+    receiver feedback; bitrate and resolution are then the ceilings. Adaptation needs
+    the feedback turned on at the GCS too (GCS_ENCODER_FEEDBACK=1), and can also be
+    switched on at runtime (POST /streams/{id}/encoder?adaptive=true on the GCS). Bitrate, keyframe interval and forced keyframes
+    are set on the running encoder; a resolution change restarts the encoder into the
+    same fan-out, so connected clients stay connected.
+
+    With capture_timestamps, each frame's PTS is its wall-clock capture time (see
+    WallClockPyavOutput). Off by default, like CAPTURE_TIMESTAMPS in the GCS's
+    stream_session.py: turn both on together, on clock-synced machines, to measure
+    network and glass-to-glass latency.
+    """
+
+    def __init__(self, port=8888, resolution=(1280, 720), bitrate=10_000_000, capture_timestamps=False,
+                 max_clients=4, client_buffer=2_000_000, transport='tcp', keyframe_interval=None,
+                 control=True, control_port=None, adaptive=False):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"transport must be one of {TRANSPORTS}")
         self.port = port
         self.resolution = resolution
         self.bitrate = bitrate
+        # send wall-clock capture times as PTS (see WallClockPyavOutput)
+        self.capture_timestamps = capture_timestamps
+        self.max_clients = max_clients
+        self.client_buffer = client_buffer
+        self.transport = transport
+        # frames between keyframes; None keeps the encoder's default
+        self.keyframe_interval = keyframe_interval
+        self.control = control
+        self.control_port = control_port if control_port is not None else port + 1
+        self.adaptive = adaptive
 
         self.picam2 = None
         self.encoder = None
+        self.output = None
         self.server_socket = None
+        self.fanout = None
+        self.rtp_server = None
+        self._pipe = None
+        self.pump_thread = None
+        self.control_server = None
+        # serializes encoder reconfiguration (control server) with start/stop
+        self._encoder_lock = RLock()
 
         self.stop_event = Event()
         self.thread = None
@@ -24,13 +115,19 @@ class VideoStreamer:
     # ---------------------------------------------
     def _init_camera(self):
         self.picam2 = Picamera2()
+        self._configure_camera()
+        self.encoder = self._make_encoder()
+
+    def _configure_camera(self):
         video_config = self.picam2.create_video_configuration(
-            main={"size": self.resolution, "format": "YUV420"}
+            main={"size": tuple(self.resolution), "format": "YUV420"}
         )
         self.picam2.configure(video_config)
 
-        self.encoder = H264Encoder(bitrate=self.bitrate)
-        self.encoder.audio = False
+    def _make_encoder(self):
+        encoder = H264Encoder(bitrate=self.bitrate, iperiod=self.keyframe_interval)
+        encoder.audio = False
+        return encoder
 
     def _init_socket(self):
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -38,30 +135,110 @@ class VideoStreamer:
         self.server_socket.bind(("0.0.0.0", self.port))
 
     # ---------------------------------------------
-    # STREAM ONE CLIENT
+    # ENCODE ONCE INTO THE FAN-OUT
     # ---------------------------------------------
-    def _stream_to_client(self, conn):
-        print(f"[Streamer] Streaming to {conn.getpeername()}")
+    def _start_encoder(self):
+        # fresh fan-out state: nothing cached from a previous encoder run
+        self.fanout = TsFanout(max_client_buffer=self.client_buffer)
+        self._open_output()
 
-        output = PyavOutput(f"pipe:{conn.fileno()}", format="mpegts")
-        disconnect_event = Event()
-        output.error_callback = lambda e: disconnect_event.set()
+    def _open_output(self):
+        read_fd, write_fd = os.pipe()
+        self._pipe = (read_fd, write_fd)
 
-        self.picam2.start_recording(self.encoder, output)
+        if self.capture_timestamps:
+            self.output = WallClockPyavOutput(f"pipe:{write_fd}", self.encoder, format="mpegts")
+        else:
+            self.output = PyavOutput(f"pipe:{write_fd}", format="mpegts")
+        self.output.error_callback = lambda e: print(f"[Streamer] Output error: {e}")
 
+        self.pump_thread = Thread(target=self._pump, args=(read_fd,), daemon=True)
+        self.pump_thread.start()
+        self.picam2.start_recording(self.encoder, self.output)
+
+    def _pump(self, read_fd):
+        # the pipe must always be drained, so slow clients can never block the encoder
+        while True:
+            try:
+                data = os.read(read_fd, 65536)
+            except OSError:
+                break
+            if not data:
+                break
+            self.fanout.feed(data)
+
+    def _stop_encoder(self):
+        print("[Streamer] Stopping recording...")
         try:
-            while not self.stop_event.is_set() and not disconnect_event.is_set():
-                self.stop_event.wait(0.1)
-        finally:
-            print("[Streamer] Stopping recording...")
             self.picam2.stop_recording()
+        except Exception as e:
+            print(f"[Streamer] Error stopping recording: {e}")
+        read_fd, write_fd = self._pipe
+        # closing the write end ends the pump with EOF
+        os.close(write_fd)
+        if self.pump_thread:
+            self.pump_thread.join(2.0)
+        os.close(read_fd)
+        self._pipe = None
+
+    # ---------------------------------------------
+    # ENCODER SETTINGS (any thread, while running)
+    # ---------------------------------------------
+    def _set_control(self, cid, value):
+        """Sets a V4L2 control on the running encoder; False if there is none or the driver refuses."""
+        vd = getattr(self.encoder, 'vd', None) if self.running else None
+        if vd is None:
+            return False
+        try:
+            fcntl.ioctl(vd, _VIDIOC_S_CTRL, struct.pack('Ii', cid, value))
+            return True
+        except OSError as e:
+            print(f"[Streamer] Encoder control {cid:#x} = {value} failed: {e}")
+            return False
+
+    def set_bitrate(self, bitrate):
+        with self._encoder_lock:
+            self.bitrate = bitrate
+            if self.encoder is not None:
+                self.encoder.bitrate = bitrate
+            if self.running and not self._set_control(_CID_BITRATE, bitrate):
+                print("[Streamer] Bitrate applies when the encoder restarts")
+
+    def set_keyframe_interval(self, frames):
+        with self._encoder_lock:
+            self.keyframe_interval = frames
+            if self.encoder is not None:
+                self.encoder.iperiod = frames
+            if self.running and not self._set_control(_CID_H264_I_PERIOD, frames):
+                print("[Streamer] Keyframe interval applies when the encoder restarts")
+
+    def request_keyframe(self):
+        """Makes the next frame an IDR frame, so receivers can resync without waiting a GOP."""
+        with self._encoder_lock:
+            return self._set_control(_CID_FORCE_KEY_FRAME, 1)
+
+    def set_resolution(self, resolution):
+        """Restarts camera and encoder at the new size; clients resume at its first keyframe."""
+        with self._encoder_lock:
+            resolution = tuple(resolution)
+            if resolution == tuple(self.resolution):
+                return
+            self.resolution = resolution
+            if not self.running:
+                return
+            print(f"[Streamer] Switching to {resolution[0]}x{resolution[1]}...")
+            self._stop_encoder()
+            self._configure_camera()
+            self.encoder = self._make_encoder()
+            self.fanout.restart_input()
+            self._open_output()
 
     # ---------------------------------------------
     # ACCEPT CLIENTS FOREVER (UNTIL STOP EVENT)
     # ---------------------------------------------
     def _connection_loop(self):
         print(f"[Streamer] Ready on port {self.port}")
-        self.server_socket.listen(1)
+        self.server_socket.listen(self.max_clients)
 
         while not self.stop_event.is_set():
             try:
@@ -70,10 +247,13 @@ class VideoStreamer:
             except socket.timeout:
                 continue
 
+            if self.fanout.client_count >= self.max_clients:
+                print(f"[Streamer] Rejecting {addr[0]}:{addr[1]}: {self.max_clients} clients already connected")
+                conn.close()
+                continue
+
             print(f"[Streamer] Connected to {addr[0]}:{addr[1]}")
-            self._stream_to_client(conn)
-            conn.close()
-            print("[Streamer] Client disconnected. Waiting again...")
+            self.fanout.add_client(conn, addr)
 
         print("[Streamer] Server stopped. Exiting loop.")
 
@@ -88,12 +268,21 @@ class VideoStreamer:
         print("[Streamer] Starting video streamer...")
 
         self.stop_event.clear()
-        self._init_camera()
-        self._init_socket()
+        with self._encoder_lock:
+            self._init_camera()
+            self._start_encoder()
 
-        self.thread = Thread(target=self._connection_loop, daemon=True)
-        self.thread.start()
+        if self.transport in ('tcp', 'both'):
+            self._init_socket()
+            self.thread = Thread(target=self._connection_loop, daemon=True)
+            self.thread.start()
+        if self.transport in ('rtp', 'both'):
+            self.rtp_server = RtpServer(self.fanout, self.port, self.max_clients)
+            self.rtp_server.start()
         self.running = True
+        if self.control:
+            self.control_server = ControlServer(self, self.control_port, self.adaptive)
+            self.control_server.start()
 
     # ---------------------------------------------
     # PUBLIC: STOP STREAMING
@@ -107,13 +296,27 @@ class VideoStreamer:
 
         self.stop_event.set()
 
+        if self.control_server:
+            self.control_server.stop()
+            self.control_server = None
         if self.thread:
             self.thread.join()
+            self.thread = None
+        if self.rtp_server:
+            self.rtp_server.stop()
+            self.rtp_server = None
 
-        try:
-            self.server_socket.close()
-        except:
-            pass
+        with self._encoder_lock:
+            self._stop_encoder()
+            self.running = False
+        self.fanout.close()
+
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+            self.server_socket = None
 
         try:
             self.picam2.close()
@@ -123,6 +326,12 @@ class VideoStreamer:
         self.running = False
         print("[Streamer] Stopped successfully.")
 
+    # ---------------------------------------------
+    # STATUS
+    # ---------------------------------------------
+    def stats(self):
+        return self.fanout.stats()
+
     # ---------------------------------------------
     # RESTART
     # ---------------------------------------------